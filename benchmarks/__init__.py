@@ -0,0 +1,7 @@
+"""
+Offline performance benchmarks for the SustainBench data loaders.
+Each benchmark generates small synthetic datasets in a temporary directory,
+so no downloaded data is needed. Run a benchmark as a module, e.g.
+
+    python -m benchmarks.kenya_index_scaling
+"""
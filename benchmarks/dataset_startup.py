@@ -0,0 +1,64 @@
+"""
+Measures the construction time of datasets whose constructors build splits
+and metadata from a large metadata table. These datasets are instantiated once
+per fold and seed in sweeps, so their startup time adds up.
+
+    python -m benchmarks.dataset_startup --n_rows 10000 100000 --repeats 5
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import poverty_folds, write_fmow_fixture, write_poverty_fixture
+
+
+def time_construction(dataset_cls, repeats, **kwargs):
+    """
+    Output:
+        - times (np.ndarray): Construction time of each repeat in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        dataset_cls(**kwargs)
+        times.append(time.perf_counter() - start)
+    return np.asarray(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--n_rows', nargs='*', type=int, default=[10000, 100000],
+        help='Numbers of metadata rows to benchmark.')
+    parser.add_argument(
+        '--repeats', type=int, default=5,
+        help='Number of constructions to time per configuration.')
+    config = parser.parse_args()
+
+    from sustainbench.datasets.fmow_dataset import FMoWDataset
+    from sustainbench.datasets.poverty_dataset import PovertyMapDataset
+
+    print(f'{"dataset":>8} {"rows":>8} {"mean (s)":>9} {"min (s)":>9}')
+    n_failed = 0
+    for n_rows in config.n_rows:
+        with tempfile.TemporaryDirectory() as data_dir, poverty_folds():
+            # images are never read during construction
+            write_fmow_fixture(data_dir, n_images=n_rows, write_images=False)
+            write_poverty_fixture(data_dir, n_images=n_rows, write_images=False)
+            for name, dataset_cls in [('fmow', FMoWDataset), ('poverty', PovertyMapDataset)]:
+                try:
+                    times = time_construction(dataset_cls, config.repeats, root_dir=data_dir)
+                except Exception as e:
+                    print(f'{name:>8} {n_rows:>8} failed: {type(e).__name__}: {e}')
+                    n_failed += 1
+                    continue
+                print(f'{name:>8} {n_rows:>8} {times.mean():>9.3f} {times.min():>9.3f}')
+    if n_failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Writers for small synthetic datasets that match the on-disk layout expected
+by the SustainBench dataset classes.
+"""
+from contextlib import contextmanager
+import json
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+
+@contextmanager
+def working_directory(path):
+    """
+    Temporarily changes the working directory. Some datasets read archives
+    relative to the working directory.
+    """
+    prev = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(prev)
+
+
+def write_release_file(data_dir, version):
+    os.makedirs(data_dir, exist_ok=True)
+    open(os.path.join(data_dir, f'RELEASE_v{version}.txt'), 'w').close()
+
+
+def write_kenya_fixture(work_dir, n_fields, min_timesteps=4, max_timesteps=24, n_bands=18, seed=0):
+    """
+    Writes a synthetic crop_type_kenya dataset.
+    Construct CropTypeMappingKenyaDataset(root_dir=os.path.join(work_dir, 'data'))
+    with work_dir as the working directory.
+    Field IDs are sparse and shuffled, so that they differ from the row indices,
+    and every field gets a random number of time steps.
+    Output:
+        - field_ids (np.ndarray): Field IDs of the written fields, in row order
+    """
+    from sustainbench.datasets.croptypemapping_kenya import CROPS, REGIONS
+
+    rng = np.random.default_rng(seed)
+    npy_dir = os.path.join(work_dir, 'npy')
+    os.makedirs(npy_dir, exist_ok=True)
+    field_ids = rng.choice(10 * n_fields, size=n_fields, replace=False) + 1
+    file_names = []
+    for field_id in field_ids:
+        path = os.path.join(npy_dir, f'field_{field_id}.npy')
+        n_timesteps = int(rng.integers(min_timesteps, max_timesteps + 1))
+        np.save(path, rng.random((n_bands, n_timesteps), dtype=np.float32))
+        file_names.append(path)
+
+    metadata = pd.DataFrame({
+        'fieldID': field_ids,
+        'fileName': file_names,
+        'cropType': rng.choice(CROPS, size=n_fields),
+        'fold_random': rng.integers(0, 3, size=n_fields),
+    })
+    for region in REGIONS:
+        metadata[f'fold_{region.lower()}_test'] = rng.integers(0, 3, size=n_fields)
+
+    archive_dir = os.path.join(work_dir, 'croptype_mapping_kenya')
+    os.makedirs(archive_dir, exist_ok=True)
+    with zipfile.ZipFile(os.path.join(archive_dir, 'crop_type_kenya.zip'), 'w') as zip_ref:
+        zip_ref.writestr('crop_type_kenya_2017_metadata.csv', metadata.to_csv(index=False))
+    write_release_file(os.path.join(work_dir, 'data', 'crop_type_kenya'), '1.0')
+    return field_ids
+
+
+def write_crop_yield_fixture(work_dir, n_per_split=50, n_bins=32, n_timesteps=32, n_bands=9,
+                             countries=('usa',), seed=0):
+    """
+    Writes a synthetic crop_yield dataset archive.
+    Construct CropYieldDataset(root_dir=os.path.join(work_dir, 'data'))
+    with work_dir as the working directory.
+    """
+    rng = np.random.default_rng(seed)
+    archive_dir = os.path.join(work_dir, 'crop_yield')
+    os.makedirs(archive_dir, exist_ok=True)
+    with zipfile.ZipFile(os.path.join(archive_dir, 'soybeans_updated.zip'), 'w') as zip_ref:
+        for country in countries:
+            for fname in ['train', 'dev', 'test']:
+                arrays = {
+                    'hists': rng.random((n_per_split, n_bins, n_timesteps, n_bands)),
+                    'yields': rng.random(n_per_split) * 4,
+                    'years': rng.integers(2005, 2016, size=n_per_split).astype(float),
+                    'keys': np.array([f'{rng.integers(50)}_{rng.integers(10)}_{i}' for i in range(n_per_split)]),
+                }
+                for name, data in arrays.items():
+                    with zip_ref.open(f'soybeans/{country}/{fname}_{name}.npz', 'w') as f:
+                        np.savez(f, data=data)
+    write_release_file(os.path.join(work_dir, 'data', 'crop_yield'), '1.0')
+
+
+def write_crop_type_mapping_fixture(data_dir, n_locations=20, country='ghana', max_timesteps=12,
+                                    img_dim=64, planet_dim=64, seed=0):
+    """
+    Writes a synthetic africa_crop_type_mapping dataset.
+    Construct CropTypeMappingDataset(root_dir=data_dir).
+    Every location gets a random number of acquisitions per satellite.
+    """
+    rng = np.random.default_rng(seed)
+    country_dir = os.path.join(data_dir, 'africa_crop_type_mapping', country)
+    for sub_dir in ['npy', 'truth', 's1', 's2', 'planet']:
+        os.makedirs(os.path.join(country_dir, sub_dir), exist_ok=True)
+
+    n_bands = {'s1': 3, 's2': 10, 'planet': 4}
+    dims = {'s1': img_dim, 's2': img_dim, 'planet': planet_dim}
+    ids = np.arange(n_locations)
+    for loc_id in ids:
+        images = {}
+        for satellite in ['s1', 's2', 'planet']:
+            n_timesteps = int(rng.integers(1, max_timesteps + 1))
+            dim = dims[satellite]
+            images[satellite] = rng.integers(
+                1, 4000, size=(n_bands[satellite], dim, dim, n_timesteps)).astype(np.float32 if satellite == 's1' else np.int16)
+            days = np.sort(rng.choice(365, size=n_timesteps, replace=False))
+            dates = [str(np.datetime64('2017-01-01') + day) for day in days]
+            with open(os.path.join(country_dir, satellite, f'{satellite}_{country}_{loc_id:06d}.json'), 'w') as f:
+                json.dump({'dates': dates}, f)
+        np.savez(os.path.join(country_dir, 'npy', f'{country}_{loc_id:06d}.npz'), **images)
+        np.savez(os.path.join(country_dir, 'truth', f'{country}_{loc_id:06d}.npz'),
+                 truth=rng.integers(0, 4, size=(img_dim, img_dim)))
+
+    pd.DataFrame({'id': ids, 'partition': rng.integers(0, 3, size=n_locations)}).to_csv(
+        os.path.join(country_dir, 'list_eval_partition.csv'), index=False)
+    write_release_file(os.path.join(data_dir, 'africa_crop_type_mapping'), '1.0')
+
+
+def write_fmow_fixture(data_dir, n_images=200, img_dim=224, n_seq=10, seed=0, write_images=True):
+    """
+    Writes a synthetic fmow dataset with n_images labeled PNG images plus
+    n_seq sequestered rows. Construct FMoWDataset(root_dir=data_dir).
+    With write_images=False only the metadata is written.
+    """
+    from PIL import Image
+    from sustainbench.datasets.fmow_dataset import categories
+
+    rng = np.random.default_rng(seed)
+    fmow_dir = os.path.join(data_dir, 'fmow')
+    os.makedirs(os.path.join(fmow_dir, 'images'), exist_ok=True)
+
+    countries = {'USA': 'Americas', 'BRA': 'Americas', 'FRA': 'Europe', 'CHN': 'Asia',
+                 'KEN': 'Africa', 'AUS': 'Oceania'}
+    n_rows = n_images + n_seq
+    start = np.datetime64('2002-01-01T00:00:00')
+    seconds = rng.integers(0, 16 * 365 * 24 * 3600, size=n_rows)
+    timestamps = [str(start + np.timedelta64(int(s), 's')) + 'Z' for s in seconds]
+    split = rng.choice(['train', 'val', 'test'], size=n_rows, p=[0.6, 0.2, 0.2]).astype(object)
+    split[rng.choice(n_rows, size=n_seq, replace=False)] = 'seq'
+    metadata = pd.DataFrame({
+        'split': split,
+        'img_filename': [f'img_{i}.jpg' for i in range(n_rows)],
+        'img_path': [f'images/rgb_img_{i}.png' for i in range(n_rows)],
+        'spatial_reso': 1.0,
+        'timestamp': timestamps,
+        'category': rng.choice(categories, size=n_rows),
+        'country_code': rng.choice(list(countries) + ['XXX'], size=n_rows),
+    })
+    metadata.to_csv(os.path.join(fmow_dir, 'rgb_metadata.csv'), index=False)
+    pd.DataFrame({'alpha-3': list(countries), 'region': list(countries.values())}).to_csv(
+        os.path.join(fmow_dir, 'country_code_mapping.csv'), index=False)
+
+    for i in np.flatnonzero(split != 'seq') if write_images else []:
+        img = rng.integers(0, 256, size=(img_dim, img_dim, 3), dtype=np.uint8)
+        Image.fromarray(img).save(os.path.join(fmow_dir, 'images', f'rgb_img_{i}.png'))
+    write_release_file(fmow_dir, '1.1')
+
+
+@contextmanager
+def poverty_folds():
+    """
+    Defines the country fold tables SURVEY_NAMES and DHS_COUNTRIES, which
+    poverty_dataset and dhs_dataset use but do not define, while the context is
+    active. Every fold uses the official country splits, and DHS_COUNTRIES lists
+    the countries that write_poverty_fixture samples from. Tables that a module
+    defines are left as they are.
+    """
+    from sustainbench.datasets import dhs_dataset, poverty_dataset
+
+    patched = []
+    for module in [poverty_dataset, dhs_dataset]:
+        splits = module.SPLITS
+        tables = {
+            'SURVEY_NAMES': {f'2009-17{fold}': splits for fold in 'ABCDE'},
+            'DHS_COUNTRIES': sorted(splits['train'] + splits['val'] + splits['test']),
+        }
+        for name, table in tables.items():
+            if not hasattr(module, name):
+                setattr(module, name, table)
+                patched.append((module, name))
+    try:
+        yield
+    finally:
+        for module, name in patched:
+            delattr(module, name)
+
+
+def write_poverty_fixture(data_dir, n_images=200, img_dim=224, seed=0, write_images=True):
+    """
+    Writes a synthetic poverty dataset with n_images float32 npz images of
+    shape (8, img_dim, img_dim). Construct PovertyMapDataset(root_dir=data_dir)
+    inside poverty_folds(). With write_images=False only the metadata is written.
+    """
+    from sustainbench.datasets.poverty_dataset import SPLITS
+
+    rng = np.random.default_rng(seed)
+    poverty_dir = os.path.join(data_dir, 'poverty')
+    os.makedirs(os.path.join(poverty_dir, 'images'), exist_ok=True)
+
+    countries = sorted(SPLITS['train'] + SPLITS['val'] + SPLITS['test'])
+    pd.DataFrame({
+        'country': rng.choice(countries, size=n_images),
+        'year': rng.integers(2009, 2018, size=n_images),
+        'lat': rng.uniform(-30, 30, size=n_images),
+        'lon': rng.uniform(-20, 100, size=n_images),
+        'urban': rng.integers(0, 2, size=n_images),
+        'wealthpooled': rng.normal(size=n_images),
+    }).to_csv(os.path.join(poverty_dir, 'dhs_metadata.csv'), index=False)
+
+    for i in range(n_images if write_images else 0):
+        np.savez_compressed(os.path.join(poverty_dir, 'images', f'landsat_poverty_img_{i}.npz'),
+                            x=rng.normal(size=(8, img_dim, img_dim)).astype(np.float32))
+    write_release_file(poverty_dir, '1.1')
+
+
+def write_crop_seg_fixture(data_dir, n_images=200, img_dim=224, seed=0):
+    """
+    Writes a synthetic crop_delineation dataset with JPEG images and PNG masks.
+    Construct CropSegmentationDataset(root_dir=data_dir).
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    seg_dir = os.path.join(data_dir, 'crop_delineation')
+    for sub_dir in ['imgs', 'masks', 'masks_filled']:
+        os.makedirs(os.path.join(seg_dir, sub_dir), exist_ok=True)
+
+    file_idxs = rng.permutation(10 * n_images)[:n_images]
+    min_lat = rng.uniform(-30, 30, size=n_images)
+    min_lon = rng.uniform(-20, 100, size=n_images)
+    pd.DataFrame({
+        'ids': np.arange(n_images),
+        'indices': file_idxs,
+        'split': rng.choice(['train', 'val', 'test'], size=n_images, p=[0.6, 0.2, 0.2]),
+        'max_lat': min_lat + 0.01,
+        'max_lon': min_lon + 0.01,
+        'min_lat': min_lat,
+        'min_lon': min_lon,
+    }).to_csv(os.path.join(seg_dir, 'clean_data.csv'), index=False)
+
+    for file_idx in file_idxs:
+        img = rng.integers(0, 256, size=(img_dim, img_dim, 3), dtype=np.uint8)
+        Image.fromarray(img).save(os.path.join(seg_dir, 'imgs', f'{file_idx}.jpeg'))
+        mask = 255 * rng.integers(0, 2, size=(img_dim, img_dim), dtype=np.uint8)
+        for mask_dir in ['masks', 'masks_filled']:
+            Image.fromarray(mask).save(os.path.join(seg_dir, mask_dir, f'{file_idx}.png'))
+    write_release_file(seg_dir, '1.1')
+
+
+def write_brick_kiln_fixture(data_dir, n_images=200, images_per_file=64, n_bands=13, img_dim=64, seed=0):
+    """
+    Writes a synthetic brick_kiln dataset split over several HDF5 files.
+    Construct BrickKilnDataset(root_dir=data_dir).
+    """
+    import h5py
+
+    rng = np.random.default_rng(seed)
+    kiln_dir = os.path.join(data_dir, 'brick_kiln')
+    os.makedirs(kiln_dir, exist_ok=True)
+
+    hdf5_file = np.arange(n_images) // images_per_file
+    hdf5_idx = np.arange(n_images) % images_per_file
+    for hdf5_loc in np.unique(hdf5_file):
+        n_file_images = int(np.sum(hdf5_file == hdf5_loc))
+        with h5py.File(os.path.join(kiln_dir, f'examples_{hdf5_loc}.hdf5'), 'w') as f:
+            f.create_dataset('images', data=rng.random((n_file_images, n_bands, img_dim, img_dim), dtype=np.float32))
+
+    lon = rng.uniform(88, 92, size=n_images)
+    lat = rng.uniform(21, 26, size=n_images)
+    pd.DataFrame({
+        'partition': rng.choice(3, size=n_images, p=[0.6, 0.2, 0.2]),
+        'y': rng.integers(0, 2, size=n_images),
+        'hdf5_file': hdf5_file,
+        'hdf5_idx': hdf5_idx,
+        'lon_top_left': lon,
+        'lat_top_left': lat + 0.01,
+        'lon_bottom_right': lon + 0.01,
+        'lat_bottom_right': lat,
+        'indice_x': rng.integers(0, 100, size=n_images),
+        'indice_y': rng.integers(0, 100, size=n_images),
+    }).to_csv(os.path.join(kiln_dir, 'list_eval_partition.csv'), index=False)
+    write_release_file(kiln_dir, '1.0')
@@ -0,0 +1,56 @@
+"""
+Measures how the epoch time of CropTypeMappingKenyaDataset scales with the
+number of fields. Items are read by row and fields are found by ID with the
+precomputed field index, so the time per item stays constant, i.e., the
+epoch time grows linearly.
+
+    python -m benchmarks.kenya_index_scaling --sizes 1000 2000 4000 8000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fixtures import working_directory, write_kenya_fixture
+
+
+def time_epoch(dataset, field_ids):
+    start = time.perf_counter()
+    for field_id in field_ids:
+        dataset[dataset.field_row(field_id)]
+    return time.perf_counter() - start
+
+
+def time_linear_scan(dataset, field_ids):
+    """
+    Time spent by the previous per-item lookup, which compared every field ID.
+    """
+    field_id_strs = dataset._y_array.numpy().astype(str)
+    start = time.perf_counter()
+    for field_id in field_ids:
+        (field_id_strs == str(field_id)).nonzero()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--sizes', nargs='*', type=int, default=[1000, 2000, 4000, 8000],
+        help='Numbers of fields to benchmark.')
+    config = parser.parse_args()
+
+    from sustainbench.datasets.croptypemapping_kenya import CropTypeMappingKenyaDataset
+
+    print(f'{"fields":>8} {"epoch (s)":>10} {"us/item":>9} {"scan (s)":>9}')
+    for n_fields in config.sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            field_ids = write_kenya_fixture(work_dir, n_fields)
+            with working_directory(work_dir):
+                dataset = CropTypeMappingKenyaDataset(root_dir=os.path.join(work_dir, 'data'))
+                epoch_time = time_epoch(dataset, field_ids)
+                scan_time = time_linear_scan(dataset, field_ids)
+        print(f'{n_fields:>8} {epoch_time:>10.3f} {1e6 * epoch_time / n_fields:>9.1f} {scan_time:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""
+Measures data loading performance of every dataset class on synthetic data
+written by benchmarks.fixtures, so it runs offline.
+
+For each dataset it reports
+    - get_input and __getitem__ throughput and latency percentiles in the main process
+    - DataLoader throughput, batch latency percentiles and resident memory
+      (main process plus workers) for several numbers of workers
+
+    python -m benchmarks.loader_throughput --datasets fmow brick_kiln --num_workers 0 2 4
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+from benchmarks import fixtures
+from sustainbench.common.data_loaders import BucketBatchSampler, padding_overhead
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _to_tensor(img):
+    from torchvision.transforms.functional import to_tensor
+    return to_tensor(img)
+
+
+def _collate_masks(batch):
+    # crop_delineation metadata holds the paths of the masks, which cannot be stacked
+    x, y, metadata = zip(*batch)
+    return default_collate(x), default_collate(y), list(metadata)
+
+
+class TransformedDataset:
+    """
+    Applies a transform to x, for datasets whose raw inputs (e.g., PIL images)
+    cannot be collated, and/or replaces the collate function of the dataset.
+    """
+    def __init__(self, dataset, transform=None, collate=None):
+        self.dataset = dataset
+        self.transform = transform
+        self.collate = dataset.collate if collate is None else collate
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        x, *rest = self.dataset[idx]
+        if self.transform is not None:
+            x = self.transform(x)
+        return (x, *rest)
+
+
+def _poverty(work_dir, n):
+    from sustainbench.datasets.poverty_dataset import PovertyMapDataset
+    fixtures.write_poverty_fixture(work_dir, n_images=n)
+    with fixtures.poverty_folds():
+        return PovertyMapDataset(root_dir=work_dir), None
+
+
+def _fmow(work_dir, n):
+    from sustainbench.datasets.fmow_dataset import FMoWDataset
+    fixtures.write_fmow_fixture(work_dir, n_images=n)
+    return FMoWDataset(root_dir=work_dir), _to_tensor
+
+
+def _crop_type_mapping(work_dir, n):
+    from sustainbench.datasets.croptypemapping_dataset import CropTypeMappingDataset
+    fixtures.write_crop_type_mapping_fixture(work_dir, n_locations=n)
+    return CropTypeMappingDataset(root_dir=work_dir), None
+
+
+def _crop_type_mapping_dynamic(work_dir, n):
+    from sustainbench.datasets.croptypemapping_dataset import CropTypeMappingDataset
+    fixtures.write_crop_type_mapping_fixture(work_dir, n_locations=n)
+    return CropTypeMappingDataset(root_dir=work_dir, dynamic_padding=True), None
+
+
+def _crop_type_kenya(work_dir, n):
+    from sustainbench.datasets.croptypemapping_kenya import CropTypeMappingKenyaDataset
+    fixtures.write_kenya_fixture(work_dir, n_fields=n)
+    return CropTypeMappingKenyaDataset(root_dir=os.path.join(work_dir, 'data')), None
+
+
+def _crop_seg(work_dir, n):
+    from sustainbench.datasets.crop_seg_dataset import CropSegmentationDataset
+    fixtures.write_crop_seg_fixture(work_dir, n_images=n)
+    return CropSegmentationDataset(root_dir=work_dir), None
+
+
+def _crop_yield(work_dir, n):
+    from sustainbench.datasets.crop_yield_dataset import CropYieldDataset
+    fixtures.write_crop_yield_fixture(work_dir, n_per_split=max(n // 3, 1))
+    return CropYieldDataset(root_dir=os.path.join(work_dir, 'data')), None
+
+
+def _brick_kiln(work_dir, n):
+    from sustainbench.datasets.brickkiln_dataset import BrickKilnDataset
+    fixtures.write_brick_kiln_fixture(work_dir, n_images=n)
+    return BrickKilnDataset(root_dir=work_dir), None
+
+
+# name -> function(work_dir, n) that writes a fixture with about n data points
+# and returns the dataset and the transform needed to collate its inputs
+DATASETS = {
+    'poverty': _poverty,
+    'fmow': _fmow,
+    'africa_crop_type_mapping': _crop_type_mapping,
+    'africa_crop_type_mapping_dynamic': _crop_type_mapping_dynamic,
+    'crop_type_kenya': _crop_type_kenya,
+    'crop_delineation': _crop_seg,
+    'crop_yield': _crop_yield,
+    'brick_kiln': _brick_kiln,
+}
+
+# upper bounds on the batch size; crop type mapping items are padded to 256
+# time steps (several hundred MB each), so larger batches do not fit in memory.
+# With dynamic_padding, batches are only padded to their longest time series.
+MAX_BATCH_SIZES = {
+    'africa_crop_type_mapping': 2,
+}
+
+# collate functions for datasets whose items default_collate cannot batch
+COLLATES = {
+    'crop_delineation': _collate_masks,
+}
+
+
+def rss_bytes():
+    """
+    Resident memory of this process and its children (e.g., DataLoader workers).
+    Without psutil, falls back to the peak RSS of this process.
+    """
+    if psutil is None:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def summarize(latencies, n_items):
+    """
+    Output:
+        - stats (dict): Throughput in items/s and latency percentiles in ms
+    """
+    latencies = np.asarray(latencies)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1e3
+    return {'throughput': n_items / latencies.sum(), 'p50': p50, 'p90': p90, 'p99': p99}
+
+
+def time_calls(fn, indices):
+    latencies = []
+    for idx in indices:
+        start = time.perf_counter()
+        fn(idx)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, len(indices))
+
+
+def time_loader(dataset, num_workers, batch_size, max_batches, batch_sampler=None):
+    if batch_sampler is None:
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                            collate_fn=dataset.collate)
+    else:
+        loader = DataLoader(dataset, batch_sampler=batch_sampler, num_workers=num_workers,
+                            collate_fn=dataset.collate)
+    latencies, n_items, rss = [], 0, 0
+    start = time.perf_counter()
+    for i, batch in enumerate(loader):
+        latencies.append(time.perf_counter() - start)
+        n_items += len(batch[1])
+        if i == 0:
+            # workers are alive and have loaded data at this point
+            rss = rss_bytes()
+        if i + 1 >= max_batches:
+            break
+        start = time.perf_counter()
+    stats = summarize(latencies, n_items)
+    stats['rss_mb'] = rss / 2**20
+    return stats
+
+
+def format_stats(label, stats):
+    line = (f'  {label:<16} {stats["throughput"]:>10.1f} {stats["p50"]:>8.2f} '
+            f'{stats["p90"]:>8.2f} {stats["p99"]:>8.2f}')
+    if 'rss_mb' in stats:
+        line += f' {stats["rss_mb"]:>9.1f}'
+    return line
+
+
+def run(name, config):
+    """
+    Output:
+        - failures (list of str): Descriptions of the measurements that failed
+    """
+    print(f'=== {name} ===')
+    failures = []
+
+    def failed(label, e):
+        print(f'  {label:<16} failed: {type(e).__name__}: {e}')
+        failures.append(f'{name} {label}: {type(e).__name__}: {e}')
+
+    with tempfile.TemporaryDirectory() as work_dir, fixtures.working_directory(work_dir):
+        try:
+            dataset, transform = DATASETS[name](work_dir, config.n)
+        except Exception as e:
+            failed('construction', e)
+            return failures
+        rng = np.random.default_rng(0)
+        indices = rng.choice(len(dataset), size=min(config.n_calls, len(dataset)), replace=False)
+
+        print(f'  {"":<16} {"items/s":>10} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"RSS MB":>9}')
+        for label, fn in [('get_input', dataset.get_input), ('__getitem__', dataset.__getitem__)]:
+            try:
+                print(format_stats(label, time_calls(fn, indices)))
+            except Exception as e:
+                failed(label, e)
+
+        collate = COLLATES.get(name)
+        if transform is None and collate is None:
+            loader_dataset = dataset
+        else:
+            loader_dataset = TransformedDataset(dataset, transform, collate)
+        batch_size = min(config.batch_size, MAX_BATCH_SIZES.get(name, config.batch_size))
+        for num_workers in config.num_workers:
+            label = f'loader w={num_workers}'
+            try:
+                stats = time_loader(loader_dataset, num_workers, batch_size, config.max_batches)
+                print(format_stats(label, stats))
+            except Exception as e:
+                failed(label, e)
+
+        if hasattr(dataset, 'sequence_lengths'):
+            run_bucketed(dataset, loader_dataset, batch_size, config, failed)
+    return failures
+
+
+def run_bucketed(dataset, loader_dataset, batch_size, config, failed):
+    """
+    Times bucketed loaders and compares their padding overhead with shuffled batches.
+    Failures are reported to failed(label, exception).
+    """
+    lengths = dataset.sequence_lengths()
+    sampler = BucketBatchSampler(lengths, batch_size, bucket_size=config.bucket_size, seed=0)
+    order = np.random.default_rng(0).permutation(len(lengths))
+    shuffled = np.mean([padding_overhead(lengths[order[i:i + batch_size]])
+                        for i in range(0, len(order), batch_size)])
+    bucketed = sampler.padding_overhead().mean()
+    print(f'  padding overhead: shuffled {shuffled:.3f}, bucketed {bucketed:.3f}')
+    for num_workers in config.num_workers:
+        label = f'bucketed w={num_workers}'
+        try:
+            stats = time_loader(loader_dataset, num_workers, batch_size, config.max_batches, batch_sampler=sampler)
+            print(format_stats(label, stats))
+        except Exception as e:
+            failed(label, e)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--datasets', nargs='*', default=list(DATASETS), choices=list(DATASETS),
+        help='Datasets to benchmark.')
+    parser.add_argument(
+        '--n', type=int, default=256,
+        help='Approximate number of data points in each synthetic dataset.')
+    parser.add_argument(
+        '--n_calls', type=int, default=100,
+        help='Number of get_input / __getitem__ calls to time.')
+    parser.add_argument(
+        '--num_workers', nargs='*', type=int, default=[0, 2, 4],
+        help='DataLoader worker counts to benchmark.')
+    parser.add_argument(
+        '--batch_size', type=int, default=16)
+    parser.add_argument(
+        '--max_batches', type=int, default=16,
+        help='Maximum number of batches to load per DataLoader configuration.')
+    parser.add_argument(
+        '--bucket_size', type=int, default=None,
+        help='Bucket size of bucketed loaders for datasets with sequence lengths.')
+    config = parser.parse_args()
+
+    if psutil is None:
+        print('psutil is not installed; reporting peak RSS of the main process only.')
+    failures = []
+    for name in config.datasets:
+        failures.extend(run(name, config))
+    if failures:
+        # every configuration is expected to run on the synthetic data
+        print(f'{len(failures)} measurements failed:')
+        for failure in failures:
+            print(f'  {failure}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+import sys
+
+
+def item_nbytes(value):
+    """
+    Approximate memory footprint of a cached value in bytes.
+    """
+    if hasattr(value, 'nbytes'):  # numpy arrays
+        return int(value.nbytes)
+    if hasattr(value, 'element_size') and hasattr(value, 'nelement'):  # torch tensors
+        return int(value.element_size() * value.nelement())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    In-process least-recently-used cache with a budget in items and/or bytes.
+    Keeps hit / miss / eviction counters that can be inspected with stats().
+
+    Each process (e.g., each DataLoader worker) holds its own cache.
+    A pickled cache is restored empty, so that spawning workers does not copy
+    the cached data.
+    """
+    def __init__(self, max_items=None, max_bytes=None):
+        """
+        Args:
+            - max_items (int): Maximum number of cached entries. None for no limit.
+            - max_bytes (int): Maximum total size of cached entries in bytes. None for no limit.
+        """
+        if max_items is not None and max_items < 0:
+            raise ValueError(f'max_items must be non-negative, got {max_items}')
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError(f'max_bytes must be non-negative, got {max_bytes}')
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_entries=OrderedDict(), _nbytes=0, hits=0, misses=0, evictions=0)
+        return state
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key and marks it as most recently used,
+        or default if key is not cached.
+        """
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Caches value under key, evicting least recently used entries as needed.
+        Values that alone exceed the byte budget are not cached.
+        """
+        nbytes = item_nbytes(value)
+        if key in self._entries:
+            self._nbytes -= self._entries.pop(key)[1]
+        if self.max_items == 0 or (self.max_bytes is not None and nbytes > self.max_bytes):
+            return
+        self._entries[key] = (value, nbytes)
+        self._nbytes += nbytes
+        while ((self.max_items is not None and len(self._entries) > self.max_items) or
+               (self.max_bytes is not None and self._nbytes > self.max_bytes)):
+            _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= evicted_nbytes
+            self.evictions += 1
+
+    def get_or_load(self, key, load_fn):
+        """
+        Returns the cached value for key, calling load_fn(key) and caching
+        the result on a miss.
+        """
+        if key in self._entries:
+            return self.get(key)
+        self.misses += 1
+        value = load_fn(key)
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+    def stats(self):
+        """
+        Output:
+            - stats (dict): Counters and current size of the cache
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'items': len(self._entries),
+            'nbytes': self._nbytes,
+            'max_items': self.max_items,
+            'max_bytes': self.max_bytes,
+        }
@@ -2,16 +2,18 @@ import numpy as np
 import torch
 from torch.utils.data import DataLoader
 from torch.utils.data.sampler import WeightedRandomSampler, SubsetRandomSampler
-from sustainbench.common.utils import get_counts, split_into_groups
+from sustainbench.common.utils import get_counts, split_into_groups_compact
 
 def get_train_loader(loader, dataset, batch_size,
-        uniform_over_groups=None, grouper=None, distinct_groups=True, n_groups_per_batch=None, **loader_kwargs):
+        uniform_over_groups=None, grouper=None, distinct_groups=True, n_groups_per_batch=None, seed=None,
+        distributed=False, num_replicas=None, rank=None, bucket_size=None, **loader_kwargs):
     """
     Constructs and returns the data loader for training.
     Args:
         - loader (str): Loader type. 'standard' for standard loaders and 'group' for group loaders,
                         which first samples groups and then samples a fixed number of examples belonging
-                        to each group.
+                        to each group. 'bucketed' for loaders that batch time series of similar lengths
+                        together (see BucketBatchSampler), for datasets with sequence_lengths().
         - dataset (SustainBenchDataset or SustainBenchSubset): Data
         - batch_size (int): Batch size
         - uniform_over_groups (None or bool): Whether to sample the groups uniformly or according to the
@@ -22,12 +24,47 @@ def get_train_loader(loader, dataset, batch_size,
         - grouper (Grouper): Grouper used for group loaders or for uniform_over_groups=True
         - distinct_groups (bool): Whether to sample distinct_groups within each minibatch for group loaders.
         - n_groups_poer_batch (int): Number of groups to sample in each minibatch for group loaders.
-        - loader_kwargs: kwargs passed into torch DataLoader initialization.
+        - seed (int): Seed of the batches of group loaders and distributed loaders. Call set_epoch on
+                      loader.batch_sampler (group loaders) or loader.sampler to reproduce a given epoch.
+                      Distributed loaders default to seed 0, since all ranks must use the same seed.
+        - distributed (bool): Whether each process (rank) loads a disjoint slice of every epoch, e.g., with
+                              DistributedDataParallel. Group balance is that of the non-distributed loader.
+        - num_replicas (int): Number of ranks of distributed loaders. Defaults to the world size.
+        - rank (int): Rank of this process for distributed loaders. Defaults to the current rank.
+        - bucket_size (int): Number of data points per length bucket for bucketed loaders.
+                             Defaults to BucketBatchSampler.DEFAULT_N_BUCKETS buckets.
+        - loader_kwargs: kwargs passed into torch DataLoader initialization. With num_workers > 0,
+                         persistent_workers defaults to True for datasets with an active image
+                         cache (see cache_info()), so that the caches of the workers are kept
+                         across epochs.
     Output:
         - data loader (DataLoader): Data loader.
     """
+    loader_kwargs = _persistent_workers(dataset, loader_kwargs)
+    if distributed:
+        num_replicas, rank = _distributed_rank(num_replicas, rank)
+        if seed is None:
+            seed = 0
+
     if loader == 'standard':
-        if uniform_over_groups is None or not uniform_over_groups:
+        if distributed:
+            weights = None
+            if uniform_over_groups:
+                assert grouper is not None
+                groups, group_counts = grouper.metadata_to_group(
+                    dataset.metadata_array,
+                    return_counts=True)
+                weights = (1 / group_counts)[groups]
+            sampler = DistributedRandomSampler(
+                len(dataset), num_replicas, rank, weights=weights, seed=seed)
+            return DataLoader(
+                dataset,
+                shuffle=False, # The DistributedRandomSampler already shuffles
+                sampler=sampler,
+                collate_fn=dataset.collate,
+                batch_size=batch_size,
+                **loader_kwargs)
+        elif uniform_over_groups is None or not uniform_over_groups:
             return DataLoader(
                 dataset,
                 # shuffle=False, # Shuffle training dataset
@@ -68,7 +105,27 @@ def get_train_loader(loader, dataset, batch_size,
             batch_size=batch_size,
             n_groups_per_batch=n_groups_per_batch,
             uniform_over_groups=uniform_over_groups,
-            distinct_groups=distinct_groups)
+            distinct_groups=distinct_groups,
+            seed=seed,
+            num_replicas=num_replicas if distributed else None,
+            rank=rank if distributed else None)
+
+        return DataLoader(dataset,
+              shuffle=None,
+              sampler=None,
+              collate_fn=dataset.collate,
+              batch_sampler=batch_sampler,
+              drop_last=False,
+              **loader_kwargs)
+
+    elif loader == 'bucketed':
+        batch_sampler = BucketBatchSampler(
+            lengths=dataset.sequence_lengths(),
+            batch_size=batch_size,
+            bucket_size=bucket_size,
+            seed=seed,
+            num_replicas=num_replicas if distributed else None,
+            rank=rank if distributed else None)
 
         return DataLoader(dataset,
               shuffle=None,
@@ -85,10 +142,14 @@ def get_eval_loader(loader, dataset, batch_size, grouper=None, **loader_kwargs):
         - loader (str): Loader type. 'standard' for standard loaders.
         - dataset (SustainBenchDataset or SustainBenchSubset): Data
         - batch_size (int): Batch size
-        - loader_kwargs: kwargs passed into torch DataLoader initialization.
+        - loader_kwargs: kwargs passed into torch DataLoader initialization. With num_workers > 0,
+                         persistent_workers defaults to True for datasets with an active image
+                         cache (see cache_info()), so that the caches of the workers are kept
+                         across epochs.
     Output:
         - data loader (DataLoader): Data loader.
     """
+    loader_kwargs = _persistent_workers(dataset, loader_kwargs)
     if loader == 'standard':
         return DataLoader(
             dataset,
@@ -98,15 +159,96 @@ def get_eval_loader(loader, dataset, batch_size, grouper=None, **loader_kwargs):
             batch_size=batch_size,
             **loader_kwargs)
 
+def _persistent_workers(dataset, loader_kwargs):
+    # worker processes (and the dataset copies they cache images in) are otherwise restarted
+    # every epoch; without a cache, idle workers would only hold on to memory
+    dataset = getattr(dataset, 'dataset', dataset)  # SustainBenchSubset
+    cache_info = getattr(dataset, 'cache_info', None)
+    if loader_kwargs.get('num_workers', 0) > 0 and cache_info is not None and cache_info() is not None:
+        loader_kwargs = {'persistent_workers': True, **loader_kwargs}
+    return loader_kwargs
+
+def _distributed_rank(num_replicas=None, rank=None):
+    if num_replicas is None or rank is None:
+        import torch.distributed as dist
+        if not dist.is_available() or not dist.is_initialized():
+            raise RuntimeError('Distributed loaders need num_replicas and rank or an initialized process group.')
+        num_replicas = dist.get_world_size() if num_replicas is None else num_replicas
+        rank = dist.get_rank() if rank is None else rank
+    if not 0 <= rank < num_replicas:
+        raise ValueError(f'rank ({rank}) must be in [0, {num_replicas}).')
+    return num_replicas, rank
+
+class DistributedRandomSampler:
+    """
+        Shuffles the data points, or samples them with replacement according to weights
+        (like WeightedRandomSampler), and yields the slice of each epoch that belongs to
+        one rank. All ranks draw the same epoch from (seed, epoch), so their slices are
+        disjoint. Epochs are padded by repeating data points to have the same number of
+        samples on every rank.
+
+        The epoch advances after every iteration, or is set explicitly with set_epoch.
+    """
+
+    def __init__(self, n, num_replicas, rank, weights=None, seed=0):
+        self.n = n
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.weights = None if weights is None else torch.as_tensor(weights, dtype=torch.double)
+        self.seed = seed
+        self.epoch = 0
+        self.num_samples = -(-n // num_replicas)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def plan_epoch(self, epoch=None):
+        """
+        Output:
+            - indices (Tensor): indices of the whole epoch, of size (num_samples * num_replicas, )
+        """
+        epoch = self.epoch if epoch is None else epoch
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        total_size = self.num_samples * self.num_replicas
+        if self.weights is not None:
+            return torch.multinomial(self.weights, total_size, replacement=True, generator=generator)
+        indices = torch.randperm(self.n, generator=generator)
+        return torch.cat([indices, indices[:total_size - self.n]])
+
+    def __iter__(self):
+        indices = self.plan_epoch()[self.rank::self.num_replicas]
+        self.epoch += 1
+        return iter(indices.tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+def _default_seed():
+    return np.random.randint(2**31)
+
+def _shuffle_last_axis(rng, arr):
+    # independent shuffles of each row, like Generator.permuted (numpy >= 1.20)
+    return np.take_along_axis(arr, np.argsort(rng.random(arr.shape), axis=-1), axis=-1)
+
 class GroupSampler:
     """
         Constructs batches by first sampling groups,
         then sampling data from those groups.
         It drops the last batch if it's incomplete.
+
+        The batches of an epoch are planned at once with a few vectorized calls on a
+        dedicated np.random.Generator seeded by (seed, epoch), so iterating only yields
+        rows of the plan. The epoch advances after every iteration, or is set explicitly
+        with set_epoch, e.g., to resume training.
+
+        With num_replicas and rank, every rank plans the same epoch and yields every
+        num_replicas-th batch of it, starting at its rank, so ranks get disjoint batches
+        and each batch is sampled over groups as without distribution.
     """
 
     def __init__(self, group_ids, batch_size, n_groups_per_batch,
-                 uniform_over_groups, distinct_groups):
+                 uniform_over_groups, distinct_groups, seed=None, num_replicas=None, rank=None):
 
         if batch_size % n_groups_per_batch != 0:
             raise ValueError(f'batch_size ({batch_size}) must be evenly divisible by n_groups_per_batch ({n_groups_per_batch}).')
@@ -114,43 +256,199 @@ class GroupSampler:
             raise ValueError(f'The dataset has only {len(group_ids)} examples but the batch size is {batch_size}. There must be enough examples to form at least one complete batch.')
 
         self.group_ids = group_ids
-        self.unique_groups, self.group_indices, unique_counts = split_into_groups(group_ids)
+        # indices of the data points of unique_groups[i] are
+        # group_order[group_starts[i]:group_starts[i]+unique_counts[i]]
+        self.unique_groups, order, offsets = split_into_groups_compact(torch.as_tensor(group_ids))
+        self.group_order = order.numpy()
+        self.group_starts = offsets[:-1].numpy()
+        self.unique_counts = (offsets[1:] - offsets[:-1]).numpy()
 
         self.distinct_groups = distinct_groups
         self.n_groups_per_batch = n_groups_per_batch
         self.n_points_per_group = batch_size // n_groups_per_batch
+        if distinct_groups and n_groups_per_batch > len(self.unique_groups):
+            raise ValueError(f'n_groups_per_batch was set to {n_groups_per_batch} but only {len(self.unique_groups)} groups are present.')
 
         self.dataset_size = len(group_ids)
         self.num_batches = self.dataset_size // batch_size
+        self.num_replicas = 1 if num_replicas is None else num_replicas
+        self.rank = 0 if rank is None else rank
+        if self.num_batches < self.num_replicas:
+            raise ValueError(f'The dataset has only {self.num_batches} complete batches for {self.num_replicas} ranks.')
 
         if uniform_over_groups: # Sample uniformly over groups
             self.group_prob = None
         else: # Sample a group proportionately to its size
-            self.group_prob = unique_counts.numpy() / unique_counts.numpy().sum()
+            self.group_prob = self.unique_counts / self.unique_counts.sum()
+
+        # without a seed, draw one from the global numpy RNG, so that np.random.seed still
+        # makes runs reproducible and set_epoch still reproduces epochs of this sampler
+        if seed is None and self.num_replicas > 1:
+            raise ValueError('A seed shared by all ranks is required with num_replicas > 1.')
+        self.seed = _default_seed() if seed is None else seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _sample_groups(self, rng):
+        """
+        Output:
+            - groups (ndarray): array of size (num_batches, n_groups_per_batch) of indices into unique_groups
+        """
+        n_unique = len(self.unique_groups)
+        size = (self.num_batches, self.n_groups_per_batch)
+        if not self.distinct_groups:
+            return rng.choice(n_unique, size=size, replace=True, p=self.group_prob)
+        # The groups with the smallest exponential keys (scaled by 1 / probability) are a
+        # sample without replacement with the same distribution as np.random.choice
+        keys = rng.exponential(size=(self.num_batches, n_unique))
+        if self.group_prob is not None:
+            with np.errstate(divide='ignore'):
+                keys = keys / self.group_prob
+        groups = np.argpartition(keys, self.n_groups_per_batch - 1, axis=1)[:, :self.n_groups_per_batch]
+        return _shuffle_last_axis(rng, groups)
+
+    def _sample_points(self, rng, counts):
+        """
+        Samples n_points_per_group positions within each of the given groups, without
+        replacement if the group is larger than the sample size.
+        Args:
+            - counts (ndarray): Sizes of the groups, of any shape
+        Output:
+            - positions (ndarray): array of size (*counts.shape, n_points_per_group)
+        """
+        k = self.n_points_per_group
+        counts = counts[..., None]
+        # Floyd's algorithm, vectorized over all groups: step j picks a position in
+        # [0, count - k + j] and takes count - k + j itself if that position was taken
+        positions = np.empty(counts.shape[:-1] + (k,), dtype=np.int64)
+        for j in range(k):
+            upper = counts - k + j
+            candidates = (rng.random(counts.shape) * (upper + 1)).astype(np.int64)
+            taken = (positions[..., :j] == candidates).any(axis=-1, keepdims=True)
+            positions[..., j:j+1] = np.where(taken, upper, candidates)
+        positions = _shuffle_last_axis(rng, positions)
+        # Groups no larger than the sample size are sampled with replacement
+        with_replacement = (rng.random(positions.shape) * counts).astype(np.int64)
+        return np.where(counts <= k, with_replacement, positions)
+
+    def plan_epoch(self, epoch=None):
+        """
+        Args:
+            - epoch (int): Epoch to plan. Defaults to the current epoch.
+        Output:
+            - batches (ndarray): array of size (num_batches, batch_size) of data point indices
+        """
+        epoch = self.epoch if epoch is None else epoch
+        rng = np.random.default_rng([self.seed, epoch])
+        groups = self._sample_groups(rng)
+        positions = self._sample_points(rng, self.unique_counts[groups])
+        batches = self.group_order[self.group_starts[groups][..., None] + positions]
+        return batches.reshape(self.num_batches, -1)
 
     def __iter__(self):
+        batches = self.plan_epoch()[self.rank::self.num_replicas][:len(self)]
+        self.epoch += 1
+        yield from batches
 
-        for batch_id in range(self.num_batches):
+    def __len__(self):
+        return self.num_batches // self.num_replicas
 
-            # Note that we are selecting group indices rather than groups
-            groups_for_batch = np.random.choice(
-                len(self.unique_groups),
-                size=self.n_groups_per_batch,
-                replace=(not self.distinct_groups),
-                p=self.group_prob)
+def padding_overhead(lengths):
+    """
+    Fraction of the time steps of a batch that are padding when every time series
+    is padded to the longest one in the batch.
+    Args:
+        - lengths (array or Tensor): Lengths of the time series of a batch, of size (B, ),
+                                     or (B, K) for K time series per data point, e.g., one per satellite
+    Output:
+        - overhead (float): Number of padded time steps over the number of time steps after padding
+    """
+    lengths = np.asarray(lengths).reshape(len(lengths), -1)
+    padded = len(lengths) * lengths.max(axis=0).sum() if lengths.size > 0 else 0
+    return 1 - lengths.sum() / padded if padded > 0 else 0.
 
-            sampled_ids = [
-                np.random.choice(
-                    self.group_indices[group],
-                    size=self.n_points_per_group,
-                    replace=len(self.group_indices[group]) <= self.n_points_per_group, # False if the group is larger than the sample size
-                    p=None)
-                for group in groups_for_batch]
+class BucketBatchSampler:
+    """
+        Batches data points with time series of similar lengths, so that padding each
+        batch to its longest time series wastes little compute.
 
-            # Flatten
-            sampled_ids = np.concatenate(sampled_ids)
+        Each epoch, the data points are sorted by length (with ties broken randomly) and
+        cut into buckets of bucket_size consecutive data points. The data points are
+        shuffled within each bucket, each bucket is cut into batches, and the batches of
+        all buckets are shuffled. Only the last batch of the last bucket can be incomplete.
+        Like GroupSampler, epochs are drawn from (seed, epoch), advance after every
+        iteration and can be split over ranks with num_replicas and rank.
+    """
 
-            yield sampled_ids
+    # with lengths spread uniformly, each bucket spans 1/16 of the range of lengths,
+    # which keeps the padding of a batch within a few percent of its time steps
+    DEFAULT_N_BUCKETS = 16
+
+    def __init__(self, lengths, batch_size, bucket_size=None, seed=None, num_replicas=None, rank=None):
+        """
+        Args:
+            - lengths (array or Tensor): Lengths of the time series of each data point, of size (N, ),
+                                         or (N, K) for K time series per data point. Data points
+                                         are sorted by their total length.
+            - batch_size (int): Batch size
+            - bucket_size (int): Number of data points per bucket, rounded up to a multiple of
+                                 batch_size. Defaults to splitting the data points into
+                                 DEFAULT_N_BUCKETS buckets. Smaller buckets pad less, larger
+                                 buckets shuffle more.
+        """
+        self.lengths = np.asarray(lengths).reshape(len(lengths), -1)
+        self.batch_size = batch_size
+        if bucket_size is None:
+            bucket_size = -(-len(self.lengths) // self.DEFAULT_N_BUCKETS)
+        self.bucket_size = -(-bucket_size // batch_size) * batch_size
+        self.num_replicas = 1 if num_replicas is None else num_replicas
+        self.rank = 0 if rank is None else rank
+        self.num_batches = -(-len(self.lengths) // batch_size)
+        if self.num_batches < self.num_replicas:
+            raise ValueError(f'The dataset has only {self.num_batches} batches for {self.num_replicas} ranks.')
+        if seed is None and self.num_replicas > 1:
+            raise ValueError('A seed shared by all ranks is required with num_replicas > 1.')
+        self.seed = _default_seed() if seed is None else seed
+        self.epoch = 0
+        self._total_lengths = self.lengths.sum(axis=1)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def plan_epoch(self, epoch=None):
+        """
+        Args:
+            - epoch (int): Epoch to plan. Defaults to the current epoch.
+        Output:
+            - batches (list of ndarray): Indices of the data points of each batch
+        """
+        epoch = self.epoch if epoch is None else epoch
+        rng = np.random.default_rng([self.seed, epoch])
+        n = len(self._total_lengths)
+        order = np.lexsort((rng.random(n), self._total_lengths))
+        buckets = np.arange(n) // self.bucket_size
+        # random keys in [0, 1) added to the bucket ids shuffle within buckets only
+        order = order[np.argsort(buckets + rng.random(n))]
+        batches = np.split(order, np.arange(self.batch_size, n, self.batch_size))
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def padding_overhead(self, batches=None):
+        """
+        Args:
+            - batches (list of ndarray): Batches of indices. Defaults to the plan of the current epoch.
+        Output:
+            - overhead (ndarray): padding_overhead of each batch
+        """
+        if batches is None:
+            batches = self.plan_epoch()
+        return np.array([padding_overhead(self.lengths[batch]) for batch in batches])
+
+    def __iter__(self):
+        batches = self.plan_epoch()[self.rank::self.num_replicas][:len(self)]
+        self.epoch += 1
+        yield from batches
 
     def __len__(self):
-        return self.num_batches
\ No newline at end of file
+        return self.num_batches // self.num_replicas
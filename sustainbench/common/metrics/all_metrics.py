@@ -4,9 +4,9 @@ import numpy as np
 import torch.nn.functional as F
 from sustainbench.common.metrics.metric import Metric, ElementwiseMetric, MultiTaskMetric
 from sustainbench.common.metrics.loss import ElementwiseLoss
-from sustainbench.common.utils import avg_over_groups, minimum, maximum
-import sklearn.metrics
-from scipy.stats import pearsonr
+from sustainbench.common.metrics.confusion import AVERAGES, check_integer_labels, classification_scores
+from sustainbench.common.metrics.threshold_sweep import ThresholdSweep
+from sustainbench.common.utils import avg_over_groups, reduce_over_groups, minimum, maximum
 
 def binary_logits_to_score(logits):
     assert logits.dim() in (1,2)
@@ -58,53 +58,186 @@ class MultiTaskAccuracy(MultiTaskMetric):
     def worst(self, metrics):
         return minimum(metrics)
 
-class Recall(Metric):
-    def __init__(self, prediction_fn=None, name=None, average='binary'):
+class ConfusionMetric(Metric):
+    """
+    Parent class for precision, recall and F1. The per-group sufficient statistics
+    are the confusion matrices of all groups, built with a single bincount, so
+    the whole group-wise table comes from one pass over the data.
+    Like the sklearn metrics with labels=torch.unique(y_true), 'macro' and 'micro'
+    averages only include the classes that occur in the true labels of a group.
+    """
+    _score_idx = None  # index into the (precision, recall, f1) output of classification_scores
+
+    def __init__(self, prediction_fn=None, name=None, average='binary', n_classes=None, pos_label=1):
+        """
+        Args:
+            - prediction_fn (function): Turns model outputs into predicted labels
+            - average (str): 'binary', 'macro', 'micro', 'weighted', or None for per-class scores
+            - n_classes (int): Number of classes. Inferred from the labels if None; confusion
+                               matrices of different sizes are padded when accumulators are combined.
+            - pos_label (int): Positive class for average='binary'
+        """
+        if average not in AVERAGES:
+            raise ValueError(f'average must be one of {AVERAGES}, got {average}')
         self.prediction_fn = prediction_fn
-        if name is None:
-            name = f'recall'
-            if average is not None:
-                name+=f'-{average}'
         self.average = average
+        self.n_classes = n_classes
+        self.pos_label = pos_label
         super().__init__(name=name)
 
-    def _compute(self, y_pred, y_true):
+    def _labels(self, y_pred, y_true):
         if self.prediction_fn is not None:
             y_pred = self.prediction_fn(y_pred)
-        recall = sklearn.metrics.recall_score(y_true, y_pred, average=self.average, labels=torch.unique(y_true))
-        return torch.tensor(recall)
+        y_pred, y_true = y_pred.reshape(-1), y_true.reshape(-1)
+        check_integer_labels(y_pred)
+        check_integer_labels(y_true)
+        return y_pred.long(), y_true.long()
+
+    def _compute(self, y_pred, y_true):
+        y_pred, y_true = self._labels(y_pred, y_true)
+        g = torch.zeros(y_true.numel(), dtype=torch.long, device=y_true.device)
+        return self._compute_from_stats(self._compute_group_stats(y_pred, y_true, g, 1, labels=True))[0]
+
+    def _compute_group_stats(self, y_pred, y_true, g, n_groups, labels=False):
+        if not labels:
+            y_pred, y_true = self._labels(y_pred, y_true)
+        assert y_pred.numel()==y_true.numel()==g.numel()
+        n_classes = max(self.n_classes or 0, self.pos_label + 1)
+        if y_true.numel() > 0:
+            n_classes = max(n_classes, int(max(y_true.max(), y_pred.max())) + 1)
+        cells = (g * n_classes + y_true) * n_classes + y_pred
+        matrices = torch.bincount(cells, minlength=n_groups * n_classes * n_classes)
+        return matrices.view(n_groups, n_classes * n_classes).double()
+
+    def _pad_stats(self, stats, n_stats):
+        # confusion matrices with inferred numbers of classes can differ in size
+        return _pad_confusion(stats, _n_classes_of_size(n_stats))
+
+    def _compute_from_stats(self, stats):
+        n_classes = _n_classes(stats)
+        matrices = stats.view(-1, n_classes, n_classes)
+        labels_mask = None if self.average in ('binary', 'weighted') else matrices.sum(-1) > 0
+        scores = classification_scores(matrices, average=self.average, pos_label=self.pos_label, labels_mask=labels_mask)
+        return scores[self._score_idx]
 
     def worst(self, metrics):
         return minimum(metrics)
 
-class F1(Metric):
-    def __init__(self, prediction_fn=None, name=None, average='binary'):
-        self.prediction_fn = prediction_fn
+def _n_classes(confusion_stats):
+    return _n_classes_of_size(confusion_stats.size(1))
+
+def _n_classes_of_size(n_stats):
+    n_classes = int(round(n_stats ** 0.5))
+    if n_classes * n_classes != n_stats:
+        raise ValueError(f'{n_stats} statistics are not a flattened confusion matrix')
+    return n_classes
+
+def _pad_confusion(stats, n_classes):
+    current = _n_classes(stats)
+    if current==n_classes:
+        return stats
+    matrices = stats.new_zeros((stats.size(0), n_classes, n_classes))
+    matrices[:, :current, :current] = stats.view(-1, current, current)
+    return matrices.view(stats.size(0), -1)
+
+class Precision(ConfusionMetric):
+    _score_idx = 0
+
+    def __init__(self, prediction_fn=None, name=None, average='binary', n_classes=None, pos_label=1):
         if name is None:
-            name = f'F1'
+            name = f'precision'
             if average is not None:
                 name+=f'-{average}'
-        self.average = average
-        super().__init__(name=name)
+        super().__init__(prediction_fn=prediction_fn, name=name, average=average, n_classes=n_classes, pos_label=pos_label)
 
-    def _compute(self, y_pred, y_true):
-        if self.prediction_fn is not None:
-            y_pred = self.prediction_fn(y_pred)
-        score = sklearn.metrics.f1_score(y_true, y_pred, average=self.average, labels=torch.unique(y_true))
-        return torch.tensor(score)
+class Recall(ConfusionMetric):
+    _score_idx = 1
 
-    def worst(self, metrics):
-        return minimum(metrics)
+    def __init__(self, prediction_fn=None, name=None, average='binary', n_classes=None, pos_label=1):
+        if name is None:
+            name = f'recall'
+            if average is not None:
+                name+=f'-{average}'
+        super().__init__(prediction_fn=prediction_fn, name=name, average=average, n_classes=n_classes, pos_label=pos_label)
+
+class F1(ConfusionMetric):
+    _score_idx = 2
+
+    def __init__(self, prediction_fn=None, name=None, average='binary', n_classes=None, pos_label=1):
+        if name is None:
+            name = f'F1'
+            if average is not None:
+                name+=f'-{average}'
+        super().__init__(prediction_fn=prediction_fn, name=name, average=average, n_classes=n_classes, pos_label=pos_label)
 
 class PearsonCorrelation(Metric):
+    """
+    Pearson correlation coefficient, computed from per-group sufficient statistics
+    (count, means, centered sums of squares and cross-products). Statistics of
+    different batches are merged with the pairwise update of Chan et al., which
+    avoids the cancellation of the naive sum-of-squares formula.
+    """
     def __init__(self, name=None):
         if name is None:
             name = 'r'
         super().__init__(name=name)
 
     def _compute(self, y_pred, y_true):
-        r = pearsonr(y_pred.squeeze().detach().cpu().numpy(), y_true.squeeze().detach().cpu().numpy())[0]
-        return torch.tensor(r)
+        g = torch.zeros(y_true.size(0), dtype=torch.long, device=y_true.device)
+        return self._compute_from_stats(self._compute_group_stats(y_pred, y_true, g, 1))[0]
+
+    def _compute_group_stats(self, y_pred, y_true, g, n_groups):
+        x = y_pred.detach().reshape(-1).double()
+        y = y_true.detach().reshape(-1).double()
+        assert x.numel()==y.numel()==g.numel()
+        n = reduce_over_groups(x, g, n_groups, reduce='count').double()
+        mean_x = reduce_over_groups(x, g, n_groups, reduce='mean')
+        mean_y = reduce_over_groups(y, g, n_groups, reduce='mean')
+        dx = x - mean_x[g]
+        dy = y - mean_y[g]
+        # columns: n, mean_x, mean_y, sum of dx^2, sum of dy^2, sum of dx*dy
+        return torch.stack([
+            n, mean_x, mean_y,
+            reduce_over_groups(dx * dx, g, n_groups, reduce='sum'),
+            reduce_over_groups(dy * dy, g, n_groups, reduce='sum'),
+            reduce_over_groups(dx * dy, g, n_groups, reduce='sum')], dim=1)
+
+    def _merge_stats(self, stats, other_stats):
+        n_a, mean_x_a, mean_y_a, m2x_a, m2y_a, cxy_a = stats.unbind(1)
+        n_b, mean_x_b, mean_y_b, m2x_b, m2y_b, cxy_b = other_stats.unbind(1)
+        n = n_a + n_b
+        delta_x = mean_x_b - mean_x_a
+        delta_y = mean_y_b - mean_y_a
+        weight = n_a * n_b / n.clamp(min=1)
+        return torch.stack([
+            n,
+            mean_x_a + delta_x * n_b / n.clamp(min=1),
+            mean_y_a + delta_y * n_b / n.clamp(min=1),
+            m2x_a + m2x_b + delta_x * delta_x * weight,
+            m2y_a + m2y_b + delta_y * delta_y * weight,
+            cxy_a + cxy_b + delta_x * delta_y * weight], dim=1)
+
+    def _compute_sample_stats(self, y_pred, y_true):
+        # centering by the overall means keeps the raw moments small
+        x = y_pred.detach().reshape(-1).double()
+        y = y_true.detach().reshape(-1).double()
+        dx, dy = x - x.mean(), y - y.mean()
+        # columns: count, dx, dy, dx^2, dy^2, dx*dy
+        return torch.stack([torch.ones_like(dx), dx, dy, dx * dx, dy * dy, dx * dy], dim=1)
+
+    def _compute_from_sample_stats(self, summed_stats):
+        n, sx, sy, sxx, syy, sxy = summed_stats.unbind(-1)
+        n_ = n.clamp(min=1)
+        m2x = (sxx - sx * sx / n_).clamp(min=0)
+        m2y = (syy - sy * sy / n_).clamp(min=0)
+        cxy = sxy - sx * sy / n_
+        return (cxy / torch.sqrt(m2x * m2y)).clamp(min=-1., max=1.)
+
+    def _compute_from_stats(self, stats):
+        m2x, m2y, cxy = stats[:, 3], stats[:, 4], stats[:, 5]
+        # nan for groups with constant predictions or targets, like scipy.stats.pearsonr
+        r = cxy / torch.sqrt(m2x * m2y)
+        return r.clamp(min=-1., max=1.)
 
     def worst(self, metrics):
         return minimum(metrics)
@@ -126,19 +259,47 @@ class MSE(ElementwiseLoss):
             name = 'mse'
         super().__init__(name=name, loss_fn=mse_loss)
 
+def _identity(y_pred):
+    return y_pred
+
 class PrecisionAtRecall(Metric):
     """Given a specific model threshold, determine the precision score achieved"""
     def __init__(self, threshold, score_fn=None, name=None):
-        self.score_fn = score_fn
+        """
+        Args:
+            - threshold (float): Scores above the threshold are predicted positive
+            - score_fn (function): Turns model outputs into scores. Defaults to the identity.
+        """
+        self.score_fn = score_fn if score_fn is not None else _identity
         self.threshold = threshold
         if name is None:
             name = "precision_at_global_recall"
         super().__init__(name=name)
 
+    @classmethod
+    def at_global_recall(cls, y_pred, y_true, global_recall=60, score_fn=None, name=None):
+        """
+        Thresholds at the score that achieves global_recall (in percent) on y_true,
+        like sustainbench.common.utils.threshold_at_recall, from a ThresholdSweep.
+        """
+        score = y_pred if score_fn is None else score_fn(y_pred)
+        threshold = ThresholdSweep(score, y_true).global_threshold_at_recall(global_recall)[0].item()
+        return cls(threshold, score_fn=score_fn, name=name)
+
     def _compute(self, y_pred, y_true):
-        score = self.score_fn(y_pred)
-        predictions = (score > self.threshold)
-        return torch.tensor(sklearn.metrics.precision_score(y_true, predictions))
+        stats = self._compute_sample_stats(y_pred, y_true).sum(0, keepdim=True)
+        return self._compute_from_stats(stats)[0]
+
+    def _compute_sample_stats(self, y_pred, y_true):
+        predictions = (self.score_fn(y_pred) > self.threshold).flatten()
+        true_positives = predictions & (y_true.flatten()==1)
+        # columns: true positive, predicted positive
+        return torch.stack([true_positives, predictions], dim=1).double()
+
+    def _compute_from_stats(self, stats):
+        true_positives, predicted_positives = stats[:, 0], stats[:, 1]
+        # sklearn returns 0 when there are no predicted positives
+        return torch.where(predicted_positives>0, true_positives / predicted_positives.clamp(min=1), torch.zeros_like(true_positives))
 
     def worst(self, metrics):
         return minimum(metrics)
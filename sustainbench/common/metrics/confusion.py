@@ -0,0 +1,153 @@
+import torch
+
+# number of elements per bincount call, which bounds the memory of the
+# int64 copies of the labels to a few hundred MB
+DEFAULT_CHUNK_SIZE = 2**24
+
+AVERAGES = ('binary', 'macro', 'micro', 'weighted', None)
+
+def _flat_labels(labels):
+    if not isinstance(labels, torch.Tensor):
+        labels = torch.as_tensor(labels)
+    return labels.reshape(-1)
+
+def check_integer_labels(labels):
+    """
+    Raises a ValueError for floating-point labels with non-integer values, e.g., scores,
+    which would otherwise be truncated to labels. sklearn rejects these as well.
+    """
+    if labels.is_floating_point() and not torch.equal(labels, labels.round()):
+        raise ValueError('Labels must be integers, got continuous values. '
+                         'Threshold scores into labels first, e.g., with a prediction_fn.')
+
+def confusion_matrix(y_true, y_pred, n_classes, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Computes a confusion matrix with one bincount per chunk of elements.
+    Args:
+        - y_true (Tensor or array): True labels in [0, n_classes), any shape
+        - y_pred (Tensor or array): Predicted labels in [0, n_classes), same number of elements as y_true.
+                                    Floating-point labels must have integer values.
+        - n_classes (int): Number of classes
+        - chunk_size (int): Number of elements to process at once
+    Output:
+        - matrix (LongTensor): tensor of size (n_classes, n_classes), where
+                               matrix[i, j] counts elements with true label i and predicted label j
+    """
+    y_true, y_pred = _flat_labels(y_true), _flat_labels(y_pred)
+    assert y_true.numel()==y_pred.numel()
+    matrix = torch.zeros(n_classes * n_classes, dtype=torch.long, device=y_true.device)
+    for start in range(0, y_true.numel(), chunk_size):
+        t, p = y_true[start:start+chunk_size], y_pred[start:start+chunk_size]
+        check_integer_labels(t)
+        check_integer_labels(p)
+        t = t.long()
+        p = p.to(t.device).long()
+        if t.numel() > 0 and (min(t.min(), p.min()) < 0 or max(t.max(), p.max()) >= n_classes):
+            raise ValueError(f'Labels must be in [0, {n_classes})')
+        matrix += torch.bincount(t * n_classes + p, minlength=n_classes * n_classes)
+    return matrix.view(n_classes, n_classes)
+
+def _divide(numerator, denominator):
+    # numerator is 0 whenever denominator is 0, so this returns 0 like sklearn's zero_division=0
+    return numerator.double() / denominator.double().clamp(min=1)
+
+def _average(per_class, support, present, average, pos_label):
+    """
+    Reduces per-class scores of size (..., C) over the class dimension.
+    """
+    if average is None:
+        return per_class
+    if average=='binary':
+        return per_class[..., pos_label]
+    if average=='macro':
+        return _divide((per_class * present).sum(-1), present.sum(-1))
+    if average=='weighted':
+        return (per_class * support).sum(-1) / support.sum(-1).double().clamp(min=1)
+    raise ValueError(f'average must be one of {AVERAGES}, got {average}')
+
+def classification_scores(matrix, average='macro', pos_label=1, labels_mask=None):
+    """
+    Derives precision, recall and F1 from confusion matrices.
+    Args:
+        - matrix (Tensor): tensor of size (..., C, C), e.g., one confusion matrix per group
+        - average (str): 'binary' (scores of pos_label), 'macro', 'micro', 'weighted', or None for per-class scores
+        - pos_label (int): Positive class for average='binary'
+        - labels_mask (Tensor): Boolean tensor of size (..., C) with the classes to average over,
+                                like sklearn's labels argument. Defaults to the classes that occur
+                                in the true or predicted labels for 'macro', and to all classes for
+                                'micro'.
+    Output:
+        - precision, recall, f1 (Tensor): tensors of size (...), or (..., C) for average=None
+    """
+    if average not in AVERAGES:
+        raise ValueError(f'average must be one of {AVERAGES}, got {average}')
+    true_positives = torch.diagonal(matrix, dim1=-2, dim2=-1)
+    support = matrix.sum(-1)
+    predicted = matrix.sum(-2)
+    if average=='micro':
+        # with all classes, every misclassification is one false positive and one
+        # false negative, so all three scores equal the accuracy
+        if labels_mask is not None:
+            true_positives, support, predicted = true_positives * labels_mask, support * labels_mask, predicted * labels_mask
+        true_positives, support, predicted = true_positives.sum(-1), support.sum(-1), predicted.sum(-1)
+        return (_divide(true_positives, predicted), _divide(true_positives, support),
+                _divide(2 * true_positives, support + predicted))
+    if labels_mask is None:
+        labels_mask = (support + predicted) > 0
+    precision = _divide(true_positives, predicted)
+    recall = _divide(true_positives, support)
+    f1 = _divide(2 * true_positives, support + predicted)
+    return tuple(_average(score, support, labels_mask, average, pos_label) for score in (precision, recall, f1))
+
+def accuracy_from_confusion(matrix):
+    """
+    Accuracy of confusion matrices of size (..., C, C).
+    """
+    return _divide(torch.diagonal(matrix, dim1=-2, dim2=-1).sum(-1), matrix.sum((-2, -1)))
+
+def iou_from_confusion(matrix):
+    """
+    Per-class intersection over union (Jaccard index) of confusion matrices of size (..., C, C).
+    Output:
+        - iou (Tensor): tensor of size (..., C). Classes that occur in neither labels nor predictions get 0.
+    """
+    true_positives = torch.diagonal(matrix, dim1=-2, dim2=-1)
+    union = matrix.sum(-1) + matrix.sum(-2) - true_positives
+    return _divide(true_positives, union)
+
+class ConfusionMatrix:
+    """
+    Accumulates a confusion matrix over batches of labels, e.g., segmentation masks,
+    so that all metrics come from a single pass over the elements:
+
+        confusion = ConfusionMatrix(n_classes=2)
+        for y_true, y_pred in batches:
+            confusion.update(y_true, y_pred)
+        precision, recall, f1 = confusion.scores(average='binary')
+    """
+    def __init__(self, n_classes, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.n_classes = n_classes
+        self.chunk_size = chunk_size
+        self.matrix = torch.zeros((n_classes, n_classes), dtype=torch.long)
+
+    def update(self, y_true, y_pred):
+        """
+        Args:
+            - y_true (Tensor or array): True labels in [0, n_classes)
+            - y_pred (Tensor or array): Predicted labels in [0, n_classes)
+        """
+        matrix = confusion_matrix(y_true, y_pred, self.n_classes, chunk_size=self.chunk_size)
+        self.matrix = self.matrix.to(matrix.device) + matrix
+
+    def accuracy(self):
+        return accuracy_from_confusion(self.matrix)
+
+    def scores(self, average='macro', pos_label=1):
+        """
+        Output:
+            - precision, recall, f1 (Tensor): see classification_scores
+        """
+        return classification_scores(self.matrix, average=average, pos_label=pos_label)
+
+    def iou(self):
+        return iou_from_confusion(self.matrix)
@@ -1,5 +1,5 @@
 import numpy as np
-from sustainbench.common.utils import avg_over_groups, get_counts
+from sustainbench.common.utils import avg_over_groups, get_counts, reduce_over_groups, sort_by_group
 import torch
 
 class Metric:
@@ -21,6 +21,88 @@ class Metric:
         """
         return NotImplementedError
 
+    def _compute_sample_stats(self, y_pred, y_true):
+        """
+        Helper function for computing additive per-sample sufficient statistics,
+        i.e., statistics whose sums over a set of data points determine the metric
+        on that set (e.g., the element-wise metric and a count of 1 for averages).
+        Subclasses can implement this together with _compute_from_stats,
+        so that group-wise evaluation takes a single pass over the data and
+        bootstrap replicates can be computed with weighted sums.
+        Args:
+            - y_pred (Tensor): Predicted targets or model output
+            - y_true (Tensor): True targets
+        Output:
+            - stats (Tensor): tensor of size (batch_size, n_stats),
+                              or None if the metric has no sufficient statistics
+        """
+        return None
+
+    def _compute_group_stats(self, y_pred, y_true, g, n_groups):
+        """
+        Helper function for computing per-group sufficient statistics.
+        Defaults to the per-group sums of _compute_sample_stats.
+        Args:
+            - y_pred (Tensor): Predicted targets or model output
+            - y_true (Tensor): True targets
+            - g (Tensor): groups
+            - n_groups (int): number of groups
+        Output:
+            - stats (Tensor): tensor of size (n_groups, n_stats),
+                              or None if the metric has no sufficient statistics
+        """
+        sample_stats = self._compute_sample_stats(y_pred, y_true)
+        if sample_stats is None:
+            return None
+        return reduce_over_groups(sample_stats.double(), g, n_groups, reduce='sum')
+
+    def _compute_from_sample_stats(self, summed_stats):
+        """
+        Helper function for computing the metric from sums of _compute_sample_stats.
+        Defaults to _compute_from_stats, for metrics whose group statistics are these sums.
+        Args:
+            - summed_stats (Tensor): tensor of size (..., n_stats)
+        Output:
+            - metrics (Tensor): tensor of size (..., )
+        """
+        shape = summed_stats.shape[:-1]
+        return self._compute_from_stats(summed_stats.reshape(-1, summed_stats.size(-1))).view(shape)
+
+    def _compute_from_stats(self, stats):
+        """
+        Helper function for computing the metric from sufficient statistics.
+        Args:
+            - stats (Tensor): tensor of size (n_groups, n_stats) from _compute_group_stats
+        Output:
+            - group_metrics (Tensor): tensor of size (n_groups, )
+        """
+        raise NotImplementedError
+
+    def _merge_stats(self, stats, other_stats):
+        """
+        Combines the sufficient statistics of two disjoint sets of data points.
+        Defaults to summing them (after _pad_stats to a common size), which suits counts and sums.
+        """
+        n_stats = max(stats.size(-1), other_stats.size(-1))
+        return self._pad_stats(stats, n_stats) + self._pad_stats(other_stats, n_stats)
+
+    def _pad_stats(self, stats, n_stats):
+        """
+        Brings sufficient statistics to size (n_groups, n_stats), for metrics whose number
+        of statistics depends on the data (e.g., confusion matrices with an inferred
+        number of classes). The padded statistics must describe the same data points.
+        Defaults to requiring that the size already matches.
+        """
+        if stats.size(-1)!=n_stats:
+            raise ValueError(f'{type(self).__name__} cannot pad {stats.size(-1)} sufficient statistics to {n_stats}')
+        return stats
+
+    def _compute_group_counts(self, y_pred, y_true, g, n_groups):
+        """
+        Number of data points in each group, as reported by compute_group_wise.
+        """
+        return get_counts(g, n_groups)
+
     def worst(self, metrics):
         """
         Given a list/numpy array/Tensor of metrics, computes the worst-case metric
@@ -113,30 +195,421 @@ class Metric:
         """
         group_metrics, group_counts, worst_group_metric = self._compute_group_wise(y_pred, y_true, g, n_groups)
         if return_dict:
-            results = {}
-            for group_idx in range(n_groups):
-                results[self.group_metric_field(group_idx)] = group_metrics[group_idx].item()
-                results[self.group_count_field(group_idx)] = group_counts[group_idx].item()
-            results[self.worst_group_metric_field] = worst_group_metric.item()
-            return results
+            return self._group_results_dict(group_metrics, group_counts, worst_group_metric)
         else:
             return group_metrics, group_counts, worst_group_metric
 
+    def compute_group_results(self, y_pred, y_true, g, n_groups, aggregate=False):
+        """
+        Like compute_group_wise, but returns a GroupResults that stays on the device
+        of the inputs until it is converted to a dictionary or string.
+        Args:
+            - aggregate (bool): Whether to also compute the metric on all data points
+        Output:
+            - results (GroupResults)
+        """
+        group_metrics, group_counts, worst_group_metric = self._compute_group_wise(y_pred, y_true, g, n_groups)
+        agg_metric = self.compute(y_pred, y_true, return_dict=False) if aggregate else None
+        return GroupResults(self, group_metrics, group_counts, worst_group_metric, agg_metric=agg_metric)
+
+    def _group_results_dict(self, group_metrics, group_counts, worst_group_metric):
+        return GroupResults(self, group_metrics, group_counts, worst_group_metric).to_dict()
+
+    def bootstrap_group_wise(self, y_pred, y_true, g, n_groups, n_bootstrap=1000, seed=None, chunk_size=2**24):
+        """
+        Computes the metric overall, per group and for the worst group on bootstrap
+        resamples of the data points. Each replicate draws N data points with replacement,
+        represented by a row of multinomial counts in a (n_bootstrap, N) weight matrix.
+        For metrics with per-sample sufficient statistics (see _compute_sample_stats),
+        all replicates follow from weighted sums computed with batched tensor ops,
+        processing chunk_size elements at a time. Other metrics are recomputed per replicate.
+        Args:
+            - y_pred (Tensor): Predicted targets or model output
+            - y_true (Tensor): True targets
+            - g (Tensor): groups
+            - n_groups (int): number of groups
+            - n_bootstrap (int): number of bootstrap replicates
+            - seed (int): seed of the resampling
+            - chunk_size (int): maximum number of elements of the intermediate weighted statistics
+        Output:
+            - agg_metrics (Tensor): tensor of size (n_bootstrap, )
+            - group_metrics (Tensor): tensor of size (n_bootstrap, n_groups).
+                                      nan for groups that are absent in a replicate.
+            - worst_group_metrics (Tensor): tensor of size (n_bootstrap, )
+        """
+        generator = torch.Generator()
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        device = y_true.device
+        n = y_true.size(0)
+        if n==0:
+            return torch.zeros(n_bootstrap), torch.full((n_bootstrap, n_groups), float('nan')), torch.zeros(n_bootstrap)
+
+        sample_stats = self._compute_sample_stats(y_pred, y_true)
+        if sample_stats is not None:
+            sample_stats = sample_stats.detach().double()
+        n_stats = 1 if sample_stats is None else sample_stats.size(1)
+        rows_per_chunk = max(1, chunk_size // (n * n_stats))
+        agg_metrics, group_metrics, group_counts = [], [], []
+        for start in range(0, n_bootstrap, rows_per_chunk):
+            n_rows = min(rows_per_chunk, n_bootstrap - start)
+            idxs = torch.randint(n, (n_rows, n), generator=generator).to(device)
+            if sample_stats is None:
+                for idx in idxs:
+                    agg_metrics.append(self.compute(y_pred[idx], y_true[idx], return_dict=False).double())
+                    metrics, counts, _ = self._compute_group_wise(y_pred[idx], y_true[idx], g[idx], n_groups)
+                    group_metrics.append(metrics.double())
+                    group_counts.append(counts)
+                continue
+            weights = torch.zeros((n_rows, n), dtype=torch.double, device=device)
+            weights.scatter_add_(1, idxs, torch.ones_like(weights))
+            stats = torch.zeros((n_rows, n_groups, n_stats), dtype=torch.double, device=device)
+            stats.index_add_(1, g, weights.unsqueeze(2) * sample_stats.unsqueeze(0))
+            counts = torch.zeros((n_rows, n_groups), dtype=torch.double, device=device)
+            counts.index_add_(1, g, weights)
+            agg_metrics.extend(self._compute_from_sample_stats(stats.sum(1)))
+            group_metrics.extend(self._compute_from_sample_stats(stats))
+            group_counts.extend(counts)
+
+        agg_metrics = torch.stack(agg_metrics)
+        group_metrics = torch.stack(group_metrics)
+        group_counts = torch.stack(group_counts)
+        worst_group_metrics = torch.stack([
+            torch.as_tensor(self.worst(metrics[counts>0]), dtype=torch.double, device=device)
+            for metrics, counts in zip(group_metrics, group_counts)])
+        group_metrics = torch.where(group_counts>0, group_metrics, torch.full_like(group_metrics, float('nan')))
+        return agg_metrics, group_metrics, worst_group_metrics
+
+    def accumulator(self, n_groups):
+        """
+        Returns a MetricAccumulator for computing this metric group-wise over batches.
+        Args:
+            - n_groups (int): number of groups
+        """
+        return MetricAccumulator(self, n_groups)
+
     def _compute_group_wise(self, y_pred, y_true, g, n_groups):
+        group_counts = self._compute_group_counts(y_pred, y_true, g, n_groups)
+        stats = self._compute_group_stats(y_pred, y_true, g, n_groups)
+        if stats is not None:
+            group_metrics = self._compute_from_stats(stats)
+            group_metrics = torch.where(group_counts>0, group_metrics, torch.zeros_like(group_metrics))
+        else:
+            group_metrics = self._compute_segment_wise(y_pred, y_true, g, n_groups)
+        worst_group_metric = self.worst(group_metrics[group_counts>0])
+
+        return group_metrics, group_counts, worst_group_metric
+
+    def _compute_segment_wise(self, y_pred, y_true, g, n_groups):
+        """
+        Sorts the data points by group once and calls _compute once per non-empty
+        group on a contiguous slice. Empty groups get tensor(0.).
+        """
+        order, offsets = sort_by_group(g, n_groups)
+        y_pred, y_true = y_pred[order], y_true[order]
+        offsets = offsets.tolist()
         group_metrics = []
-        group_counts = get_counts(g, n_groups)
         for group_idx in range(n_groups):
-            if group_counts[group_idx]==0:
+            start, end = offsets[group_idx], offsets[group_idx+1]
+            if start==end:
                 group_metrics.append(torch.tensor(0., device=g.device))
             else:
-                group_metrics.append(
-                    self._compute(
-                        y_pred[g == group_idx],
-                        y_true[g == group_idx]))
-        group_metrics = torch.stack(group_metrics)
-        worst_group_metric = self.worst(group_metrics[group_counts>0])
+                group_metrics.append(self._compute(y_pred[start:end], y_true[start:end]))
+        return torch.stack(group_metrics)
 
-        return group_metrics, group_counts, worst_group_metric
+def percentile_interval(replicates, confidence=0.95):
+    """
+    Percentile bootstrap confidence interval.
+    Args:
+        - replicates (Tensor): tensor of size (n_bootstrap, ...) of replicate metrics. nans are ignored.
+        - confidence (float): coverage of the interval
+    Output:
+        - lower, upper (Tensor): tensors of size (...)
+    """
+    alpha = (1 - confidence) / 2
+    q = torch.tensor([alpha, 1 - alpha], dtype=torch.double, device=replicates.device)
+    lower, upper = _nanquantile(replicates.double(), q)
+    return lower, upper
+
+def _nanquantile(values, q):
+    """
+    torch.nanquantile(values, q, dim=0) with linear interpolation, from a single sort,
+    since torch.nanquantile needs torch >= 1.8. Columns without values are nan.
+    """
+    # sort puts nans last
+    values = values.sort(dim=0)[0]
+    n_valid = (~torch.isnan(values)).sum(0)
+    pos = q.view((-1,) + (1,) * (values.dim() - 1)) * (n_valid - 1).clamp(min=0)
+    lower_idx, upper_idx = pos.floor().long(), pos.ceil().long()
+    lower, upper = values.gather(0, lower_idx), values.gather(0, upper_idx)
+    quantiles = lower + (upper - lower) * (pos - lower_idx)
+    return torch.where(n_valid>0, quantiles, torch.full_like(quantiles, float('nan')))
+
+class GroupResults:
+    """
+    Group-wise results of a metric, kept in a single tensor on the device they were
+    computed on, so that computing them does not synchronize with the host:
+
+        results = metric.compute_group_results(y_pred, y_true, g, n_groups)
+        results.group_metrics                # Tensor on the device of y_pred
+        results.to_dict()                    # same as metric.compute_group_wise(...)
+
+    to_dict(), tolist() and to_str() copy the tensor to the host once and cache the copy.
+    """
+    def __init__(self, metric, group_metrics, group_counts, worst_group_metric, agg_metric=None):
+        """
+        Args:
+            - metric (Metric): Metric whose field names the dictionary uses
+            - group_metrics (Tensor): tensor of size (n_groups, )
+            - group_counts (Tensor): tensor of size (n_groups, )
+            - worst_group_metric (0-dim tensor): worst-group metric
+            - agg_metric (0-dim tensor): Metric on all data points, if computed
+        """
+        self.metric = metric
+        self.n_groups = group_metrics.numel()
+        device = group_metrics.device
+        values = [group_metrics.reshape(-1), group_counts.reshape(-1), worst_group_metric.reshape(1)]
+        if agg_metric is not None:
+            values.append(agg_metric.reshape(1))
+        # layout: group metrics, group counts, worst-group metric[, aggregate metric]
+        self.values = torch.cat([v.to(device=device, dtype=torch.double) for v in values])
+        self.has_agg_metric = agg_metric is not None
+        self._host_values = None
+
+    @property
+    def group_metrics(self):
+        return self.values[:self.n_groups]
+
+    @property
+    def group_counts(self):
+        return self.values[self.n_groups:2*self.n_groups]
+
+    @property
+    def worst_group_metric(self):
+        return self.values[2*self.n_groups]
+
+    @property
+    def agg_metric(self):
+        return self.values[2*self.n_groups+1] if self.has_agg_metric else None
+
+    def tolist(self):
+        """
+        Output:
+            - group_metrics (list): Metric of each group
+            - group_counts (list): Count of each group
+            - worst_group_metric (float): Worst-group metric
+            - agg_metric (float): Metric on all data points, or None
+        """
+        if self._host_values is None:
+            self._host_values = self.values.tolist()
+        values, n = self._host_values, self.n_groups
+        agg_metric = values[2*n+1] if self.has_agg_metric else None
+        return values[:n], values[n:2*n], values[2*n], agg_metric
+
+    def to_dict(self):
+        """
+        Output:
+            - results (dict): Dictionary of results, with the keys of Metric.compute_group_wise
+                              and, if computed, Metric.compute
+        """
+        group_metrics, group_counts, worst_group_metric, agg_metric = self.tolist()
+        results = {}
+        if agg_metric is not None:
+            results[self.metric.agg_metric_field] = agg_metric
+        for group_idx in range(self.n_groups):
+            results[self.metric.group_metric_field(group_idx)] = group_metrics[group_idx]
+            results[self.metric.group_count_field(group_idx)] = group_counts[group_idx]
+        results[self.metric.worst_group_metric_field] = worst_group_metric
+        return results
+
+    def to_str(self, group_str=None):
+        """
+        Args:
+            - group_str (function): Maps a group index to its description, e.g., grouper.group_str
+        Output:
+            - results_str (str): Pretty print version of the results. Empty groups are skipped.
+        """
+        if group_str is None:
+            group_str = lambda group_idx: f'group {group_idx}'
+        group_metrics, group_counts, worst_group_metric, agg_metric = self.tolist()
+        name = self.metric.name
+        results_str = ''
+        if agg_metric is not None:
+            results_str += f'Average {name}: {agg_metric:.3f}\n'
+        for group_idx in range(self.n_groups):
+            if group_counts[group_idx] == 0:
+                continue
+            results_str += (
+                f'  {group_str(group_idx)}  '
+                f'[n = {group_counts[group_idx]:6.0f}]:\t'
+                f'{name} = {group_metrics[group_idx]:5.3f}\n')
+        results_str += f'Worst-group {name}: {worst_group_metric:.3f}\n'
+        return results_str
+
+    def __str__(self):
+        return self.to_str()
+
+class MetricAccumulator:
+    """
+    Computes a metric group-wise over a stream of batches, e.g., an eval loop:
+
+        accumulator = metric.accumulator(grouper.n_groups)
+        for y_pred, y_true, g in batches:
+            accumulator.update(y_pred, y_true, g)
+        results = accumulator.finalize()
+
+    The results are the same as those of metric.compute_group_wise on the
+    concatenated batches. For metrics with sufficient statistics
+    (see Metric._compute_group_stats), only the per-group statistics are kept,
+    so memory does not grow with the number of batches. Other metrics keep the
+    batches and compute the metric on finalize().
+    """
+    def __init__(self, metric, n_groups):
+        self.metric = metric
+        self.n_groups = n_groups
+        self.stats = None
+        self.group_counts = None
+        self._batches = []
+
+    def update(self, y_pred, y_true, g):
+        """
+        Args:
+            - y_pred (Tensor): Predicted targets or model output of a batch
+            - y_true (Tensor): True targets of a batch
+            - g (Tensor): groups of a batch
+        """
+        stats = self.metric._compute_group_stats(y_pred, y_true, g, self.n_groups)
+        if stats is None:
+            self._batches.append((y_pred.detach(), y_true.detach(), g.detach()))
+            return
+        stats = stats.detach()
+        group_counts = self.metric._compute_group_counts(y_pred, y_true, g, self.n_groups)
+        if self.stats is None:
+            self.stats, self.group_counts = stats, group_counts
+        else:
+            self.stats = self.metric._merge_stats(self.stats, stats)
+            self.group_counts = self.group_counts + group_counts
+
+    def merge(self, other):
+        """
+        Adds the data points seen by another accumulator of the same metric and groups,
+        e.g., of another shard or split evaluated separately, without torch.distributed.
+        Sufficient statistics of different sizes (e.g., confusion matrices with a number
+        of classes inferred from each part) are padded to a common size.
+        Args:
+            - other (MetricAccumulator): Accumulator to add. It is left unchanged.
+        Output:
+            - self
+        """
+        if other.n_groups!=self.n_groups:
+            raise ValueError(f'Cannot merge accumulators over {other.n_groups} and {self.n_groups} groups')
+        self._batches.extend(other._batches)
+        if other.stats is not None:
+            if self.stats is None:
+                self.stats, self.group_counts = other.stats.clone(), other.group_counts.clone()
+            else:
+                self.stats = self.metric._merge_stats(self.stats, other.stats.to(self.stats.device))
+                self.group_counts = self.group_counts + other.group_counts.to(self.group_counts.device)
+        return self
+
+    def reduce(self, dst=0, group=None):
+        """
+        Combines the accumulators of all processes of a torch.distributed process group
+        on rank dst, e.g., after evaluating a shard of the data on each rank.
+        Sufficient statistics are summed with dist.reduce, or gathered and merged with
+        Metric._merge_stats for metrics with a custom merge, so the communication
+        grows with n_groups rather than with the number of data points.
+        Metrics without sufficient statistics gather their batches instead.
+        All ranks of the group must call this. Afterwards, the accumulators of the
+        other ranks are empty.
+        Args:
+            - dst (int): Rank that receives the combined statistics
+            - group (ProcessGroup): Process group to reduce over. Defaults to the world.
+        """
+        import torch.distributed as dist
+        is_dst = dist.get_rank()==dst
+        world_size = dist.get_world_size(group)
+        info = (None if self.stats is None else tuple(self.stats.shape), bool(self._batches))
+        infos = [None] * world_size
+        dist.all_gather_object(infos, info, group=group)
+
+        if any(has_batches for _, has_batches in infos):
+            batches = [tuple(t.cpu() for t in batch) for batch in self._batches]
+            gathered = [None] * world_size if is_dst else None
+            dist.gather_object(batches, gathered, dst=dst, group=group)
+            self._batches = [batch for rank_batches in gathered for batch in rank_batches] if is_dst else []
+            return
+        shapes = [shape for shape, _ in infos if shape is not None]
+        if not shapes:
+            return
+        # e.g., confusion matrices whose number of classes was inferred from each shard
+        n_stats = max(shape[-1] for shape in shapes)
+
+        if self.stats is None:
+            # zero statistics describe an empty set of data points
+            device = _reduction_device(group)
+            self.stats = torch.zeros((self.n_groups, n_stats), dtype=torch.double, device=device)
+            self.group_counts = torch.zeros(self.n_groups, device=device)
+        else:
+            self.stats = self.metric._pad_stats(self.stats, n_stats)
+        if type(self.metric)._merge_stats is Metric._merge_stats:
+            dist.reduce(self.stats, dst=dst, op=dist.ReduceOp.SUM, group=group)
+        else:
+            gathered = [torch.empty_like(self.stats) for _ in range(world_size)] if is_dst else None
+            dist.gather(self.stats, gathered, dst=dst, group=group)
+            if is_dst:
+                stats = gathered[0]
+                for other_stats in gathered[1:]:
+                    stats = self.metric._merge_stats(stats, other_stats)
+                self.stats = stats
+        dist.reduce(self.group_counts, dst=dst, op=dist.ReduceOp.SUM, group=group)
+        if not is_dst:
+            self.stats, self.group_counts = None, None
+
+    def finalize(self, return_dict=True, distributed=False, dst=0, group=None):
+        """
+        Args:
+            - return_dict (bool): Whether to return the output as a dictionary or tensors
+            - distributed (bool): Whether to first combine the accumulators of all
+                                  processes with reduce(). Only rank dst returns results.
+            - dst (int): Rank that computes the results if distributed
+            - group (ProcessGroup): Process group if distributed
+        Output:
+            - Same as Metric.compute_group_wise(return_dict=return_dict) on all batches seen so far,
+              or None on ranks other than dst if distributed
+        """
+        if distributed:
+            import torch.distributed as dist
+            self.reduce(dst=dst, group=group)
+            if dist.get_rank()!=dst:
+                return None
+        if self._batches:
+            y_pred, y_true, g = (torch.cat(tensors) for tensors in zip(*self._batches))
+            return self.metric.compute_group_wise(y_pred, y_true, g, self.n_groups, return_dict=return_dict)
+        if self.stats is None:
+            group_metrics = torch.zeros(self.n_groups)
+            group_counts = torch.zeros(self.n_groups)
+        else:
+            group_counts = self.group_counts
+            group_metrics = self.metric._compute_from_stats(self.stats)
+            group_metrics = torch.where(group_counts>0, group_metrics, torch.zeros_like(group_metrics))
+        worst_group_metric = self.metric.worst(group_metrics[group_counts>0])
+        if return_dict:
+            return self.metric._group_results_dict(group_metrics, group_counts, worst_group_metric)
+        else:
+            return group_metrics, group_counts, worst_group_metric
+
+def _reduction_device(group=None):
+    """
+    Device of the tensors that torch.distributed reduces over group:
+    the current CUDA device for NCCL, the CPU otherwise.
+    """
+    import torch.distributed as dist
+    if dist.get_backend(group)==dist.Backend.NCCL:
+        return torch.device('cuda', torch.cuda.current_device())
+    return torch.device('cpu')
 
 class ElementwiseMetric(Metric):
     """
@@ -182,6 +655,14 @@ class ElementwiseMetric(Metric):
         worst_group_metric = self.worst(group_metrics[group_counts>0])
         return group_metrics, group_counts, worst_group_metric
 
+    def _compute_sample_stats(self, y_pred, y_true):
+        element_wise_metrics = self._compute_element_wise(y_pred, y_true).double()
+        # columns: element-wise metric, count
+        return torch.stack([element_wise_metrics, torch.ones_like(element_wise_metrics)], dim=1)
+
+    def _compute_from_stats(self, stats):
+        return (stats[:, 0] / stats[:, 1].clamp(min=1)).float()
+
     @property
     def agg_metric_field(self):
         """
@@ -236,6 +717,21 @@ class MultiTaskMetric(Metric):
         worst_group_metric = self.worst(group_metrics[group_counts>0])
         return group_metrics, group_counts, worst_group_metric
 
+    def _compute_sample_stats(self, y_pred, y_true):
+        flattened_metrics, indices = self.compute_flattened(y_pred, y_true, return_dict=False)
+        # columns: sum of the metric over the labeled entries of each data point, number of labeled entries
+        stats = torch.zeros((y_true.size(0), 2), dtype=torch.double, device=y_true.device)
+        stats.index_add_(0, indices, torch.stack([flattened_metrics.double(), torch.ones_like(flattened_metrics, dtype=torch.double)], dim=1))
+        return stats
+
+    def _compute_from_stats(self, stats):
+        return (stats[:, 0] / stats[:, 1].clamp(min=1)).float()
+
+    def _compute_group_counts(self, y_pred, y_true, g, n_groups):
+        # only labeled entries are counted
+        _, indices = self.compute_flattened(y_pred, y_true, return_dict=False)
+        return get_counts(g[indices], n_groups)
+
     def compute_flattened(self, y_pred, y_true, return_dict=True):
         is_labeled = ~torch.isnan(y_true)
         batch_idx = torch.where(is_labeled)[0]
@@ -0,0 +1,177 @@
+import torch
+
+def _sorted_percentile(values, starts, counts, percentiles):
+    """
+    Percentiles of consecutive sorted segments of values, with the linear
+    interpolation of numpy.percentile.
+    Args:
+        - values (Tensor): Values, sorted within each segment
+        - starts (LongTensor): Start of each segment, of size (S, )
+        - counts (LongTensor): Length of each segment, of size (S, )
+        - percentiles (Tensor): Percentiles in [0, 100], of size (P, )
+    Output:
+        - percentiles (Tensor): tensor of size (S, P). nan for empty segments.
+    """
+    q = percentiles.to(device=values.device, dtype=torch.double).reshape(1, -1) / 100
+    counts, starts = counts.unsqueeze(1), starts.unsqueeze(1)
+    if values.numel()==0:
+        return torch.full((counts.size(0), q.size(1)), float('nan'), dtype=torch.double, device=values.device)
+    position = q * (counts - 1).clamp(min=0)
+    lower = position.floor().long()
+    upper = torch.minimum(lower + 1, (counts - 1).clamp(min=0))
+    last = values.numel() - 1
+    values = values.double()
+    lower_values = values[(starts + lower).clamp(max=last)]
+    upper_values = values[(starts + upper).clamp(max=last)]
+    result = lower_values + (position - lower) * (upper_values - lower_values)
+    return torch.where(counts > 0, result, torch.full_like(result, float('nan')))
+
+class ThresholdSweep:
+    """
+    Binary classification metrics at many decision thresholds from a single sort.
+    The scores are sorted once (by group, then by score), after which the true and
+    false positive counts at any set of thresholds follow from binary searches and
+    cumulative sums, optionally for every group at once:
+
+        sweep = ThresholdSweep(scores, y_true)
+        thresholds, precision, recall, accuracy = sweep.curve()
+        auc = sweep.auc()
+        precision_at_60 = sweep.precision_at_recall(60)
+
+    All outputs have a leading dimension of size n_groups (1 without groups).
+    """
+    def __init__(self, y_score, y_true, g=None, n_groups=None):
+        """
+        Args:
+            - y_score (Tensor): Scores of the positive class, any shape
+            - y_true (Tensor): Binary labels, same number of elements as y_score
+            - g (Tensor): Groups of the data points. All data points form one group if None.
+            - n_groups (int): Number of groups
+        """
+        scores = y_score.detach().reshape(-1)
+        labels = (y_true.reshape(-1)==1).to(scores.device)
+        assert scores.numel()==labels.numel()
+        if g is None:
+            g = torch.zeros(scores.numel(), dtype=torch.long, device=scores.device)
+            n_groups = 1
+        self.n_groups = n_groups
+
+        # the only sort over the data points: distinct scores and their ranks
+        self.unique_scores, ranks = torch.unique(scores, sorted=True, return_inverse=True)
+        # keys increase with the group and, within a group, with the score
+        self._stride = self.unique_scores.numel() + 1
+        keys, order = torch.sort(g * self._stride + ranks)
+        self._keys = keys
+        sorted_labels = labels[order].long()
+        # _positives_from[i] is the number of positives at sorted positions >= i
+        self._positives_from = torch.zeros(scores.numel() + 1, dtype=torch.long, device=scores.device)
+        self._positives_from[:-1] = torch.flip(torch.cumsum(torch.flip(sorted_labels, [0]), 0), [0])
+
+        counts = torch.bincount(g, minlength=n_groups)
+        self._group_ends = torch.cumsum(counts, 0)
+        self.n_samples = counts
+        self.n_positives = torch.bincount(g[labels], minlength=n_groups)
+        # scores of the positives, sorted within each group, for threshold_at_recall
+        self._positive_scores = self.unique_scores[ranks[order][sorted_labels.bool()]]
+        self._positive_ends = torch.cumsum(self.n_positives, 0)
+        self._positive_rank_counts = torch.bincount(ranks[labels], minlength=self.unique_scores.numel())
+
+    def counts_at(self, thresholds, strict=True):
+        """
+        Confusion counts when predicting positive for scores above the thresholds.
+        Args:
+            - thresholds (Tensor or float): Thresholds, of size (T, ) or (n_groups, T) for per-group thresholds
+            - strict (bool): Whether positives are score > threshold (True) or score >= threshold (False)
+        Output:
+            - tp, fp, tn, fn (LongTensor): tensors of size (n_groups, T)
+        """
+        thresholds = torch.as_tensor(thresholds, dtype=self.unique_scores.dtype, device=self.unique_scores.device)
+        thresholds = thresholds.reshape(-1, thresholds.size(-1)) if thresholds.dim() > 0 else thresholds.reshape(1, 1)
+        # rank of the first distinct score that counts as positive
+        threshold_ranks = torch.searchsorted(self.unique_scores, thresholds.contiguous(), right=strict)
+        group_idxs = torch.arange(self.n_groups, device=self._keys.device).unsqueeze(1)
+        starts = torch.searchsorted(self._keys, (group_idxs * self._stride + threshold_ranks).contiguous())
+        ends = self._group_ends.unsqueeze(1).expand_as(starts)
+        tp = self._positives_from[starts] - self._positives_from[ends]
+        fp = (ends - starts) - tp
+        fn = self.n_positives.unsqueeze(1) - tp
+        tn = (self.n_samples - self.n_positives).unsqueeze(1) - fp
+        return tp, fp, tn, fn
+
+    def scores_at(self, thresholds, strict=True):
+        """
+        Output:
+            - precision, recall, accuracy (Tensor): tensors of size (n_groups, T).
+                                                     Precision is 0 without predicted positives, like sklearn.
+        """
+        tp, fp, tn, fn = (counts.double() for counts in self.counts_at(thresholds, strict=strict))
+        precision = tp / (tp + fp).clamp(min=1)
+        recall = tp / (tp + fn).clamp(min=1)
+        accuracy = (tp + tn) / (tp + fp + tn + fn).clamp(min=1)
+        return precision, recall, accuracy
+
+    def curve(self):
+        """
+        Precision, recall and accuracy at every distinct score, predicting positive
+        for scores >= threshold.
+        Output:
+            - thresholds (Tensor): Distinct scores in increasing order, of size (U, )
+            - precision, recall, accuracy (Tensor): tensors of size (n_groups, U)
+        """
+        return (self.unique_scores,) + self.scores_at(self.unique_scores, strict=False)
+
+    def auc(self):
+        """
+        Area under the ROC curve of each group, like sklearn.metrics.roc_auc_score.
+        nan for groups without positives or without negatives.
+        Output:
+            - auc (Tensor): tensor of size (n_groups, )
+        """
+        tp, fp, _, _ = self.counts_at(self.unique_scores, strict=False)
+        zeros = torch.zeros((self.n_groups, 1), dtype=tp.dtype, device=tp.device)
+        # decreasing thresholds, starting from predicting everything negative
+        tpr = torch.cat([zeros, torch.flip(tp, [1])], dim=1).double() / self.n_positives.unsqueeze(1).double()
+        fpr = torch.cat([zeros, torch.flip(fp, [1])], dim=1).double() / (self.n_samples - self.n_positives).unsqueeze(1).double()
+        return torch.trapz(tpr, fpr, dim=1)
+
+    def threshold_at_recall(self, recall):
+        """
+        Thresholds at which predicting score > threshold achieves the given recall in each
+        group, like sustainbench.common.utils.threshold_at_recall (the (100 - recall)-th
+        percentile of the scores of the positives, with linear interpolation).
+        Args:
+            - recall (float or Tensor): Recall targets in percent, of size (R, )
+        Output:
+            - thresholds (Tensor): tensor of size (n_groups, R). nan for groups without positives.
+        """
+        starts = self._positive_ends - self.n_positives
+        return _sorted_percentile(self._positive_scores, starts, self.n_positives, 100 - torch.as_tensor(recall))
+
+    def global_threshold_at_recall(self, recall):
+        """
+        Like threshold_at_recall, over the data points of all groups.
+        Output:
+            - thresholds (Tensor): tensor of size (R, )
+        """
+        # the positives in increasing order of score, from the ranks computed by the sort
+        positive_scores = self.unique_scores.repeat_interleave(self._positive_rank_counts)
+        n_positives = self.n_positives.sum().reshape(1)
+        return _sorted_percentile(positive_scores, torch.zeros_like(n_positives), n_positives,
+                                  100 - torch.as_tensor(recall))[0]
+
+    def precision_at_recall(self, recall, global_threshold=True):
+        """
+        Precision when thresholding at the given recall, like PrecisionAtRecall.
+        Args:
+            - recall (float or Tensor): Recall targets in percent, of size (R, )
+            - global_threshold (bool): Whether all groups use the threshold that achieves the
+                                       recall on all data points (as in BrickKilnDataset), or each
+                                       group uses its own threshold
+        Output:
+            - precision (Tensor): tensor of size (n_groups, R)
+        """
+        if global_threshold:
+            thresholds = self.global_threshold_at_recall(recall)
+        else:
+            thresholds = self.threshold_at_recall(recall)
+        return self.scores_at(thresholds, strict=True)[0]
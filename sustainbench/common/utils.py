@@ -42,20 +42,50 @@ def split_into_groups(g):
     Args:
         - g (Tensor): Vector of groups
     Returns:
-        - groups (Tensor): Unique groups present in g
+        - groups (Tensor): Unique groups present in g, in increasing order
         - group_indices (list): List of Tensors, where the i-th tensor is the indices of the
                                 elements of g that equal groups[i].
                                 Has the same length as len(groups).
         - unique_counts (Tensor): Counts of each element in groups.
                                  Has the same length as len(groups).
     """
-    unique_groups, unique_counts = torch.unique(g, sorted=False, return_counts=True)
-    group_indices = []
-    for group in unique_groups:
-        group_indices.append(
-            torch.nonzero(g == group, as_tuple=True)[0])
+    unique_groups, order, offsets = split_into_groups_compact(g)
+    unique_counts = offsets[1:] - offsets[:-1]
+    group_indices = list(torch.split(order, unique_counts.tolist()))
     return unique_groups, group_indices, unique_counts
 
+def stable_argsort(g):
+    """
+    Stable argsort of non-negative integer groups along the first dimension.
+    torch.sort(stable=True) needs torch >= 1.9, so this sorts the keys
+    g * N + position instead, which are unique and order equal groups by position.
+    Args:
+        - g (Tensor): Tensor of size (N, ...) of groups
+    Returns:
+        - order (Tensor): Tensor of size (N, ...) of indices along the first dimension
+    """
+    n = g.size(0)
+    position = torch.arange(n, device=g.device).view((-1,) + (1,) * (g.dim() - 1))
+    return torch.sort(g.long() * n + position, dim=0)[1]
+
+def split_into_groups_compact(g):
+    """
+    Compact form of split_into_groups that returns the indices of all groups as one
+    permutation with offsets (as in a CSR matrix), from a single sort.
+    Args:
+        - g (Tensor): Vector of groups
+    Returns:
+        - groups (Tensor): Unique groups present in g, in increasing order
+        - order (Tensor): Permutation that sorts g. The indices of the elements of g that equal
+                          groups[i] are order[offsets[i]:offsets[i+1]], in increasing order.
+        - offsets (Tensor): Vector of length len(groups) + 1
+    """
+    order = stable_argsort(g)
+    unique_groups, unique_counts = torch.unique_consecutive(g[order], return_counts=True)
+    offsets = torch.zeros(len(unique_groups) + 1, dtype=torch.long, device=g.device)
+    offsets[1:] = torch.cumsum(unique_counts, dim=0)
+    return unique_groups, order, offsets
+
 def get_counts(g, n_groups):
     """
     This differs from split_into_groups in how it handles missing groups.
@@ -72,6 +102,78 @@ def get_counts(g, n_groups):
     counts[unique_groups] = unique_counts.float()
     return counts
 
+def sort_by_group(g, n_groups):
+    """
+    Sorts the elements of g by group once, so that each group can be processed
+    as a contiguous slice instead of with a boolean mask over all elements.
+    Args:
+        - g (Tensor): Vector of groups
+        - n_groups (int): Number of groups
+    Returns:
+        - order (Tensor): Stable permutation that sorts g
+        - offsets (Tensor): Vector of length n_groups + 1. The elements of group i are
+                            order[offsets[i]:offsets[i+1]].
+    """
+    order = stable_argsort(g)
+    offsets = torch.zeros(n_groups + 1, dtype=torch.long, device=g.device)
+    offsets[1:] = torch.cumsum(torch.bincount(g, minlength=n_groups), dim=0)
+    return order, offsets
+
+GROUP_REDUCTIONS = ('mean', 'sum', 'min', 'max', 'count')
+
+def reduce_over_groups(v, g, n_groups, reduce='mean'):
+    """
+    Reduces the values of each group with native torch ops, on the device of v.
+    Args:
+        - v (Tensor): Tensor of size (N, ...) containing the values to reduce
+        - g (Tensor): Vector of size (N, ) containing the group of each row of v
+        - n_groups (int): Number of groups
+        - reduce (str): One of 'mean', 'sum', 'min', 'max', 'count'
+    Returns:
+        - group_values (Tensor): Tensor of size (n_groups, ...). Empty groups are 0.
+                                 'count' returns a float vector of size (n_groups, ).
+    """
+    if reduce not in GROUP_REDUCTIONS:
+        raise ValueError(f'reduce must be one of {GROUP_REDUCTIONS}, got {reduce}')
+    assert v.device==g.device
+    assert v.size(0)==g.numel()
+    counts = torch.bincount(g, minlength=n_groups)
+    if reduce=='count':
+        return counts.float()
+
+    out_shape = (n_groups,) + tuple(v.shape[1:])
+    if reduce in ('sum', 'mean'):
+        dtype = v.dtype if (reduce=='sum' or v.is_floating_point()) else torch.float
+        out = torch.zeros(out_shape, dtype=dtype, device=v.device)
+        out.index_add_(0, g, v.to(dtype))
+        if reduce=='mean':
+            out /= counts.clamp(min=1).to(dtype).view((-1,) + (1,) * (v.dim() - 1))
+        return out
+
+    if hasattr(torch.Tensor, 'scatter_reduce_'):
+        out = torch.zeros(out_shape, dtype=v.dtype, device=v.device)
+        index = g.view((-1,) + (1,) * (v.dim() - 1)).expand_as(v)
+        return out.scatter_reduce_(0, index, v, reduce='amin' if reduce=='min' else 'amax', include_self=False)
+    return _extremum_over_groups(v, g, counts, reduce)
+
+def _extremum_over_groups(v, g, counts, reduce):
+    """
+    Sort-based min / max over groups for torch versions without scatter_reduce_.
+    Sorts the values, then stably sorts by group, so that the first element of
+    each group is its extremum.
+    """
+    n_groups = counts.numel()
+    values = v.reshape(v.size(0), -1)
+    values, value_order = values.sort(dim=0, descending=(reduce=='max'))
+    groups = g[value_order]
+    group_order = stable_argsort(groups)
+    values = values.gather(0, group_order)
+    starts = torch.cumsum(counts, dim=0) - counts
+    nonempty = counts>0
+    out = torch.zeros((n_groups, values.size(1)), dtype=v.dtype, device=v.device)
+    out[nonempty] = values[starts[nonempty]]
+    return out.view((n_groups,) + tuple(v.shape[1:]))
+
 def avg_over_groups(v, g, n_groups):
     """
     Args:
@@ -81,12 +183,10 @@ def avg_over_groups(v, g, n_groups):
         group_avgs (Tensor): Vector of length num_groups
         group_counts (Tensor)
     """
-    import torch_scatter
     assert v.device==g.device
-    device = v.device
     assert v.numel()==g.numel()
     group_count = get_counts(g, n_groups)
-    group_avgs = torch_scatter.scatter(src=v, index=g, dim_size=n_groups, reduce='mean')
+    group_avgs = reduce_over_groups(v, g, n_groups, reduce='mean')
     return group_avgs, group_count
 
 def map_to_id_array(df, ordered_map={}):
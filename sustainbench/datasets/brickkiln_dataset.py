@@ -1,13 +1,53 @@
 import os
 
 import h5py
+import numpy as np
 import pandas as pd
-from sklearn.metrics import precision_score, recall_score, accuracy_score, roc_auc_score
 import torch
 
+from sustainbench.common.metrics.confusion import ConfusionMatrix
+from sustainbench.common.metrics.threshold_sweep import ThresholdSweep
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
 
 
+class HDF5FilePool:
+    """
+    Keeps open read-only HDF5 datasets, one per (file, key) and process.
+    HDF5 handles must not be shared across processes, so handles inherited through
+    a fork (e.g., by DataLoader workers) are dropped and each process opens its own.
+    The pool is pickled empty for the same reason.
+    """
+    def __init__(self):
+        self._pid = os.getpid()
+        self._files = {}
+        self._datasets = {}
+
+    def __getstate__(self):
+        return {'_pid': None, '_files': {}, '_datasets': {}}
+
+    def get(self, path, key):
+        """
+        Returns the h5py dataset `key` of the HDF5 file at `path`.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._files = {}
+            self._datasets = {}
+        dataset = self._datasets.get((path, key))
+        if dataset is None:
+            if path not in self._files:
+                self._files[path] = h5py.File(path, 'r')
+            dataset = self._files[path][key]
+            self._datasets[(path, key)] = dataset
+        return dataset
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._datasets = {}
+
+
 class BrickKilnDataset(SustainBenchDataset):
     """
     Supported `split_scheme`: 'official'
@@ -59,17 +99,41 @@ class BrickKilnDataset(SustainBenchDataset):
         self._metadata_fields = ['y', 'hdf5_file', 'hdf5_idx', 'lon_top_left', 'lat_top_left', 'lon_bottom_right', 'lat_bottom_right', 'indice_x', 'indice_y']
         self._metadata_array = torch.tensor(self.metadata[self.metadata_fields].astype(float).values)
 
+        # plain arrays avoid pandas lookups in get_input
+        self._hdf5_file = self.metadata['hdf5_file'].to_numpy()
+        self._hdf5_idx = self.metadata['hdf5_idx'].to_numpy()
+        self._hdf5_pool = HDF5FilePool()
+
         super().__init__(root_dir, download, split_scheme)
 
+    def _images(self, hdf5_loc):
+        return self._hdf5_pool.get(os.path.join(self.data_dir, f'examples_{hdf5_loc}.hdf5'), 'images')
+
     def get_input(self, idx):
-        hdf5_loc = self.metadata['hdf5_file'].iloc[idx]
-        with h5py.File(os.path.join(self.data_dir, f'examples_{hdf5_loc}.hdf5'), 'r') as f:
-            img = f['images'][self.metadata['hdf5_idx'].iloc[idx]]
+        img = self._images(self._hdf5_file[idx])[self._hdf5_idx[idx]]
 
         img = torch.from_numpy(img).float()
         return img
 
-    def eval(self, y_pred, y_true, metadata, prediction_fn=None):
+    def get_input_batch(self, indices):
+        """
+        Returns x for several indices, reading each HDF5 file once with a
+        single sorted fancy-index selection.
+        """
+        files = self._hdf5_file[indices]
+        rows = self._hdf5_idx[indices]
+        imgs = None
+        for hdf5_loc in np.unique(files):
+            batch_pos = np.flatnonzero(files == hdf5_loc)
+            # h5py requires strictly increasing indices
+            file_rows, inverse = np.unique(rows[batch_pos], return_inverse=True)
+            file_imgs = self._images(hdf5_loc)[file_rows]
+            if imgs is None:
+                imgs = np.empty((len(indices),) + file_imgs.shape[1:], dtype=file_imgs.dtype)
+            imgs[batch_pos] = file_imgs[inverse]
+        return torch.from_numpy(imgs).float()
+
+    def eval(self, y_pred, y_true, metadata, prediction_fn=None, recall_targets=()):
         """
         Computes all evaluation metrics.
         Args:
@@ -78,25 +142,33 @@ class BrickKilnDataset(SustainBenchDataset):
                                are predicted labels.
             - y_true (LongTensor): Ground-truth labels
             - prediction_fn (function): A function that turns y_pred into predicted labels. If none, y_pred is
-              expected to be probability score
+              expected to be predicted labels; scores raise a ValueError
+            - recall_targets (list of float): Recalls in percent at which to also report the precision,
+                                              thresholding y_pred like PrecisionAtRecall
         Output:
             - results (dictionary): Dictionary of evaluation metrics
             - results_str (str): String summarizing the evaluation metrics
         """
-        if prediction_fn is None:
-            precision = precision_score(y_true, y_pred)
-            recall = recall_score(y_true, y_pred)
-            accuracy = accuracy_score(y_true, y_pred)
-
-            results = {'Precision': precision, 'Recall': recall, 'Accuracy': accuracy}
-            results_str = f'Precision: {precision}, Recall: {recall}, Accuracy: {accuracy}'
-        else:
-            precision = precision_score(y_true, prediction_fn(y_pred))
-            recall = recall_score(y_true, prediction_fn(y_pred))
-            accuracy = accuracy_score(y_true, prediction_fn(y_pred))
-            auc = roc_auc_score(y_true, y_pred)
-
-            results = {'Precision': precision, 'Recall': recall, 'Accuracy': accuracy, 'AUC': auc}
-            results_str = f'Precision: {precision}, Recall: {recall}, Accuracy: {accuracy}, AUC: {auc}'
+        y_pred, y_true = torch.as_tensor(y_pred), torch.as_tensor(y_true)
+        predictions = y_pred if prediction_fn is None else torch.as_tensor(prediction_fn(y_pred))
+        confusion = ConfusionMatrix(n_classes=2)
+        confusion.update(y_true, predictions)
+        precision, recall, _ = (score.item() for score in confusion.scores(average='binary'))
+        accuracy = confusion.accuracy().item()
+
+        results = {'Precision': precision, 'Recall': recall, 'Accuracy': accuracy}
+        results_str = f'Precision: {precision}, Recall: {recall}, Accuracy: {accuracy}'
+        if prediction_fn is not None or len(recall_targets) > 0:
+            # a single sort of the scores serves the AUC and all recall targets
+            sweep = ThresholdSweep(y_pred, y_true)
+        if prediction_fn is not None:
+            auc = sweep.auc()[0].item()
+            results['AUC'] = auc
+            results_str += f', AUC: {auc}'
+        if len(recall_targets) > 0:
+            precisions = sweep.precision_at_recall(torch.as_tensor(recall_targets))[0]
+            for target, precision_at_recall in zip(recall_targets, precisions.tolist()):
+                results[f'Precision@Recall{target}'] = precision_at_recall
+                results_str += f', Precision@Recall{target}: {precision_at_recall}'
 
         return results, results_str
@@ -3,8 +3,9 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from PIL import Image
-from sklearn.metrics import f1_score, accuracy_score, precision_recall_fscore_support
+import torch
 
+from sustainbench.common.metrics.confusion import ConfusionMatrix
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
 
 
@@ -97,22 +98,35 @@ class CropSegmentationDataset(SustainBenchDataset):
         img = np.asarray(img)
         return img
 
-    def crop_segmentation_metrics(self, y_true, y_pred, binarized=True):
-        y_true = y_true.flatten()
-        y_pred = y_pred.flatten()
+    def crop_segmentation_metrics(self, y_true, y_pred, binarized=True, iou=False):
+        """
+        Computes binary segmentation metrics from one confusion matrix over all pixels.
+        Output:
+            - f1 (float): Dice / F1 score of the positive class
+            - acc (float): Pixel accuracy
+            - precision_recall (tuple): (precision, recall, f1, None), like
+                                        sklearn's precision_recall_fscore_support
+            - iou (list of float): Per-class intersection over union, only returned if iou
+        """
+        y_true = torch.as_tensor(y_true).flatten()
+        y_pred = torch.as_tensor(y_pred).flatten()
         assert (y_true.shape == y_pred.shape)
         if not binarized:
-            y_pred[y_pred > 0.5] = 1
-            y_pred[y_pred != 1] = 0
-        y_true = y_true.astype(int)
-        y_pred = y_pred.astype(int)
-        f1 = f1_score(y_true, y_pred, average='binary', pos_label=1)
-        acc = accuracy_score(y_true, y_pred)
-        precision_recall = precision_recall_fscore_support(y_true, y_pred, average='binary', pos_label=1)
+            y_pred = (y_pred > 0.5)
+        # binarized predictions are truncated to labels, like astype(int)
+        y_true, y_pred = y_true.long(), y_pred.long()
+        confusion = ConfusionMatrix(n_classes=2)
+        confusion.update(y_true, y_pred)
+        precision, recall, f1 = (score.item() for score in confusion.scores(average='binary', pos_label=1))
+        acc = confusion.accuracy().item()
         print('Dice/ F1 score:', f1)
         print('Accuracy score:', acc)
-        print("Precision recall fscore", precision_recall)
-        return f1, acc, precision_recall
+        print("Precision recall fscore", (precision, recall, f1, None))
+        if not iou:
+            return f1, acc, (precision, recall, f1, None)
+        class_iou = confusion.iou().tolist()
+        print('IoU per class:', class_iou)
+        return f1, acc, (precision, recall, f1, None), class_iou
 
     def eval(self, y_pred, y_true, metadata, binarized=False):  # TODO
         """
@@ -126,8 +140,8 @@ class CropSegmentationDataset(SustainBenchDataset):
             - results (list): List of evaluation metrics
             - results_str (str): String summarizing the evaluation metrics
         """
-        f1, acc, precision_recall = self.crop_segmentation_metrics(y_true, y_pred, binarized=binarized)
-        results = [f1, acc, precision_recall]
-        results_str = 'Dice/ F1 score: {}, Accuracy score: {}, Precision recall fscore: {}'.format(f1, acc, precision_recall)
+        f1, acc, precision_recall, iou = self.crop_segmentation_metrics(y_true, y_pred, binarized=binarized, iou=True)
+        results = [f1, acc, precision_recall, iou]
+        results_str = 'Dice/ F1 score: {}, Accuracy score: {}, Precision recall fscore: {}, IoU per class: {}'.format(f1, acc, precision_recall, iou)
         return results, results_str
 
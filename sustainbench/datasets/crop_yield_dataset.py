@@ -1,5 +1,4 @@
 import os
-import zipfile
 from pathlib import Path
 
 import numpy as np
@@ -8,6 +7,36 @@ from sklearn.metrics import r2_score
 import torch
 
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
+from sustainbench.datasets.extract_utils import extract_archive_once
+
+ARCHIVE_PATH = os.path.join('crop_yield', 'soybeans_updated.zip')
+SPLIT_FNAMES = {'train': 'train', 'val': 'dev', 'test': 'test'}
+HISTOGRAMS_FILE = 'hists.npy'
+
+
+def write_histograms(extract_dir):
+    """
+    Writes the train, val and test histograms of each country into a single
+    uncompressed .npy file (in that order), so that they can be memory-mapped.
+    """
+    soybeans_dir = os.path.join(extract_dir, 'soybeans')
+    for country in sorted(os.listdir(soybeans_dir)):
+        country_data_dir = os.path.join(soybeans_dir, country)
+        if not os.path.isdir(country_data_dir):
+            continue
+        hists_files = [os.path.join(country_data_dir, f'{fname}_hists.npz') for fname in SPLIT_FNAMES.values()]
+        if not all(os.path.exists(f) for f in hists_files):
+            continue
+        hists = [np.load(f)['data'] for f in hists_files]
+        out = np.lib.format.open_memmap(
+            os.path.join(country_data_dir, HISTOGRAMS_FILE), mode='w+', dtype=hists[0].dtype,
+            shape=(sum(len(h) for h in hists),) + hists[0].shape[1:])
+        start = 0
+        for h in hists:
+            out[start:start + len(h)] = h
+            start += len(h)
+        out.flush()
+        del out
 
 
 class CropYieldDataset(SustainBenchDataset):
@@ -68,15 +97,26 @@ class CropYieldDataset(SustainBenchDataset):
         else:
             self._country = self._split_scheme
 
-        train_data, train_labels, train_years, train_keys = self._load_split(split='train', country=self._country)
-        val_data, val_labels, val_years, val_keys = self._load_split(split='val', country=self._country)
-        test_data, test_labels, test_years, test_keys = self._load_split(split='test', country=self._country)
+        # The archive is extracted only once per version; later constructions
+        # just check the manifest.
+        self._extract_dir = extract_archive_once(
+            ARCHIVE_PATH, os.path.join(self._data_dir, f'soybeans_v{self.version}'),
+            post_extract=write_histograms)
+
+        train_labels, train_years, train_keys = self._load_split(split='train', country=self._country)
+        val_labels, val_years, val_keys = self._load_split(split='val', country=self._country)
+        test_labels, test_years, test_keys = self._load_split(split='test', country=self._country)
 
         train_mask = np.ones_like(train_labels) * self._split_dict['train']
         val_mask = np.ones_like(val_labels) * self._split_dict['val']
         test_mask = np.ones_like(test_labels) * self._split_dict['test']
 
-        self._histograms = np.concatenate([train_data, val_data, test_data])
+        # train, val and test histograms, memory-mapped copy-on-write
+        self._histograms = np.load(
+            os.path.join(self._country_data_dir(self._country), HISTOGRAMS_FILE), mmap_mode='c')
+        if len(self._histograms) != len(train_labels) + len(val_labels) + len(test_labels):
+            raise ValueError(f'Histograms in {self._extract_dir} do not match the labels. '
+                             f'Delete the directory to extract the archive again.')
         self._split_array = np.concatenate([train_mask, val_mask, test_mask])
 
         self.metadata = pd.DataFrame(data={
@@ -114,33 +154,32 @@ class CropYieldDataset(SustainBenchDataset):
     def region2_to_loc2(self, region2):
         return list(self.region2s).index(region2)
 
+    def _country_data_dir(self, country):
+        country_data_dir = os.path.join(self._extract_dir, 'soybeans', country)
+        if not os.path.isdir(country_data_dir):
+            raise FileNotFoundError(f"Data directory for country {country} not found at {country_data_dir}")
+        return country_data_dir
+
     def _load_split(self, split, country):
         """
-        Returns stored data for given split and country.
+        Returns stored labels, years and keys for given split and country.
+        The histograms are memory-mapped separately.
         """
-        split_fname = {'train': 'train', 'val': 'dev', 'test': 'test'}
-        if split not in split_fname.keys():
+        if split not in SPLIT_FNAMES.keys():
             raise ValueError(f'Loading split {split} not supported')
 
-        fname = split_fname[split]
-
-        with zipfile.ZipFile('crop_yield/soybeans_updated.zip', 'r') as zip_ref:
-            zip_ref.extractall(self._data_dir)
-        country_data_dir = os.path.join(self._data_dir, 'soybeans', country)
-        if not os.path.isdir(country_data_dir):
-            raise FileNotFoundError(f"Data directory for country {country} not found at {country_data_dir}")
+        fname = SPLIT_FNAMES[split]
+        country_data_dir = self._country_data_dir(country)
 
-        data_file = os.path.join(country_data_dir, f'{fname}_hists.npz')
         labels_file = os.path.join(country_data_dir, f'{fname}_yields.npz')
         years_file = os.path.join(country_data_dir, f'{fname}_years.npz')
         keys_file = os.path.join(country_data_dir, f'{fname}_keys.npz')
 
-        data = np.load(data_file)['data']
         labels = np.load(labels_file)['data']
         years = np.load(years_file)['data'].astype(int)
         keys = np.load(keys_file)['data']
 
-        return data, labels, years, keys
+        return labels, years, keys
 
     def get_input(self, idx):
         """
@@ -149,6 +188,12 @@ class CropYieldDataset(SustainBenchDataset):
         img = self._histograms[idx]
         return img
 
+    def get_input_batch(self, indices):
+        """
+        Returns x for several indices with a single gather, as an array like get_input.
+        """
+        return self._histograms[indices]
+
     def crop_yield_metrics(self, y_true, y_pred):
         y_true = y_true.flatten()
         y_pred = y_pred.flatten()
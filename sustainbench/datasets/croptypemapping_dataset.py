@@ -1,12 +1,13 @@
 import json
 import os
+import tempfile
 
 import numpy as np
 import pandas as pd
-from sklearn.metrics import f1_score, accuracy_score
 import torch
 import torchvision.transforms as transforms
 
+from sustainbench.common.metrics.confusion import ConfusionMatrix
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
 
 
@@ -52,6 +53,124 @@ IMG_DIM = 64
 
 PLANET_DIM = 212
 
+SATELLITES = ['s1', 's2', 'planet']
+
+DATES_INDEX_FILE = 'dates_index.npz'
+
+
+def parse_dates(dates):
+    """
+    Converts 'YYYY-MM-DD' date strings into int32 integers YYYYMMDD.
+    """
+    dates = np.asarray(dates, dtype=str)
+    if dates.size == 0:
+        return np.zeros(0, dtype=np.int32)
+    return np.char.replace(dates, '-', '').astype(np.int32)
+
+
+def build_dates_index(data_dir, country, loc_ids):
+    """
+    One-time build of a compact acquisition date table per satellite.
+    For each satellite, the dates of all locations are concatenated into one int32
+    array, and the dates of the i-th location are dates[offsets[i]:offsets[i+1]].
+    Args:
+        - data_dir (str): Dataset directory
+        - country (str): 'ghana' or 'southsudan'
+        - loc_ids (array of int): Location ids, in dataset order
+    Output:
+        - index (dict): Maps f'{satellite}_dates' and f'{satellite}_offsets' to arrays,
+                        and 'ids' to loc_ids
+    """
+    index = {'ids': np.asarray(loc_ids, dtype=np.int64)}
+    for satellite in SATELLITES:
+        dates = []
+        offsets = np.zeros(len(loc_ids) + 1, dtype=np.int64)
+        for i, loc_id in enumerate(loc_ids):
+            json_path = os.path.join(data_dir, country, satellite, f'{satellite}_{country}_{loc_id:06d}.json')
+            with open(json_path, 'r') as f:
+                loc_dates = parse_dates(json.load(f)['dates'])
+            dates.append(loc_dates)
+            offsets[i + 1] = offsets[i] + len(loc_dates)
+        index[f'{satellite}_dates'] = np.concatenate(dates) if dates else np.zeros(0, dtype=np.int32)
+        index[f'{satellite}_offsets'] = offsets
+
+    # Write a temporary file of this process next to the index and rename it into
+    # place, so that concurrent builds (e.g., DDP ranks) never see a partial index.
+    index_path = os.path.join(data_dir, country, DATES_INDEX_FILE)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix=DATES_INDEX_FILE + '.tmp', suffix='.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **index)
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return index
+
+
+def load_dates_index(data_dir, country, loc_ids):
+    """
+    Loads the date table written by build_dates_index, building it first if it
+    does not exist or does not match loc_ids.
+    """
+    index_path = os.path.join(data_dir, country, DATES_INDEX_FILE)
+    if os.path.exists(index_path):
+        with np.load(index_path) as f:
+            index = dict(f)
+        if np.array_equal(index['ids'], loc_ids):
+            return index
+    return build_dates_index(data_dir, country, loc_ids)
+
+
+def pad_time_series(tensors):
+    """
+    Right pads tensors of size (..., T_i) with zeros to the largest T_i and stacks them.
+    Output:
+        - padded (Tensor): tensor of size (len(tensors), ..., max T_i)
+    """
+    length = max(tensor.shape[-1] for tensor in tensors)
+    padded = tensors[0].new_zeros((len(tensors),) + tuple(tensors[0].shape[:-1]) + (length,))
+    for i, tensor in enumerate(tensors):
+        padded[i, ..., :tensor.shape[-1]] = tensor
+    return padded
+
+
+def collate_time_series(batch):
+    """
+    Collates unpadded CropTypeMappingDataset items (dynamic_padding=True) by padding
+    each satellite only to the longest time series in the batch.
+    Args:
+        - batch (list): (x, y, metadata) items of the dataset, or (x, y) items of its subsets
+    Output:
+        - x (dict): Maps each satellite to a tensor of size (B, C, H, W, T), where T is the
+                    longest time series of the satellite in the batch, and
+                    f'{satellite}_lengths' to the length of each time series (LongTensor of size (B, ))
+                    and f'{satellite}_mask' to a BoolTensor of size (B, T) that is True for
+                    acquisitions and False for padding
+        - y (Tensor): Stacked labels
+        - metadata (dict): Maps each satellite to the acquisition dates of size (B, T),
+                           zero padded. Only returned for (x, y, metadata) items.
+    """
+    items = list(zip(*batch))
+    xs, ys = items[0], items[1]
+    metadata = {} if len(items) > 2 else None
+    x = {}
+    for satellite in SATELLITES:
+        if metadata is not None:
+            # the number of acquisition dates is the length of each time series
+            dates = [item_metadata[satellite] for item_metadata in items[2]]
+            metadata[satellite] = pad_time_series(dates)
+            lengths = torch.tensor([len(item_dates) for item_dates in dates], dtype=torch.long)
+        else:
+            lengths = torch.tensor([item_x[satellite].shape[-1] for item_x in xs], dtype=torch.long)
+        x[satellite] = pad_time_series([item_x[satellite] for item_x in xs])
+        x[f'{satellite}_lengths'] = lengths
+        x[f'{satellite}_mask'] = torch.arange(x[satellite].shape[-1]) < lengths.unsqueeze(1)
+    y = torch.stack(ys)
+    if metadata is None:
+        return x, y
+    return x, y, metadata
+
 
 class CropTypeMappingDataset(SustainBenchDataset):
     """
@@ -63,7 +182,9 @@ class CropTypeMappingDataset(SustainBenchDataset):
         List of three satellites, each containing C x 64 x 64 x T satellite image,
         with 12 channels from S2, 2 channels from S1, and 6 from Planet.
         Additional bands such as NDVI and GCVI are computed for Planet and S2.
-        For S1, VH/VV is also computed. Time series are zero padded to 256.
+        For S1, VH/VV is also computed. Time series are zero padded to 256, or
+        unpadded with dynamic_padding=True, in which case collate_time_series
+        pads each batch to its longest time series and adds masks and lengths.
         Mean/std applied on bands excluding NDVI and GCVI. Paper uses 32x32
         imagery but the public dataset/splits use 64x64 imagery, which is
         thusly provided. Bands are as follows:
@@ -101,16 +222,21 @@ class CropTypeMappingDataset(SustainBenchDataset):
             'compressed_size': None}}
 
     def __init__(self, version=None, root_dir='data', download=False, split_scheme='official',
-                 resize_planet=False, calculate_bands=True, normalize=True):
+                 resize_planet=False, calculate_bands=True, normalize=True, dynamic_padding=False):
         """
         Args:
             resize_planet: True if Planet imagery will be resized to 64x64
             calculate_bands: True if aditional bands (NDVI and GCVI) will be calculated on the fly and appended
             normalize: True if bands (excluding NDVI and GCVI) wll be normalized
+            dynamic_padding: True if time series and dates will be returned unpadded and collated
+                             with collate_time_series instead of being padded to 256
         """
         self._resize_planet = resize_planet
         self._calculate_bands = calculate_bands
         self._normalize = normalize
+        self._dynamic_padding = dynamic_padding
+        if dynamic_padding:
+            self._collate = collate_time_series
 
         self._version = version
         self._data_dir = self.initialize_data_dir(root_dir, download)
@@ -138,6 +264,10 @@ class CropTypeMappingDataset(SustainBenchDataset):
         self._metadata_fields = ['y']
         self._metadata_array = torch.from_numpy(split_df['id'].values)
 
+        # acquisition dates of every location, so that get_metadata does not
+        # have to open the per-location json files
+        self._dates_index = load_dates_index(self.data_dir, self.country, split_df['id'].values)
+
         super().__init__(root_dir, download, split_scheme)
 
     def __getitem__(self, idx):
@@ -150,8 +280,10 @@ class CropTypeMappingDataset(SustainBenchDataset):
 
     def pad(self, tensor):
         '''
-        Right pads or crops tensor to GRID_SIZE.
+        Right pads or crops tensor to GRID_SIZE. Returns tensor unchanged with dynamic_padding.
         '''
+        if self.dynamic_padding:
+            return tensor
         pad_size = GRID_SIZE[self.country] - tensor.shape[-1]
         tensor = torch.nn.functional.pad(input=tensor, pad=(0, pad_size), value=0)
         return tensor
@@ -217,32 +349,29 @@ class CropTypeMappingDataset(SustainBenchDataset):
         """
         Converts json dates into tensor containing dates
         """
-        dates = np.array(json_file['dates'])
-        dates = np.char.replace(dates, '-', '')
-        dates = torch.from_numpy(dates.astype(np.int))
-        return dates
+        return torch.from_numpy(parse_dates(json_file['dates']).astype(np.int64))
+
+    def get_satellite_dates(self, idx, satellite):
+        """
+        Returns the unpadded acquisition dates of one satellite for a given idx.
+        """
+        offsets = self._dates_index[f'{satellite}_offsets']
+        dates = self._dates_index[f'{satellite}_dates'][offsets[idx]:offsets[idx + 1]]
+        return torch.from_numpy(dates.astype(np.int64))
+
+    def sequence_lengths(self):
+        """
+        Returns the number of acquisitions of each satellite for every data point, as an
+        array of size (N, len(SATELLITES)), e.g., for BucketBatchSampler.
+        """
+        return np.stack([np.diff(self._dates_index[f'{satellite}_offsets']) for satellite in SATELLITES], axis=1)
 
     def get_metadata(self, idx):
         """
         Returns metadata for a given idx.
         Dates are returned as integers in format {Year}{Month}{Day}
         """
-        loc_id = f'{self.y_array[idx]:06d}'
-
-        s1_json = json.loads(open(os.path.join(self.data_dir, self.country, 's1', f's1_{self.country}_{loc_id}.json'), 'r').read())
-        s1 = self.get_dates(s1_json)
-
-        s2_json = json.loads(open(os.path.join(self.data_dir, self.country, 's2', f's2_{self.country}_{loc_id}.json'), 'r').read())
-        s2 = self.get_dates(s2_json)
-
-        planet_json = json.loads(open(os.path.join(self.data_dir, self.country, 'planet', f'planet_{self.country}_{loc_id}.json'), 'r').read())
-        planet = self.get_dates(planet_json)
-
-        s1 = self.pad(s1)
-        s2 = self.pad(s2)
-        planet = self.pad(planet)
-
-        return {'s1': s1, 's2': s2, 'planet': planet}
+        return {satellite: self.pad(self.get_satellite_dates(idx, satellite)) for satellite in SATELLITES}
 
     def normalization(self, grid, satellite):
         """ Normalization based on values defined in constants.py
@@ -261,17 +390,29 @@ class CropTypeMappingDataset(SustainBenchDataset):
             raise ValueError("Incorrect normalization parameters")
         return grid
 
-    def crop_segmentation_metrics(self, y_true, y_pred):
-        y_true = y_true.flatten()
-        y_pred = y_pred.flatten()
+    def crop_segmentation_metrics(self, y_true, y_pred, iou=False):
+        """
+        Computes macro F1 and accuracy from one confusion matrix over all pixels.
+        Output:
+            - f1 (float): Macro Dice / F1 score over the classes in y_true or y_pred
+            - acc (float): Pixel accuracy
+            - iou (list of float): Per-class intersection over union, only returned if iou
+        """
+        y_true = torch.as_tensor(y_true).flatten().int()
+        y_pred = torch.as_tensor(y_pred).flatten().int()
         assert (y_true.shape == y_pred.shape)
-        y_true = y_true.int()
-        y_pred = y_pred.int()
-        f1 = f1_score(y_true, y_pred, average='macro')
-        acc = accuracy_score(y_true, y_pred)
+        n_classes = int(max(y_true.max(), y_pred.max())) + 1 if y_true.numel() > 0 else 1
+        confusion = ConfusionMatrix(n_classes=n_classes)
+        confusion.update(y_true, y_pred)
+        f1 = confusion.scores(average='macro')[2].item()
+        acc = confusion.accuracy().item()
         print('Macro Dice/ F1 score:', f1)
         print('Accuracy score:', acc)
-        return f1, acc
+        if not iou:
+            return f1, acc
+        class_iou = confusion.iou().tolist()
+        print('IoU per class:', class_iou)
+        return f1, acc, class_iou
 
     def eval(self, y_pred, y_true, metadata):
         """
@@ -284,9 +425,9 @@ class CropTypeMappingDataset(SustainBenchDataset):
             - results (dictionary): Dictionary of evaluation metrics
             - results_str (str): String summarizing the evaluation metrics
         """
-        f1, acc = self.crop_segmentation_metrics(y_true, y_pred)
-        results = [f1, acc]
-        results_str = f'Dice/ F1 score: {f1}, Accuracy score: {acc}'
+        f1, acc, iou = self.crop_segmentation_metrics(y_true, y_pred, iou=True)
+        results = [f1, acc, iou]
+        results_str = f'Dice/ F1 score: {f1}, Accuracy score: {acc}, IoU per class: {iou}'
         return results, results_str
 
     @property
@@ -303,6 +444,13 @@ class CropTypeMappingDataset(SustainBenchDataset):
         """
         return self._country
 
+    @property
+    def dynamic_padding(self):
+        """
+        True if time series are returned unpadded and padded per batch by collate_time_series.
+        """
+        return self._dynamic_padding
+
     @property
     def resize_planet(self):
         """
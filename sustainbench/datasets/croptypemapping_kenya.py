@@ -4,7 +4,9 @@ import numpy as np
 import pandas as pd
 import torch
 from sklearn.metrics import f1_score, accuracy_score
+from torch.utils.data.dataloader import default_collate
 
+from sustainbench.datasets.croptypemapping_dataset import pad_time_series
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
 
 
@@ -23,6 +25,29 @@ for i, crop in enumerate(CROPS):
 REGIONS = ['Bungoma', 'Busia', 'Siaya']
 
 
+def collate_pixel_time_series(batch):
+    """
+    Collates CropTypeMappingKenyaDataset items by padding the pixel time series to
+    the longest one in the batch.
+    Args:
+        - batch (list): (x, y, metadata) items of the dataset, or (x, y) items of its subsets
+    Output:
+        - x (dict): Maps 'input' to a tensor of size (B, C, T), where T is the longest time
+                    series in the batch, 'input_lengths' to the length of each time series
+                    (LongTensor of size (B, )) and 'input_mask' to a BoolTensor of size (B, T)
+                    that is True for time steps and False for padding
+        - y, metadata: Collated with torch's default_collate
+    """
+    items = list(zip(*batch))
+    inputs = [item_x['input'] for item_x in items[0]]
+    lengths = torch.tensor([item_input.shape[-1] for item_input in inputs], dtype=torch.long)
+    padded = pad_time_series(inputs)
+    x = {'input': padded,
+         'input_lengths': lengths,
+         'input_mask': torch.arange(padded.shape[-1]) < lengths.unsqueeze(1)}
+    return (x,) + tuple(default_collate(list(values)) for values in items[1:])
+
+
 class CropTypeMappingKenyaDataset(SustainBenchDataset):
     """
     Supported `split_scheme`:
@@ -102,7 +127,18 @@ class CropTypeMappingKenyaDataset(SustainBenchDataset):
         # y_labels are actual y labels..
         self._y_array = torch.from_numpy(split_df['fieldID'].values)
         self._y_npys = split_df['fileName'].values
-        self._y_labels = torch.from_numpy(split_df['cropType'].replace(CROP_LABELS).values)
+        self._y_labels = torch.from_numpy(split_df['cropType'].replace(CROP_LABELS).values.astype(np.int64))
+        self._y_size = 1
+
+        # field ID -> row, for looking up fields by ID with field_row
+        self._field_rows = {str(field_id): row for row, field_id in enumerate(split_df['fieldID'].values)}
+
+        self._split_scheme = self.split
+        self._metadata_fields = ['y']
+        self._metadata_array = self._y_labels
+
+        # time series differ in length, so batches are padded to their longest one
+        self._collate = collate_pixel_time_series
 
         super().__init__(root_dir, download, test_set)
 
@@ -111,23 +147,44 @@ class CropTypeMappingKenyaDataset(SustainBenchDataset):
         # since different subsets (e.g., train vs test) might have different transforms
         x = self.get_input(idx)
         y = self.get_label(idx)
-        return x, y
+        metadata = self.metadata_array[idx]
+        return x, y, metadata
+
+    def field_row(self, field_id):
+        """
+        Returns the index (row) of the field with ID field_id, e.g., dataset[dataset.field_row(field_id)].
+        """
+        try:
+            return self._field_rows[str(field_id)]
+        except KeyError:
+            raise KeyError(f'Field ID {field_id} not found in {self.dataset_name}') from None
 
     def get_input(self, idx):
         """
         Returns X for a given idx.
         """
-        path = self._y_npys[(self._y_array == str(idx)).nonzero(as_tuple=True)[0]]
+        path = self._y_npys[idx]
         input = np.load(path, allow_pickle=True)
         input = torch.from_numpy(input)
 
         return {'input': input}
 
+    def sequence_lengths(self):
+        """
+        Returns the length of the pixel time series (last dimension of the input) of
+        every data point, e.g., for BucketBatchSampler. Only the headers of the input
+        files are read, once.
+        """
+        if getattr(self, '_sequence_lengths', None) is None:
+            self._sequence_lengths = np.array(
+                [np.load(path, mmap_mode='r', allow_pickle=True).shape[-1] for path in self._y_npys])
+        return self._sequence_lengths
+
     def get_label(self, idx):
         """
         Returns y for a given idx.
         """
-        return self._y_labels[(self._y_array == str(idx)).nonzero(as_tuple=True)[0]]
+        return self._y_labels[idx]
 
     def crop_segmentation_metrics(self, y_true, y_pred):
         y_true = y_true.int()
@@ -6,6 +6,7 @@ import torch
 
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
 from sustainbench.common.metrics.all_metrics import MSE, PearsonCorrelation
+from sustainbench.common.cache import LRUCache
 from sustainbench.common.grouper import CombinatorialGrouper
 from sustainbench.common.utils import subsample_idxs
 
@@ -56,7 +57,7 @@ STD_DEVS = {
 
 def split_by_countries(idxs, ood_countries, metadata):
     countries = np.asarray(metadata['country'].iloc[idxs])
-    is_ood = np.any([(countries == country) for country in ood_countries], axis=0)
+    is_ood = np.isin(countries, list(ood_countries))
     return idxs[~is_ood], idxs[is_ood]
 
 
@@ -144,7 +145,18 @@ class DHSDataset(SustainBenchDataset):
                  split_scheme='official',
                  no_nl=False, fold='A', oracle_training_set=False,
                  use_ood_val=True,
-                 cache_size=100):
+                 cache_size=0, cache_bytes=None):
+        """
+        Args:
+            cache_size: maximum number of decoded images kept in the in-process
+                LRU cache. None or 0 disables the item limit / the cache.
+                Each DataLoader worker keeps its own cache, and shuffled epochs only
+                hit it once it holds most of the split, so the cache is off by default.
+                Size it with cache_bytes to the memory each worker can spare, and keep
+                the workers alive across epochs (persistent_workers, which get_train_loader
+                and get_eval_loader turn on for datasets with a cache).
+            cache_bytes: maximum total size of the cache in bytes. None for no limit.
+        """
         self._version = version
         self._data_dir = self.initialize_data_dir(root_dir, download)
 
@@ -164,6 +176,10 @@ class DHSDataset(SustainBenchDataset):
             raise ValueError("Fold must be A, B, C, D, or E")
 
         self.root = Path(self._data_dir)
+        self._cache = None
+        if cache_size or cache_bytes:
+            self._cache = LRUCache(max_items=cache_size or None, max_bytes=cache_bytes)
+
         self.metadata = pd.read_csv(self.root / 'dhs_metadata.csv')
         # country folds, split off OOD
         country_folds = SURVEY_NAMES[f'2009-17{fold}']
@@ -209,8 +225,11 @@ class DHSDataset(SustainBenchDataset):
         self._y_size = 1
 
         # add country group field
-        country_to_idx = {country: i for i, country in enumerate(DHS_COUNTRIES)}
-        self.metadata['country'] = [country_to_idx[country] for country in self.metadata['country'].tolist()]
+        country_idxs = pd.Categorical(self.metadata['country'], categories=DHS_COUNTRIES).codes
+        if np.any(country_idxs < 0):
+            unknown = self.metadata['country'][country_idxs < 0].unique()
+            raise ValueError(f'Unknown countries in metadata: {list(unknown)}')
+        self.metadata['country'] = country_idxs
         self._metadata_map = {'country': DHS_COUNTRIES}
         self._metadata_array = torch.from_numpy(self.metadata[['urban', 'wealthpooled', 'country']].astype(float).to_numpy())
         # rename wealthpooled to y
@@ -226,13 +245,26 @@ class DHSDataset(SustainBenchDataset):
         """
         Returns x for a given idx.
         """
-        img = np.load(self.root / 'images' / f'landsat_poverty_img_{idx}.npz')['x']
+        if self._cache is None:
+            img = self._load_npz(idx)
+        else:
+            # cached arrays are shared between calls, so hand out a copy
+            img = self._cache.get_or_load(idx, self._load_npz).copy()
+        return torch.from_numpy(img)
+
+    def _load_npz(self, idx):
+        img = np.load(self.root / 'images' / f'landsat_poverty_img_{idx}.npz')['x'].astype(np.float32, copy=False)
         if self.no_nl:
             img[-1] = 0
-        img = torch.from_numpy(img).float()
-
         return img
 
+    def cache_info(self):
+        """
+        Returns the hit / miss / eviction counters of this process's image cache,
+        or None if caching is disabled.
+        """
+        return None if self._cache is None else self._cache.stats()
+
     def eval(self, y_pred, y_true, metadata, prediction_fn=None):
         """
         Computes all evaluation metrics.
@@ -0,0 +1,144 @@
+"""
+Utilities for extracting a dataset archive once and reusing the extracted
+files across dataset constructions.
+
+The extracted directory contains a manifest with the size and CRC-32 checksum
+of every file. A later extraction is skipped when the manifest matches the
+archive and the files on disk, which only requires reading the archive's
+central directory and stat-ing the extracted files.
+"""
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Dict, Optional
+import zipfile
+import zlib
+
+MANIFEST_FILE = 'MANIFEST.json'
+MANIFEST_FORMAT_VERSION = 1
+
+
+def file_crc32(path: str, chunk_size: int = 1024 * 1024) -> int:
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _archive_members(from_path: str) -> Dict[str, Dict[str, int]]:
+    with zipfile.ZipFile(from_path, 'r') as z:
+        return {info.filename: {'size': info.file_size, 'crc32': info.CRC}
+                for info in z.infolist() if not info.is_dir()}
+
+
+def read_manifest(to_path: str) -> Optional[dict]:
+    manifest_path = os.path.join(to_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def manifest_matches(from_path: str, to_path: str) -> bool:
+    """
+    Cheap check of whether to_path holds a complete extraction of the archive
+    at from_path: the archive members must match the manifest (if the archive
+    is still present) and every file in the manifest must exist with its
+    recorded size.
+    """
+    manifest = read_manifest(to_path)
+    if manifest is None or manifest.get('format_version') != MANIFEST_FORMAT_VERSION:
+        return False
+    if os.path.exists(from_path) and _archive_members(from_path) != manifest['archive_members']:
+        return False
+    for rel_path, info in manifest['files'].items():
+        path = os.path.join(to_path, rel_path)
+        if not os.path.isfile(path) or os.path.getsize(path) != info['size']:
+            return False
+    return True
+
+
+def verify_checksums(to_path: str) -> bool:
+    """
+    Full check of the extracted files against the CRC-32 checksums in the
+    manifest. This reads every file, so it is not done on dataset construction.
+    """
+    manifest = read_manifest(to_path)
+    if manifest is None:
+        return False
+    for rel_path, info in manifest['files'].items():
+        path = os.path.join(to_path, rel_path)
+        if not os.path.isfile(path) or file_crc32(path) != info['crc32']:
+            return False
+    return True
+
+
+def extract_archive_once(from_path: str, to_path: str,
+                         post_extract: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Extracts the zip archive at from_path into to_path, unless a previous
+    extraction with a matching manifest is already there.
+    Args:
+        - from_path (str): Path of the zip archive
+        - to_path (str): Directory to extract into. Use a versioned directory
+                         so that different dataset versions do not collide.
+        - post_extract (function): Optional function called with the extraction
+                                   directory before the manifest is written, e.g.,
+                                   to write derived files. Derived files are
+                                   recorded in the manifest as well.
+    Output:
+        - to_path (str): The directory containing the extracted files
+    """
+    if manifest_matches(from_path, to_path):
+        return to_path
+    if not os.path.exists(from_path):
+        raise FileNotFoundError(f'Archive {from_path} not found and no valid extraction exists at {to_path}.')
+
+    # Extract into a temporary directory next to to_path and rename it into
+    # place, so that concurrent constructions never see a partial extraction.
+    parent_dir = os.path.dirname(os.path.abspath(to_path))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=os.path.basename(to_path) + '.tmp')
+    try:
+        with zipfile.ZipFile(from_path, 'r') as z:
+            z.extractall(tmp_dir)
+        archive_members = _archive_members(from_path)
+        if post_extract is not None:
+            post_extract(tmp_dir)
+
+        files = {}
+        for root, _, names in os.walk(tmp_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, tmp_dir).replace(os.sep, '/')
+                if rel_path in archive_members:
+                    # zipfile already verified the CRC during extraction
+                    files[rel_path] = archive_members[rel_path]
+                else:
+                    files[rel_path] = {'size': os.path.getsize(path), 'crc32': file_crc32(path)}
+        manifest = {
+            'format_version': MANIFEST_FORMAT_VERSION,
+            'archive': os.path.basename(from_path),
+            'archive_members': archive_members,
+            'files': files,
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        if manifest_matches(from_path, to_path):
+            # another process finished extracting in the meantime
+            return to_path
+        if os.path.exists(to_path):
+            shutil.rmtree(to_path)
+        try:
+            os.rename(tmp_dir, to_path)
+        except OSError:
+            # another process finished extracting first
+            if not manifest_matches(from_path, to_path):
+                raise
+    finally:
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+    return to_path
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 import shutil
 import pandas as pd
@@ -8,18 +9,49 @@ import numpy as np
 import torchvision.transforms.functional as F
 from torchvision import transforms
 import tarfile
-import datetime
-import pytz
 from PIL import Image
 from tqdm import tqdm
 from sustainbench.common.utils import subsample_idxs
 from sustainbench.common.metrics.all_metrics import Accuracy
 from sustainbench.common.grouper import CombinatorialGrouper
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
+from sustainbench.datasets.memmap_store import MemmapStore, memmap_store_exists, write_memmap_store
 
 Image.MAX_IMAGE_PIXELS = 10000000000
 
 
+def memmap_store_dir(data_dir, resolution):
+    return os.path.join(data_dir, f'rgb_{resolution}_memmap')
+
+
+def prepare_memmap_store(root_dir='data', resolution=224, items_per_shard=1024, overwrite=False):
+    """
+    One-time decode of every non-sequestered rgb_img_{idx}.png, resized to
+    resolution x resolution, into uint8 shard files plus an index, for use with
+    FMoWDataset(storage='memmap').
+    Args:
+        - root_dir (str): Directory containing the fmow dataset folder
+        - resolution (int): Side length that images are resized to
+        - items_per_shard (int): Number of images per shard file
+        - overwrite (bool): Whether to rebuild an existing store
+    Output:
+        - store_dir (str): Path of the written store
+    """
+    data_dir = Path(root_dir) / FMoWDataset._dataset_name
+    metadata = pd.read_csv(data_dir / 'rgb_metadata.csv')
+    keys = np.arange(len(metadata))[np.asarray(metadata['split'] != 'seq')]
+
+    def load_fn(idx):
+        img = Image.open(data_dir / 'images' / f'rgb_img_{idx}.png').convert('RGB')
+        if img.size != (resolution, resolution):
+            img = img.resize((resolution, resolution), Image.BILINEAR)
+        return np.asarray(img)
+
+    return write_memmap_store(
+        memmap_store_dir(str(data_dir), resolution), keys, load_fn, (resolution, resolution, 3), np.uint8,
+        items_per_shard=items_per_shard, overwrite=overwrite)
+
+
 categories = ["airport", "airport_hangar", "airport_terminal", "amusement_park", "aquaculture", "archaeological_site", "barn", "border_checkpoint", "burial_site", "car_dealership", "construction_site", "crop_field", "dam", "debris_or_rubble", "educational_institution", "electric_substation", "factory_or_powerplant", "fire_station", "flooded_road", "fountain", "gas_station", "golf_course", "ground_transportation_station", "helipad", "hospital", "impoverished_settlement", "interchange", "lake_or_pond", "lighthouse", "military_facility", "multi-unit_residential", "nuclear_powerplant", "office_building", "oil_or_gas_facility", "park", "parking_lot_or_garage", "place_of_worship", "police_station", "port", "prison", "race_track", "railway_bridge", "recreational_facility", "road_bridge", "runway", "shipyard", "shopping_mall", "single-unit_residential", "smokestack", "solar_farm", "space_facility", "stadium", "storage_tank", "surface_mine", "swimming_pool", "toll_booth", "tower", "tunnel_opening", "waste_disposal", "water_treatment_facility", "wind_farm", "zoo"]
 
 
@@ -55,7 +87,14 @@ class FMoWDataset(SustainBenchDataset):
             'compressed_size': 53_893_324_800}
     }
 
-    def __init__(self, version=None, root_dir='data', download=False, split_scheme='official', oracle_training_set=False, seed=111, use_ood_val=False):
+    def __init__(self, version=None, root_dir='data', download=False, split_scheme='official', oracle_training_set=False, seed=111, use_ood_val=False,
+                 storage='png', memmap_resolution=224):
+        """
+        Args:
+            storage: 'png' decodes the original PNG of every image. 'memmap' reads
+                pre-decoded, resized images from the store written by prepare_memmap_store.
+            memmap_resolution: resolution of the store to read with storage='memmap'
+        """
         self._version = version
         self._data_dir = self.initialize_data_dir(root_dir, download)
 
@@ -70,25 +109,39 @@ class FMoWDataset(SustainBenchDataset):
         self.seed = int(seed)
         self._original_resolution = (224, 224)
 
+        if storage not in ['png', 'memmap']:
+            raise ValueError(f'Storage {storage} not recognized')
+        self._storage = storage
+        if self._storage == 'memmap':
+            store_dir = memmap_store_dir(self._data_dir, memmap_resolution)
+            if not memmap_store_exists(store_dir):
+                raise FileNotFoundError(
+                    f'No memmap store found at {store_dir}. Run '
+                    f'sustainbench.datasets.fmow_dataset.prepare_memmap_store first.')
+            self._image_store = MemmapStore(store_dir)
+            self._original_resolution = (memmap_resolution, memmap_resolution)
+
         self.category_to_idx = {cat: i for i, cat in enumerate(categories)}
 
         self.metadata = pd.read_csv(self.root / 'rgb_metadata.csv')
         country_codes_df = pd.read_csv(self.root / 'country_code_mapping.csv')
-        countrycode_to_region = {k: v for k, v in zip(country_codes_df['alpha-3'], country_codes_df['region'])}
-        regions = [countrycode_to_region.get(code, 'Other') for code in self.metadata['country_code'].to_list()]
-        self.metadata['region'] = regions
+        countrycode_to_region = pd.Series(country_codes_df['region'].values, index=country_codes_df['alpha-3'])
+        self.metadata['region'] = self.metadata['country_code'].map(countrycode_to_region).fillna('Other')
         all_countries = self.metadata['country_code']
 
         self.num_chunks = 101
         self.chunk_size = len(self.metadata) // (self.num_chunks - 1)
 
+        # parse the timestamps once; all split and year logic works on the UTC year
+        years = pd.to_datetime(self.metadata['timestamp'], utc=True).dt.year.to_numpy()
+        split_col = self.metadata['split'].to_numpy()
+        split_masks = {split: split_col == split for split in ['train', 'val', 'test', 'seq']}
+
         if self._split_scheme.startswith('time_after'):
             year = int(self._split_scheme.split('_')[2])
-            year_dt = datetime.datetime(year, 1, 1, tzinfo=pytz.UTC)
-            self.test_ood_mask = np.asarray(pd.to_datetime(self.metadata['timestamp']) >= year_dt)
+            self.test_ood_mask = years >= year
             # use 3 years of the training set as validation
-            year_minus_3_dt = datetime.datetime(year-3, 1, 1, tzinfo=pytz.UTC)
-            self.val_ood_mask = np.asarray(pd.to_datetime(self.metadata['timestamp']) >= year_minus_3_dt) & ~self.test_ood_mask
+            self.val_ood_mask = (years >= year - 3) & ~self.test_ood_mask
             self.ood_mask = self.test_ood_mask | self.val_ood_mask
         else:
             raise ValueError(f"Not supported: self._split_scheme = {self._split_scheme}")
@@ -97,24 +150,18 @@ class FMoWDataset(SustainBenchDataset):
         for split in self._split_dict.keys():
             idxs = np.arange(len(self.metadata))
             if split == 'test':
-                test_mask = np.asarray(self.metadata['split'] == 'test')
-                idxs = idxs[self.test_ood_mask & test_mask]
+                idxs = idxs[self.test_ood_mask & split_masks['test']]
             elif split == 'val':
-                val_mask = np.asarray(self.metadata['split'] == 'val')
-                idxs = idxs[self.val_ood_mask & val_mask]
+                idxs = idxs[self.val_ood_mask & split_masks['val']]
             elif split == 'id_test':
-                test_mask = np.asarray(self.metadata['split'] == 'test')
-                idxs = idxs[~self.ood_mask & test_mask]
+                idxs = idxs[~self.ood_mask & split_masks['test']]
             elif split == 'id_val':
-                val_mask = np.asarray(self.metadata['split'] == 'val')
-                idxs = idxs[~self.ood_mask & val_mask]
+                idxs = idxs[~self.ood_mask & split_masks['val']]
             else:
-                split_mask = np.asarray(self.metadata['split'] == split)
-                idxs = idxs[~self.ood_mask & split_mask]
+                idxs = idxs[~self.ood_mask & split_masks[split]]
 
             if self.oracle_training_set and split == 'train':
-                test_mask = np.asarray(self.metadata['split'] == 'test')
-                unused_ood_idxs = np.arange(len(self.metadata))[self.ood_mask & ~test_mask]
+                unused_ood_idxs = np.arange(len(self.metadata))[self.ood_mask & ~split_masks['test']]
                 subsample_unused_ood_idxs = subsample_idxs(unused_ood_idxs, num=len(idxs)//2, seed=self.seed+2)
                 subsample_train_idxs = subsample_idxs(idxs.copy(), num=len(idxs) // 2, seed=self.seed+3)
                 idxs = np.concatenate([subsample_unused_ood_idxs, subsample_train_idxs])
@@ -125,31 +172,27 @@ class FMoWDataset(SustainBenchDataset):
             self._split_names = {'train': 'Train', 'val': 'ID Val', 'id_test': 'ID Test', 'ood_val': 'OOD Val', 'test': 'OOD Test'}
 
         # filter out sequestered images from full dataset
-        seq_mask = np.asarray(self.metadata['split'] == 'seq')
+        seq_mask = split_masks['seq']
         # take out the sequestered images
         self._split_array = self._split_array[~seq_mask]
         self.full_idxs = np.arange(len(self.metadata))[~seq_mask]
 
-        self._y_array = np.asarray([self.category_to_idx[y] for y in list(self.metadata['category'])])
+        self._y_array = pd.Categorical(self.metadata['category'], categories=categories).codes.astype(np.int64)
+        if np.any(self._y_array < 0):
+            unknown = self.metadata['category'][self._y_array < 0].unique()
+            raise ValueError(f'Unknown categories in metadata: {list(unknown)}')
         self.metadata['y'] = self._y_array
-        self._y_array = torch.from_numpy(self._y_array).long()[~seq_mask]
+        self._y_array = torch.from_numpy(self._y_array)[~seq_mask]
         self._y_size = 1
         self._n_classes = 62
 
-        # convert region to idxs
-        all_regions = list(self.metadata['region'].unique())
-        region_to_region_idx = {region: i for i, region in enumerate(all_regions)}
-        self._metadata_map = {'region': all_regions}
-        region_idxs = [region_to_region_idx[region] for region in self.metadata['region'].tolist()]
+        # convert region to idxs, in order of first appearance
+        region_idxs, all_regions = pd.factorize(self.metadata['region'])
+        self._metadata_map = {'region': list(all_regions)}
         self.metadata['region'] = region_idxs
 
         # make a year column in metadata
-        year_array = -1 * np.ones(len(self.metadata))
-        ts = pd.to_datetime(self.metadata['timestamp'])
-        for year in range(2002, 2018):
-            year_mask = np.asarray(ts >= datetime.datetime(year, 1, 1, tzinfo=pytz.UTC)) \
-                        & np.asarray(ts < datetime.datetime(year+1, 1, 1, tzinfo=pytz.UTC))
-            year_array[year_mask] = year - 2002
+        year_array = np.where((years >= 2002) & (years < 2018), years - 2002, -1)
         self.metadata['year'] = year_array
         self._metadata_map['year'] = list(range(2002, 2018))
 
@@ -168,6 +211,8 @@ class FMoWDataset(SustainBenchDataset):
         Returns x for a given idx.
         """
         idx = self.full_idxs[idx]
+        if self._storage == 'memmap':
+            return Image.fromarray(self._image_store[idx])
         img = Image.open(self.root / 'images' / f'rgb_img_{idx}.png').convert('RGB')
         return img
 
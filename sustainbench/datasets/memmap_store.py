@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+
+import numpy as np
+from tqdm import tqdm
+
+INDEX_FILE = 'index.json'
+POSITIONS_FILE = 'positions.npy'
+STORE_FORMAT_VERSION = 1
+
+
+def shard_path(store_dir, shard):
+    return os.path.join(store_dir, f'shard_{shard:04d}.npy')
+
+
+def write_memmap_store(store_dir, keys, load_fn, item_shape, dtype,
+                       items_per_shard=1024, overwrite=False, progress=True):
+    """
+    Packs a collection of equally-shaped arrays into a few large fixed-stride
+    .npy shard files plus an index, so that individual items can later be
+    read as zero-copy np.memmap views.
+    Args:
+        - store_dir (str): Output directory for the shards and index
+        - keys (array of int): Dataset indices of the items to write, in storage order
+        - load_fn (function): Maps a key to an array of shape item_shape
+        - item_shape (tuple of int): Shape of every item
+        - dtype (np.dtype): dtype that items are stored as
+        - items_per_shard (int): Number of items per shard file
+        - overwrite (bool): Whether to replace an existing store
+        - progress (bool): Whether to show a progress bar
+    Output:
+        - store_dir (str): The directory containing the written store
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    if keys.ndim != 1 or len(keys) == 0:
+        raise ValueError('keys must be a non-empty 1-D array of integers')
+    if keys.min() < 0:
+        raise ValueError('keys must be non-negative')
+    if len(np.unique(keys)) != len(keys):
+        raise ValueError('keys must be unique')
+    if os.path.exists(os.path.join(store_dir, INDEX_FILE)):
+        if not overwrite:
+            raise FileExistsError(f'A memmap store already exists at {store_dir}. Pass overwrite=True to rebuild it.')
+        shutil.rmtree(store_dir)
+
+    # Write into a temporary directory first so that an interrupted conversion
+    # never leaves behind something that looks like a complete store.
+    tmp_dir = store_dir.rstrip(os.sep) + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    item_shape = tuple(int(d) for d in item_shape)
+    dtype = np.dtype(dtype)
+    num_items = len(keys)
+    num_shards = (num_items + items_per_shard - 1) // items_per_shard
+
+    iterator = range(num_shards)
+    if progress:
+        iterator = tqdm(iterator, desc=f'Writing {os.path.basename(store_dir)}')
+    for shard in iterator:
+        shard_keys = keys[shard * items_per_shard:(shard + 1) * items_per_shard]
+        out = np.lib.format.open_memmap(
+            shard_path(tmp_dir, shard), mode='w+', dtype=dtype,
+            shape=(len(shard_keys),) + item_shape)
+        for i, key in enumerate(shard_keys):
+            item = np.asarray(load_fn(int(key)))
+            if item.shape != item_shape:
+                raise ValueError(f'Item {key} has shape {item.shape}, expected {item_shape}')
+            out[i] = item
+        out.flush()
+        del out
+
+    # positions[key] is the storage slot of key, or -1 if key is not stored
+    positions = -1 * np.ones(keys.max() + 1, dtype=np.int64)
+    positions[keys] = np.arange(num_items)
+    np.save(os.path.join(tmp_dir, POSITIONS_FILE), positions)
+
+    index = {
+        'format_version': STORE_FORMAT_VERSION,
+        'item_shape': list(item_shape),
+        'dtype': dtype.str,
+        'num_items': num_items,
+        'items_per_shard': items_per_shard,
+        'num_shards': num_shards,
+    }
+    with open(os.path.join(tmp_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=2)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+    return store_dir
+
+
+def memmap_store_exists(store_dir):
+    return os.path.exists(os.path.join(store_dir, INDEX_FILE))
+
+
+class MemmapStore:
+    """
+    Read-only view of a store written by write_memmap_store.
+    Items are returned as np.memmap views into the shard files, so reading
+    does not copy or decode anything until the data is actually touched.
+
+    Shards are opened in copy-on-write mode: in-place edits of a returned view
+    only affect the current process and are never written back to disk.
+    Shards are opened lazily and are not pickled, so each DataLoader worker maps
+    the files itself instead of receiving a copy of the data.
+    """
+    def __init__(self, store_dir):
+        if not memmap_store_exists(store_dir):
+            raise FileNotFoundError(f'No memmap store found at {store_dir}.')
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, INDEX_FILE), 'r') as f:
+            index = json.load(f)
+        if index['format_version'] != STORE_FORMAT_VERSION:
+            raise ValueError(f'Unsupported memmap store version {index["format_version"]} in {store_dir}')
+        self.item_shape = tuple(index['item_shape'])
+        self.dtype = np.dtype(index['dtype'])
+        self.num_items = index['num_items']
+        self.items_per_shard = index['items_per_shard']
+        self.num_shards = index['num_shards']
+        self.positions = np.load(os.path.join(store_dir, POSITIONS_FILE))
+        self._shards = [None] * self.num_shards
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = [None] * self.num_shards
+        return state
+
+    def __len__(self):
+        return self.num_items
+
+    def __contains__(self, key):
+        return 0 <= key < len(self.positions) and self.positions[key] >= 0
+
+    @property
+    def nbytes(self):
+        return self.num_items * int(np.prod(self.item_shape)) * self.dtype.itemsize
+
+    def _shard(self, shard):
+        if self._shards[shard] is None:
+            self._shards[shard] = np.load(shard_path(self.store_dir, shard), mmap_mode='c')
+        return self._shards[shard]
+
+    def _locate(self, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        if np.any(keys < 0) or np.any(keys >= len(self.positions)):
+            raise KeyError(f'Key out of range for memmap store at {self.store_dir}')
+        slots = self.positions[keys]
+        if np.any(slots < 0):
+            raise KeyError(f'Key not present in memmap store at {self.store_dir}')
+        return slots // self.items_per_shard, slots % self.items_per_shard
+
+    def __getitem__(self, key):
+        """
+        Args:
+            - key (int): Dataset index of the item
+        Output:
+            - item (np.memmap): Zero-copy view of the stored item
+        """
+        shard, offset = self._locate(int(key))
+        return self._shard(int(shard))[int(offset)]
+
+    def read_batch(self, keys):
+        """
+        Reads several items with one sorted fancy-indexing read per shard.
+        Args:
+            - keys (array of int): Dataset indices of the items
+        Output:
+            - items (np.ndarray): Array of shape (len(keys), *item_shape)
+        """
+        shards, offsets = self._locate(keys)
+        items = np.empty((len(shards),) + self.item_shape, dtype=self.dtype)
+        if len(shards) == 0:
+            return items
+        order = np.lexsort((offsets, shards))
+        bounds = np.flatnonzero(np.diff(shards[order])) + 1
+        for group in np.split(order, bounds):
+            items[group] = self._shard(int(shards[group[0]]))[offsets[group]]
+        return items
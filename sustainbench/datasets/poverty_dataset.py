@@ -7,7 +7,9 @@ import torch
 from torch.utils.data import Dataset
 
 from sustainbench.datasets.sustainbench_dataset import SustainBenchDataset
+from sustainbench.datasets.memmap_store import MemmapStore, memmap_store_exists, write_memmap_store
 from sustainbench.common.metrics.all_metrics import MSE, PearsonCorrelation
+from sustainbench.common.cache import LRUCache
 from sustainbench.common.grouper import CombinatorialGrouper
 from sustainbench.common.utils import subsample_idxs, shuffle_arr
 
@@ -56,12 +58,39 @@ STD_DEVS = {
 }
 
 
+MEMMAP_DIR = 'images_memmap'
+
+
 def split_by_countries(idxs, ood_countries, metadata):
     countries = np.asarray(metadata['country'].iloc[idxs])
-    is_ood = np.any([(countries == country) for country in ood_countries], axis=0)
+    is_ood = np.isin(countries, list(ood_countries))
     return idxs[~is_ood], idxs[is_ood]
 
 
+def prepare_memmap_store(root_dir='data', items_per_shard=1024, overwrite=False):
+    """
+    One-time conversion of the per-image npz files into fixed-stride float32
+    shard files plus an index, for use with PovertyMapDataset(storage='memmap').
+    Args:
+        - root_dir (str): Directory containing the poverty dataset folder
+        - items_per_shard (int): Number of images per shard file
+        - overwrite (bool): Whether to rebuild an existing store
+    Output:
+        - store_dir (str): Path of the written store
+    """
+    data_dir = Path(root_dir) / PovertyMapDataset._dataset_name
+    metadata = pd.read_csv(data_dir / 'dhs_metadata.csv')
+    keys = np.arange(len(metadata))
+
+    def load_fn(idx):
+        return np.load(data_dir / 'images' / f'landsat_poverty_img_{idx}.npz')['x']
+
+    item_shape = load_fn(keys[0]).shape
+    return write_memmap_store(
+        str(data_dir / MEMMAP_DIR), keys, load_fn, item_shape, np.float32,
+        items_per_shard=items_per_shard, overwrite=overwrite)
+
+
 class PovertyMapDataset(SustainBenchDataset):
     """The PovertyMap poverty measure prediction dataset.
 
@@ -148,7 +177,21 @@ class PovertyMapDataset(SustainBenchDataset):
                  split_scheme='official',
                  no_nl=False, fold='A', oracle_training_set=False,
                  use_ood_val=True,
-                 cache_size=100):
+                 cache_size=0, cache_bytes=None, storage='npz'):
+        """
+        Args:
+            cache_size: maximum number of decoded images kept in the in-process
+                LRU cache. None or 0 disables the item limit / the cache.
+                Each DataLoader worker keeps its own cache, and shuffled epochs only
+                hit it once it holds most of the split, so the cache is off by default.
+                Size it with cache_bytes to the memory each worker can spare, and keep
+                the workers alive across epochs (persistent_workers, which get_train_loader
+                and get_eval_loader turn on for datasets with a cache).
+            cache_bytes: maximum total size of the cache in bytes. None for no limit.
+            storage: 'npz' reads one compressed npz file per image. 'memmap' copies
+                images out of the memory-mapped shards written by prepare_memmap_store,
+                which skips decompression but not the copy.
+        """
         self._version = version
         self._data_dir = self.initialize_data_dir(root_dir, download)
 
@@ -168,6 +211,22 @@ class PovertyMapDataset(SustainBenchDataset):
             raise ValueError("Fold must be A, B, C, D, or E")
 
         self.root = Path(self._data_dir)
+        if storage not in ['npz', 'memmap']:
+            raise ValueError(f'Storage {storage} not recognized')
+        self._storage = storage
+        if self._storage == 'memmap':
+            store_dir = str(self.root / MEMMAP_DIR)
+            if not memmap_store_exists(store_dir):
+                raise FileNotFoundError(
+                    f'No memmap store found at {store_dir}. Run '
+                    f'sustainbench.datasets.poverty_dataset.prepare_memmap_store first.')
+            self._image_store = MemmapStore(store_dir)
+
+        # memmapped images are already served from the page cache
+        self._cache = None
+        if self._storage == 'npz' and (cache_size or cache_bytes):
+            self._cache = LRUCache(max_items=cache_size or None, max_bytes=cache_bytes)
+
         self.metadata = pd.read_csv(self.root / 'dhs_metadata.csv')
         # country folds, split off OOD
         country_folds = SURVEY_NAMES[f'2009-17{fold}']
@@ -213,8 +272,11 @@ class PovertyMapDataset(SustainBenchDataset):
         self._y_size = 1
 
         # add country group field
-        country_to_idx = {country: i for i, country in enumerate(DHS_COUNTRIES)}
-        self.metadata['country'] = [country_to_idx[country] for country in self.metadata['country'].tolist()]
+        country_idxs = pd.Categorical(self.metadata['country'], categories=DHS_COUNTRIES).codes
+        if np.any(country_idxs < 0):
+            unknown = self.metadata['country'][country_idxs < 0].unique()
+            raise ValueError(f'Unknown countries in metadata: {list(unknown)}')
+        self.metadata['country'] = country_idxs
         self._metadata_map = {'country': DHS_COUNTRIES}
         self._metadata_array = torch.from_numpy(self.metadata[['urban', 'wealthpooled', 'country']].astype(float).to_numpy())
         # rename wealthpooled to y
@@ -229,14 +291,48 @@ class PovertyMapDataset(SustainBenchDataset):
     def get_input(self, idx):
         """
         Returns x for a given idx.
+        With storage='memmap', x is copied from the page cache of the mapped shard.
+        """
+        if self._storage == 'memmap':
+            # copy out of the mapping, so that neither no_nl nor in-place transforms
+            # write to the shared pages (which would change later reads of idx and
+            # turn the pages into private memory of this process)
+            img = np.array(self._image_store[idx], dtype=np.float32)
+            if self.no_nl:
+                img[-1] = 0
+            return torch.from_numpy(img)
+
+        if self._cache is None:
+            img = self._load_npz(idx)
+        else:
+            # cached arrays are shared between calls, so hand out a copy
+            img = self._cache.get_or_load(idx, self._load_npz).copy()
+        return torch.from_numpy(img)
+
+    def get_input_batch(self, indices):
         """
-        img = np.load(self.root / 'images' / f'landsat_poverty_img_{idx}.npz')['x']
+        Returns x for several indices, read in shard order when storage='memmap'.
+        """
+        if self._storage != 'memmap':
+            return super().get_input_batch(indices)
+        imgs = self._image_store.read_batch(indices)
         if self.no_nl:
-            img[-1] = 0
-        img = torch.from_numpy(img).float()
+            imgs[:, -1] = 0
+        return torch.from_numpy(imgs)
 
+    def _load_npz(self, idx):
+        img = np.load(self.root / 'images' / f'landsat_poverty_img_{idx}.npz')['x'].astype(np.float32, copy=False)
+        if self.no_nl:
+            img[-1] = 0
         return img
 
+    def cache_info(self):
+        """
+        Returns the hit / miss / eviction counters of this process's image cache,
+        or None if caching is disabled.
+        """
+        return None if self._cache is None else self._cache.stats()
+
     def eval(self, y_pred, y_true, metadata, prediction_fn=None):
         """
         Computes all evaluation metrics.
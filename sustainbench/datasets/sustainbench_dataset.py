@@ -3,6 +3,20 @@ from pathlib import Path
 import time
 
 import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+from sustainbench.common.metrics.metric import percentile_interval
+
+
+def gather(array, indices):
+    """
+    Gathers the rows of a Tensor or numpy array at indices with a single
+    fancy-indexing op. The rows keep the type of array, like array[idx] does.
+    """
+    if isinstance(array, torch.Tensor):
+        return array[torch.from_numpy(indices)]
+    return np.asarray(array)[indices]
 
 
 class SustainBenchDataset:
@@ -39,6 +53,28 @@ class SustainBenchDataset:
         metadata = self.metadata_array[idx]
         return x, y, metadata
 
+    def __getitems__(self, indices):
+        """
+        Batched counterpart of __getitem__, called by torch DataLoaders with all
+        indices of a batch. Datasets that override get_input_batch read the inputs
+        of the whole batch at once, and labels and metadata are gathered with one
+        indexing op each. Other datasets fall back to __getitem__.
+        Args:
+            - indices (list or array of int): Indices of the data points
+        Output:
+            - items (list): (x, y, metadata) tuples like __getitem__, so that any
+                            collate_fn, including torch's default_collate, works
+        """
+        if (type(self).__getitem__ is not SustainBenchDataset.__getitem__
+                or type(self).get_input_batch is SustainBenchDataset.get_input_batch
+                or isinstance(self.y_array[0], Path)):
+            return [self[idx] for idx in indices]
+        indices = np.asarray(indices, dtype=np.int64)
+        x = self.get_input_batch(indices)
+        y = gather(self.y_array, indices)
+        metadata = gather(self.metadata_array, indices)
+        return list(zip(x, y, metadata))
+
     def get_input(self, idx):
         """
         Args:
@@ -48,6 +84,22 @@ class SustainBenchDataset:
         """
         return self.dataset[self.indices[idx]]
 
+    def get_input_batch(self, indices):
+        """
+        Reads the inputs of several data points at once.
+        Datasets can override this with a vectorized or sorted bulk read,
+        which __getitems__ then uses. The rows must have the type that
+        get_input returns, since subset transforms are applied to them.
+        Args:
+            - indices (np.ndarray): Indices of the data points
+        Output:
+            - x (Tensor or np.ndarray): Input features stacked along the first dimension
+        """
+        inputs = [self.get_input(idx) for idx in indices]
+        if isinstance(inputs[0], np.ndarray):
+            return np.stack(inputs)
+        return default_collate(inputs)
+
     #def eval(self, y_pred, y_true, metadata):
         """
         Args:
@@ -426,7 +478,8 @@ class SustainBenchDataset:
         return results, results_str
 
     @staticmethod
-    def standard_group_eval(metric, grouper, y_pred, y_true, metadata, aggregate=True):
+    def standard_group_eval(metric, grouper, y_pred, y_true, metadata, aggregate=True,
+                            n_bootstrap=0, confidence=0.95, seed=None):
         """
         Args:
             - metric (Metric): Metric to use for eval
@@ -434,30 +487,56 @@ class SustainBenchDataset:
             - y_pred (Tensor): Predicted targets
             - y_true (Tensor): True targets
             - metadata (Tensor): Metadata
+            - n_bootstrap (int): Number of bootstrap replicates. If positive, percentile
+                                 confidence intervals are added as *_ci_low / *_ci_high results.
+            - confidence (float): Coverage of the confidence intervals
+            - seed (int): Seed of the bootstrap resampling
         Output:
             - results (dict): Dictionary of results
             - results_str (str): Pretty print version of the results
         """
         results, results_str = {}, ''
-        if aggregate:
-            results.update(metric.compute(y_pred, y_true))
-            results_str += f"Average {metric.name}: {results[metric.agg_metric_field]:.3f}\n"
         g = grouper.metadata_to_group(metadata)
-        group_results = metric.compute_group_wise(y_pred, y_true, g, grouper.n_groups)
+        agg_ci = group_ci = worst_ci = None
+        if n_bootstrap > 0:
+            agg_reps, group_reps, worst_reps = metric.bootstrap_group_wise(
+                y_pred, y_true, g, grouper.n_groups, n_bootstrap=n_bootstrap, seed=seed)
+            agg_ci, group_ci, worst_ci = (
+                [bound.tolist() for bound in percentile_interval(reps, confidence)]
+                for reps in (agg_reps, group_reps, worst_reps))
+
+        def ci_str(ci, idx=None):
+            if n_bootstrap <= 0:
+                return ''
+            lower, upper = ci if idx is None else (ci[0][idx], ci[1][idx])
+            return f' [{lower:.3f}, {upper:.3f}]'
+
+        def add_ci(key, ci, idx=None):
+            if n_bootstrap > 0:
+                results[f'{key}_ci_low'], results[f'{key}_ci_high'] = ci if idx is None else (ci[0][idx], ci[1][idx])
+
+        # all metrics and counts come to the host in a single transfer
+        group_results = metric.compute_group_results(y_pred, y_true, g, grouper.n_groups, aggregate=aggregate)
+        group_metrics, group_counts, worst_group_metric, agg_metric = group_results.tolist()
+        if aggregate:
+            results[metric.agg_metric_field] = agg_metric
+            add_ci(metric.agg_metric_field, agg_ci)
+            results_str += f"Average {metric.name}: {agg_metric:.3f}{ci_str(agg_ci)}\n"
         for group_idx in range(grouper.n_groups):
             group_str = grouper.group_field_str(group_idx)
-            group_metric = group_results[metric.group_metric_field(group_idx)]
-            group_counts = group_results[metric.group_count_field(group_idx)]
-            results[f'{metric.name}_{group_str}'] = group_metric
-            results[f'count_{group_str}'] = group_counts
-            if group_results[metric.group_count_field(group_idx)] == 0:
+            results[f'{metric.name}_{group_str}'] = group_metrics[group_idx]
+            results[f'count_{group_str}'] = group_counts[group_idx]
+            if group_counts[group_idx] == 0:
                 continue
+            add_ci(f'{metric.name}_{group_str}', group_ci, group_idx)
             results_str += (
                 f'  {grouper.group_str(group_idx)}  '
-                f"[n = {group_results[metric.group_count_field(group_idx)]:6.0f}]:\t"
-                f"{metric.name} = {group_results[metric.group_metric_field(group_idx)]:5.3f}\n")
-        results[f'{metric.worst_group_metric_field}'] = group_results[f'{metric.worst_group_metric_field}']
-        results_str += f"Worst-group {metric.name}: {group_results[metric.worst_group_metric_field]:.3f}\n"
+                f"[n = {group_counts[group_idx]:6.0f}]:\t"
+                f"{metric.name} = {group_metrics[group_idx]:5.3f}"
+                f"{ci_str(group_ci, group_idx)}\n")
+        results[f'{metric.worst_group_metric_field}'] = worst_group_metric
+        add_ci(metric.worst_group_metric_field, worst_ci)
+        results_str += f"Worst-group {metric.name}: {worst_group_metric:.3f}{ci_str(worst_ci)}\n"
         return results, results_str
 
 
@@ -485,6 +564,16 @@ class SustainBenchSubset(SustainBenchDataset):
             x = self.transform(x)
         return x, y #, metadata
 
+    def __getitems__(self, indices):
+        # Datasets with the default __getitem__ read the whole batch, and
+        # transforms are then applied per data point like in __getitem__.
+        if type(self.dataset).__getitem__ is not SustainBenchDataset.__getitem__:
+            return [self[idx] for idx in indices]
+        items = self.dataset.__getitems__(self.indices[np.asarray(indices, dtype=np.int64)])
+        if self.transform is None:
+            return [(x, y) for x, y, _ in items]
+        return [(self.transform(x), y) for x, y, _ in items]
+
     def __len__(self):
         return len(self.indices)
 
@@ -500,5 +589,8 @@ class SustainBenchSubset(SustainBenchDataset):
     def metadata_array(self):
         return self.dataset.metadata_array[self.indices]
 
+    def sequence_lengths(self):
+        return self.dataset.sequence_lengths()[self.indices]
+
     def eval(self, y_pred, y_true, metadata):
         return self.dataset.eval(y_pred, y_true, metadata)
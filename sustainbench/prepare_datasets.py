@@ -0,0 +1,59 @@
+import argparse
+
+# datasets with a one-time preprocessing step that speeds up data loading
+PREPARABLE_DATASETS = ['poverty', 'fmow']
+
+
+def main() -> None:
+    """
+    Converts already-downloaded datasets into faster on-disk formats.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--root_dir', required=True,
+        help='The directory where [dataset]/data can be found.')
+    parser.add_argument(
+        '--datasets', nargs='*', default=None,
+        help='A space-separated list of dataset names to prepare. If left '
+             'unspecified, the script will prepare all datasets that support '
+             f'it. Available choices are {PREPARABLE_DATASETS}.')
+    parser.add_argument(
+        '--items_per_shard', type=int, default=1024,
+        help='Number of examples to pack into each shard file.')
+    parser.add_argument(
+        '--resolution', type=int, default=224,
+        help='Side length that fmow images are resized to.')
+    parser.add_argument(
+        '--overwrite', action='store_true',
+        help='Rebuild prepared files even if they already exist.')
+    config = parser.parse_args()
+
+    if config.datasets is None:
+        config.datasets = PREPARABLE_DATASETS
+
+    for dataset in config.datasets:
+        if dataset not in PREPARABLE_DATASETS:
+            raise ValueError(f'{dataset} not recognized; must be one of '
+                             f'{PREPARABLE_DATASETS}.')
+
+    print(f'Preparing the following datasets: {config.datasets}')
+    for dataset in config.datasets:
+        print(f'=== {dataset} ===')
+        if dataset == 'poverty':
+            from sustainbench.datasets.poverty_dataset import prepare_memmap_store
+            store_dir = prepare_memmap_store(
+                root_dir=config.root_dir,
+                items_per_shard=config.items_per_shard,
+                overwrite=config.overwrite)
+        elif dataset == 'fmow':
+            from sustainbench.datasets.fmow_dataset import prepare_memmap_store
+            store_dir = prepare_memmap_store(
+                root_dir=config.root_dir,
+                resolution=config.resolution,
+                items_per_shard=config.items_per_shard,
+                overwrite=config.overwrite)
+        print(f'Wrote memmap store to {store_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# make sustainbench and the benchmark fixtures importable without installing the package
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+import sklearn.metrics
+
+from benchmarks import fixtures
+from sustainbench.datasets.crop_seg_dataset import CropSegmentationDataset
+
+
+def test_crop_segmentation_metrics_match_sklearn(tmp_path):
+    fixtures.write_crop_seg_fixture(str(tmp_path), n_images=4, img_dim=8)
+    dataset = CropSegmentationDataset(root_dir=str(tmp_path))
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 2, size=(4, 16, 16))
+    scores = np.clip(y_true * 0.6 + rng.random(y_true.shape) * 0.5, 0, 1)
+
+    f1, acc, precision_recall = dataset.crop_segmentation_metrics(y_true, scores, binarized=False)
+    y_pred = (scores > 0.5).astype(int).flatten()
+    assert f1 == pytest.approx(sklearn.metrics.f1_score(y_true.flatten(), y_pred))
+    assert acc == pytest.approx(sklearn.metrics.accuracy_score(y_true.flatten(), y_pred))
+    expected = sklearn.metrics.precision_recall_fscore_support(y_true.flatten(), y_pred, average='binary')
+    assert precision_recall[:3] == pytest.approx(expected[:3])
+    assert precision_recall[3] is None
+
+    *_, iou = dataset.crop_segmentation_metrics(y_true, scores, binarized=False, iou=True)
+    assert iou == pytest.approx(sklearn.metrics.jaccard_score(y_true.flatten(), y_pred, average=None).tolist())
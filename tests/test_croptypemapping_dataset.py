@@ -0,0 +1,46 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+import sklearn.metrics
+import torch
+
+from benchmarks import fixtures
+from sustainbench.datasets.croptypemapping_dataset import (
+    DATES_INDEX_FILE, CropTypeMappingDataset, build_dates_index, load_dates_index)
+
+
+def _build(data_dir, n_builds):
+    for _ in range(n_builds):
+        build_dates_index(data_dir, 'ghana', np.arange(20))
+
+
+def test_concurrent_dates_index_builds(tmp_path):
+    fixtures.write_crop_type_mapping_fixture(str(tmp_path), n_locations=20, img_dim=2, planet_dim=2)
+    data_dir = os.path.join(str(tmp_path), 'africa_crop_type_mapping')
+    # e.g., DDP ranks constructing the dataset at the same time
+    with ProcessPoolExecutor(4) as executor:
+        for future in [executor.submit(_build, data_dir, 10) for _ in range(4)]:
+            future.result()
+
+    assert sorted(os.listdir(os.path.join(data_dir, 'ghana'))) == sorted(
+        ['npy', 'truth', 's1', 's2', 'planet', 'list_eval_partition.csv', DATES_INDEX_FILE])
+    index = load_dates_index(data_dir, 'ghana', np.arange(20))
+    expected = build_dates_index(data_dir, 'ghana', np.arange(20))
+    assert index.keys() == expected.keys()
+    assert all(np.array_equal(index[key], expected[key]) for key in index)
+
+
+def test_crop_segmentation_metrics_match_sklearn(tmp_path):
+    fixtures.write_crop_type_mapping_fixture(str(tmp_path), n_locations=4, img_dim=2, planet_dim=2)
+    dataset = CropTypeMappingDataset(root_dir=str(tmp_path))
+    rng = np.random.default_rng(0)
+    y_true = torch.from_numpy(rng.integers(0, 4, size=(8, 8)))
+    y_pred = torch.where(torch.from_numpy(rng.random((8, 8)) < 0.6), y_true, torch.from_numpy(rng.integers(0, 4, size=(8, 8))))
+
+    f1, acc = dataset.crop_segmentation_metrics(y_true, y_pred)
+    assert f1 == pytest.approx(sklearn.metrics.f1_score(y_true.flatten(), y_pred.flatten(), average='macro'))
+    assert acc == pytest.approx(sklearn.metrics.accuracy_score(y_true.flatten(), y_pred.flatten()))
+    *_, iou = dataset.crop_segmentation_metrics(y_true, y_pred, iou=True)
+    assert iou == pytest.approx(sklearn.metrics.jaccard_score(y_true.flatten(), y_pred.flatten(), average=None).tolist())
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from benchmarks import fixtures
+from sustainbench.datasets.croptypemapping_kenya import CROPS, CropTypeMappingKenyaDataset
+
+
+@pytest.fixture
+def kenya(tmp_path):
+    with fixtures.working_directory(str(tmp_path)):
+        field_ids = fixtures.write_kenya_fixture(str(tmp_path), n_fields=30)
+        dataset = CropTypeMappingKenyaDataset(root_dir=os.path.join(str(tmp_path), 'data'))
+    return dataset, field_ids
+
+
+def test_items_are_indexed_by_row(kenya):
+    dataset, field_ids = kenya
+    assert not np.array_equal(field_ids, np.arange(len(field_ids)))
+    for idx in [0, 7, len(dataset) - 1]:
+        x, y = dataset[idx][:2]
+        expected = np.load(os.path.join(os.path.dirname(dataset._y_npys[0]), f'field_{field_ids[idx]}.npy'))
+        assert torch.equal(x['input'], torch.from_numpy(expected))
+        assert y == dataset._y_labels[idx]
+        assert 0 <= y < len(CROPS)
+
+
+def test_field_row_looks_up_by_field_id(kenya):
+    dataset, field_ids = kenya
+    for row, field_id in enumerate(field_ids):
+        assert dataset.field_row(field_id) == row
+    with pytest.raises(KeyError):
+        dataset.field_row(-1)
+
+
+def test_bucketed_loader_on_subset(tmp_path):
+    from sustainbench.common.data_loaders import get_train_loader, padding_overhead
+
+    with fixtures.working_directory(str(tmp_path)):
+        fixtures.write_kenya_fixture(str(tmp_path), n_fields=200, min_timesteps=2, max_timesteps=40)
+        dataset = CropTypeMappingKenyaDataset(root_dir=os.path.join(str(tmp_path), 'data'))
+    subset = dataset.get_subset('train')
+    lengths = subset.sequence_lengths()
+    assert len(np.unique(lengths)) > 1
+
+    loader = get_train_loader('bucketed', subset, batch_size=8, seed=0, bucket_size=16)
+    seen = []
+    for batch_idxs, (x, y) in zip(loader.batch_sampler.plan_epoch(0), loader):
+        assert torch.equal(x['input_lengths'], torch.from_numpy(lengths[batch_idxs]))
+        for i, idx in enumerate(batch_idxs):
+            item_x, item_y = subset[idx]
+            length = item_x['input'].shape[-1]
+            assert torch.equal(x['input'][i, :, :length], item_x['input'])
+            assert not x['input_mask'][i, length:].any()
+            assert y[i] == item_y
+        seen.extend(batch_idxs.tolist())
+    assert sorted(seen) == list(range(len(subset)))
+
+    shuffled = np.random.default_rng(0).permutation(len(subset))
+    shuffled_overhead = np.mean([padding_overhead(lengths[shuffled[i:i + 8]]) for i in range(0, len(subset), 8)])
+    bucketed_overhead = loader.batch_sampler.padding_overhead().mean()
+    assert bucketed_overhead < shuffled_overhead / 2
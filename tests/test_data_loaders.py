@@ -0,0 +1,71 @@
+import socket
+
+import numpy as np
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from sustainbench.common.data_loaders import (
+    BucketBatchSampler, DistributedRandomSampler, GroupSampler, _distributed_rank)
+
+
+def test_unseeded_samplers_follow_global_numpy_seed():
+    group_ids = np.arange(60) % 3
+
+    def plans():
+        np.random.seed(0)
+        group_sampler = GroupSampler(group_ids, batch_size=6, n_groups_per_batch=2,
+                                     uniform_over_groups=True, distinct_groups=True)
+        bucket_sampler = BucketBatchSampler(np.arange(60) % 7, batch_size=6)
+        return list(group_sampler), list(bucket_sampler)
+
+    (groups_a, buckets_a), (groups_b, buckets_b) = plans(), plans()
+    assert all(np.array_equal(a, b) for a, b in zip(groups_a, groups_b))
+    assert all(np.array_equal(a, b) for a, b in zip(buckets_a, buckets_b))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _sampler_worker(rank, world_size, port, results):
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank, world_size=world_size)
+    try:
+        # the rank and number of replicas come from the process group
+        num_replicas, rank = _distributed_rank()
+        random_sampler = DistributedRandomSampler(50, num_replicas, rank, seed=3)
+        group_sampler = GroupSampler(np.arange(60) % 4, batch_size=4, n_groups_per_batch=2,
+                                     uniform_over_groups=True, distinct_groups=True, seed=3,
+                                     num_replicas=num_replicas, rank=rank)
+        results[rank] = (list(random_sampler), [batch.tolist() for batch in group_sampler])
+    finally:
+        dist.destroy_process_group()
+
+
+def test_distributed_samplers_split_the_single_process_plan():
+    world_size = 3
+    with mp.Manager() as manager:
+        results = manager.dict()
+        mp.spawn(_sampler_worker, args=(world_size, _free_port(), results), nprocs=world_size)
+        results = [results[rank] for rank in range(world_size)]
+
+    # each rank takes every world_size-th element of the same epoch plan
+    random_plan = DistributedRandomSampler(50, world_size, 0, seed=3).plan_epoch().tolist()
+    positions = [list(range(rank, len(random_plan), world_size)) for rank in range(world_size)]
+    assert sorted(sum(positions, [])) == list(range(len(random_plan)))
+    for rank, (indices, _) in enumerate(results):
+        assert indices == [random_plan[i] for i in positions[rank]]
+    # together the ranks see every data point, and only the padding of the last slot repeats one
+    all_indices = sum((indices for indices, _ in results), [])
+    assert sorted(all_indices) == sorted(random_plan)
+    assert set(all_indices) == set(range(50)) and len(all_indices) == 51
+
+    group_sampler = GroupSampler(np.arange(60) % 4, batch_size=4, n_groups_per_batch=2,
+                                 uniform_over_groups=True, distinct_groups=True, seed=3)
+    group_plan = [batch.tolist() for batch in group_sampler.plan_epoch()]
+    n_batches = len(results[0][1])
+    assert all(len(batches) == n_batches for _, batches in results)
+    # the ranks' batches are disjoint slices that together form the single-process plan
+    interleaved = [results[i % world_size][1][i // world_size] for i in range(world_size * n_batches)]
+    assert interleaved == group_plan[:world_size * n_batches]
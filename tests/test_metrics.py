@@ -0,0 +1,260 @@
+import socket
+
+import numpy as np
+import pytest
+import scipy.stats
+import sklearn.metrics
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from sustainbench.common.metrics.all_metrics import (
+    F1, MSE, Accuracy, PearsonCorrelation, Precision, PrecisionAtRecall, Recall)
+from sustainbench.common.metrics.confusion import (
+    accuracy_from_confusion, classification_scores, confusion_matrix, iou_from_confusion)
+from sustainbench.common.metrics.metric import percentile_interval
+from sustainbench.common.metrics.threshold_sweep import ThresholdSweep
+from sustainbench.common.utils import threshold_at_recall
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _shards(world_size):
+    # the shards have different maximum labels, and the last one is empty
+    y_true = torch.tensor([0, 1, 2, 3, 4, 1, 0, 3, 4, 2])
+    y_pred = torch.tensor([0, 1, 1, 3, 4, 1, 2, 3, 0, 2])
+    g = torch.tensor([0, 1, 0, 1, 0, 1, 0, 1, 0, 1])
+    cuts = [0, 3, 10] + [10] * (world_size - 2)
+    return [(y_pred[a:b], y_true[a:b], g[a:b]) for a, b in zip(cuts[:-1], cuts[1:])], (y_pred, y_true, g)
+
+
+def _reduce_worker(rank, world_size, port, results):
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank, world_size=world_size)
+    try:
+        shards, _ = _shards(world_size)
+        accumulator = F1(average='macro').accumulator(2)
+        y_pred, y_true, g = shards[rank]
+        if len(y_true) > 0:
+            accumulator.update(y_pred, y_true, g)
+        output = accumulator.finalize(distributed=True)
+        if rank == 0:
+            results.update(output)
+    finally:
+        dist.destroy_process_group()
+
+
+def test_reduce_pads_inferred_confusion_matrices():
+    world_size = 3
+    with mp.Manager() as manager:
+        results = manager.dict()
+        mp.spawn(_reduce_worker, args=(world_size, _free_port(), results), nprocs=world_size)
+        results = dict(results)
+    _, (y_pred, y_true, g) = _shards(world_size)
+    assert results == F1(average='macro').compute_group_wise(y_pred, y_true, g, 2)
+
+
+def test_merge_pads_inferred_confusion_matrices():
+    _, (y_pred, y_true, g) = _shards(2)
+    metric = F1(average='macro')
+    # the first part only has labels up to 2, the second up to 4
+    first, second = metric.accumulator(2), metric.accumulator(2)
+    first.update(y_pred[:3], y_true[:3], g[:3])
+    second.update(y_pred[3:], y_true[3:], g[3:])
+    assert first.stats.shape != second.stats.shape
+    assert first.merge(second).finalize() == metric.compute_group_wise(y_pred, y_true, g, 2)
+
+    empty = metric.accumulator(2)
+    assert empty.merge(first).finalize() == first.finalize()
+
+
+def test_confusion_metrics_reject_scores():
+    scores = torch.tensor([0.1, 0.9, 0.8, 0.2, 0.7])
+    y_true = torch.tensor([0, 1, 1, 0, 0])
+    with pytest.raises(ValueError, match='continuous'):
+        F1().compute(scores, y_true)
+    with pytest.raises(ValueError, match='continuous'):
+        confusion_matrix(y_true, scores, 2)
+    # integer-valued floats are labels
+    assert confusion_matrix(y_true, (scores > 0.5).float(), 2).tolist() == [[2, 1], [0, 2]]
+
+
+def test_precision_at_global_recall_without_score_fn():
+    scores = torch.tensor([0.1, 0.9, 0.8, 0.2, 0.7])
+    y_true = torch.tensor([0, 1, 1, 0, 0])
+    metric = PrecisionAtRecall.at_global_recall(scores, y_true, global_recall=100)
+    # the two positives have the highest scores
+    assert metric.compute(scores, y_true)[metric.agg_metric_field] == 1.0
+
+
+def test_percentile_interval_matches_nanquantile():
+    replicates = torch.randn(200, 5, dtype=torch.double, generator=torch.Generator().manual_seed(0))
+    replicates[::3, 1] = float('nan')
+    replicates[:, 2] = float('nan')
+    replicates[1:, 3] = float('nan')
+    lower, upper = percentile_interval(replicates, confidence=0.9)
+    expected = torch.nanquantile(replicates, torch.tensor([0.05, 0.95], dtype=torch.double), dim=0)
+    assert torch.allclose(torch.stack([lower, upper]), expected, equal_nan=True)
+
+
+def _random_labels(n=600, n_classes=5, n_groups=3, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    y_true = torch.randint(n_classes, (n, ), generator=generator)
+    # mostly correct predictions, so that the scores are not all near chance
+    noise = torch.randint(n_classes, (n, ), generator=generator)
+    y_pred = torch.where(torch.rand(n, generator=generator) < 0.6, y_true, noise)
+    g = torch.randint(n_groups, (n, ), generator=generator)
+    # a class that only some groups have
+    y_true[(g==0) & (y_true==4)] = 3
+    return y_pred, y_true, g
+
+
+@pytest.mark.parametrize('metric_cls, sklearn_fn', [
+    (Precision, sklearn.metrics.precision_score),
+    (Recall, sklearn.metrics.recall_score),
+    (F1, sklearn.metrics.f1_score),
+])
+@pytest.mark.parametrize('average', ['binary', 'macro', 'micro', 'weighted'])
+def test_confusion_metrics_match_sklearn(metric_cls, sklearn_fn, average):
+    y_pred, y_true, g = _random_labels()
+    if average == 'binary':
+        y_pred, y_true = (y_pred > 2).long(), (y_true > 2).long()
+    group_metrics, group_counts, worst = metric_cls(average=average).compute_group_wise(
+        y_pred, y_true, g, 3, return_dict=False)
+    expected = []
+    for group in range(3):
+        mask = g == group
+        # the sklearn-based metrics restricted the labels to those in y_true
+        expected.append(sklearn_fn(y_true[mask].numpy(), y_pred[mask].numpy(), average=average,
+                                   labels=torch.unique(y_true[mask]).numpy(), zero_division=0))
+    assert group_metrics.tolist() == pytest.approx(expected)
+    assert group_counts.tolist() == torch.bincount(g, minlength=3).tolist()
+    assert float(worst) == pytest.approx(min(expected))
+
+    # the same from batches, whose confusion matrices have inferred sizes
+    accumulator = metric_cls(average=average).accumulator(3)
+    for batch in torch.arange(len(g)).split(50):
+        accumulator.update(y_pred[batch], y_true[batch], g[batch])
+    assert accumulator.finalize(return_dict=False)[0].tolist() == pytest.approx(expected)
+
+
+def test_pearson_correlation_matches_scipy():
+    generator = torch.Generator().manual_seed(0)
+    y_true = torch.randn(500, 1, generator=generator, dtype=torch.double) * 3 + 100
+    y_pred = 0.7 * y_true + torch.randn(500, 1, generator=generator, dtype=torch.double)
+    g = torch.randint(4, (500, ), generator=generator)
+    expected = [scipy.stats.pearsonr(y_pred[g == group, 0].numpy(), y_true[g == group, 0].numpy())[0]
+                for group in range(4)]
+
+    metric = PearsonCorrelation()
+    group_metrics, _, worst = metric.compute_group_wise(y_pred, y_true, g, 4, return_dict=False)
+    assert group_metrics.tolist() == pytest.approx(expected)
+    assert float(worst) == pytest.approx(min(expected))
+    overall = scipy.stats.pearsonr(y_pred[:, 0].numpy(), y_true[:, 0].numpy())[0]
+    assert float(metric.compute(y_pred, y_true, return_dict=False)) == pytest.approx(overall)
+
+    # merged batch statistics (Chan et al.) agree with a single pass
+    accumulator = metric.accumulator(4)
+    for batch in torch.arange(500).split(64):
+        accumulator.update(y_pred[batch], y_true[batch], g[batch])
+    assert accumulator.finalize(return_dict=False)[0].tolist() == pytest.approx(expected)
+
+
+def test_confusion_matrix_scores_match_sklearn():
+    y_pred, y_true, _ = _random_labels(n=1000)
+    # small chunks exercise the chunked bincount
+    matrix = confusion_matrix(y_true.view(10, 100), y_pred.view(10, 100), 5, chunk_size=64)
+    assert matrix.tolist() == sklearn.metrics.confusion_matrix(y_true.numpy(), y_pred.numpy(), labels=range(5)).tolist()
+
+    for average in ['macro', 'micro', 'weighted', None]:
+        scores = classification_scores(matrix, average=average)
+        expected = sklearn.metrics.precision_recall_fscore_support(
+            y_true.numpy(), y_pred.numpy(), average=average, zero_division=0)[:3]
+        for score, expected_score in zip(scores, expected):
+            assert np.asarray(score.tolist()) == pytest.approx(np.asarray(expected_score))
+    assert accuracy_from_confusion(matrix).item() == pytest.approx(sklearn.metrics.accuracy_score(y_true.numpy(), y_pred.numpy()))
+    assert iou_from_confusion(matrix).tolist() == pytest.approx(
+        sklearn.metrics.jaccard_score(y_true.numpy(), y_pred.numpy(), average=None).tolist())
+
+
+def test_threshold_sweep_matches_sklearn():
+    generator = torch.Generator().manual_seed(0)
+    y_true = torch.randint(2, (400, ), generator=generator)
+    # rounded scores have many ties, within and across the classes
+    y_score = ((torch.rand(400, generator=generator, dtype=torch.double) + 0.5 * y_true) * 10).round() / 10
+    g = torch.randint(3, (400, ), generator=generator)
+    recalls = [20, 60, 90, 100]
+    sweep = ThresholdSweep(y_score, y_true, g, 3)
+
+    expected_auc = [sklearn.metrics.roc_auc_score(y_true[g == group].numpy(), y_score[g == group].numpy())
+                    for group in range(3)]
+    assert sweep.auc().tolist() == pytest.approx(expected_auc)
+    assert ThresholdSweep(y_score, y_true).auc().tolist() == pytest.approx(
+        [sklearn.metrics.roc_auc_score(y_true.numpy(), y_score.numpy())])
+
+    global_thresholds = [threshold_at_recall(y_score.numpy(), y_true.numpy(), recall) for recall in recalls]
+    assert sweep.global_threshold_at_recall(recalls).tolist() == pytest.approx(global_thresholds)
+    group_thresholds = [[threshold_at_recall(y_score[g == group].numpy(), y_true[g == group].numpy(), recall)
+                         for recall in recalls] for group in range(3)]
+    assert sweep.threshold_at_recall(recalls).numpy() == pytest.approx(np.asarray(group_thresholds))
+
+    for global_threshold, thresholds in [(True, [global_thresholds] * 3), (False, group_thresholds)]:
+        expected = [[sklearn.metrics.precision_score(y_true[g == group].numpy(),
+                                                     (y_score[g == group] > threshold).numpy(), zero_division=0)
+                     for threshold in thresholds[group]] for group in range(3)]
+        assert sweep.precision_at_recall(recalls, global_threshold=global_threshold).numpy() == pytest.approx(np.asarray(expected))
+
+    # the metric evaluated by BrickKilnDataset agrees with the sweep
+    metric = PrecisionAtRecall.at_global_recall(y_score, y_true, global_recall=60)
+    group_metrics = metric.compute_group_wise(y_score, y_true, g, 3, return_dict=False)[0]
+    assert group_metrics.tolist() == pytest.approx(sweep.precision_at_recall(60)[:, 0].tolist())
+
+
+def _naive_bootstrap(metric, y_pred, y_true, g, n_groups, idxs):
+    agg_metrics, group_metrics, worst_group_metrics = [], [], []
+    for idx in idxs:
+        agg_metrics.append(float(metric.compute(y_pred[idx], y_true[idx], return_dict=False)))
+        metrics = []
+        for group in range(n_groups):
+            mask = g[idx] == group
+            if mask.any():
+                metrics.append(float(metric.compute(y_pred[idx][mask], y_true[idx][mask], return_dict=False)))
+            else:
+                metrics.append(float('nan'))
+        group_metrics.append(metrics)
+        worst_group_metrics.append(float(metric.worst(torch.tensor([m for m in metrics if not np.isnan(m)]))))
+    return np.asarray(agg_metrics), np.asarray(group_metrics), np.asarray(worst_group_metrics)
+
+
+@pytest.mark.parametrize('metric, regression', [
+    (Accuracy(), False),
+    (F1(average='macro'), False),
+    (MSE(), True),
+    (PearsonCorrelation(), True),
+])
+def test_bootstrap_matches_naive_resampling(metric, regression):
+    generator = torch.Generator().manual_seed(0)
+    n, n_groups, n_bootstrap = 80, 3, 40
+    if regression:
+        y_true = torch.randn(n, 1, generator=generator, dtype=torch.double)
+        y_pred = y_true + torch.randn(n, 1, generator=generator, dtype=torch.double)
+    else:
+        y_pred, y_true, _ = _random_labels(n=n)
+    # group 2 has a single data point, which many replicates do not draw
+    g = torch.zeros(n, dtype=torch.long)
+    g[n // 2:] = 1
+    g[-1] = 2
+
+    agg_metrics, group_metrics, worst_group_metrics = metric.bootstrap_group_wise(
+        y_pred, y_true, g, n_groups, n_bootstrap=n_bootstrap, seed=5)
+    # all replicates are drawn at once with the default chunk_size
+    idxs = torch.randint(n, (n_bootstrap, n), generator=torch.Generator().manual_seed(5))
+    expected = _naive_bootstrap(metric, y_pred, y_true, g, n_groups, idxs)
+    assert np.isnan(expected[1][:, 2]).any()
+
+    assert agg_metrics.numpy() == pytest.approx(expected[0])
+    assert group_metrics.numpy() == pytest.approx(expected[1], nan_ok=True)
+    assert worst_group_metrics.numpy() == pytest.approx(expected[2])
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import torch
+
+from benchmarks import fixtures
+from sustainbench.common.data_loaders import get_train_loader
+from sustainbench.datasets.poverty_dataset import PovertyMapDataset, prepare_memmap_store
+
+
+@pytest.fixture
+def poverty_dir(tmp_path):
+    fixtures.write_poverty_fixture(str(tmp_path), n_images=12, img_dim=8)
+    with fixtures.poverty_folds():
+        yield str(tmp_path)
+
+
+@pytest.mark.parametrize('no_nl', [False, True])
+def test_memmap_items_are_not_aliased(poverty_dir, no_nl):
+    prepare_memmap_store(poverty_dir, items_per_shard=5)
+    dataset = PovertyMapDataset(root_dir=poverty_dir, storage='memmap', no_nl=no_nl, cache_size=0)
+    reference = PovertyMapDataset(root_dir=poverty_dir, no_nl=no_nl, cache_size=0)
+
+    x = dataset.get_input(3)
+    assert torch.equal(x, reference.get_input(3))
+    x.mul_(10)
+    assert torch.equal(dataset.get_input(3), reference.get_input(3))
+    if no_nl:
+        # zeroing the nightlights band must not write to the mapped shard
+        assert np.any(np.asarray(dataset._image_store[3][-1]) != 0)
+
+
+class CacheStatsDataset(PovertyMapDataset):
+    # reports the cache of the worker that loaded each item in place of the metadata
+    def __getitem__(self, idx):
+        x, y, _ = super().__getitem__(idx)
+        return x, y, torch.tensor(self.cache_info()['hits'])
+
+
+def test_cache_hits_carry_across_epochs(poverty_dir):
+    dataset = CacheStatsDataset(root_dir=poverty_dir, cache_size=64)
+    loader = get_train_loader('standard', dataset, batch_size=4, num_workers=1)
+    assert loader.persistent_workers
+
+    hits = [torch.cat([batch_hits for _, _, batch_hits in loader]).max().item() for _ in range(2)]
+    # the first epoch decodes every image once, the second one only reads the cache
+    assert hits == [0, len(dataset)]
+
+
+def test_workers_persist_only_for_cached_datasets(poverty_dir):
+    cached = PovertyMapDataset(root_dir=poverty_dir, cache_size=64)
+    uncached = PovertyMapDataset(root_dir=poverty_dir)
+    assert get_train_loader('standard', cached.get_subset('test'), batch_size=4, num_workers=1).persistent_workers
+    assert not get_train_loader('standard', uncached, batch_size=4, num_workers=1).persistent_workers
+    assert not get_train_loader('standard', cached, batch_size=4).persistent_workers
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from benchmarks import fixtures
+from sustainbench.datasets.brickkiln_dataset import BrickKilnDataset
+from sustainbench.datasets.crop_yield_dataset import CropYieldDataset
+
+
+def make_brick_kiln(tmp_path):
+    fixtures.write_brick_kiln_fixture(str(tmp_path), n_images=40, images_per_file=16, img_dim=8)
+    return BrickKilnDataset(root_dir=str(tmp_path))
+
+
+def test_plain_dataloader_collates_batched_reads(tmp_path):
+    dataset = make_brick_kiln(tmp_path)
+    loader = DataLoader(dataset, batch_size=8)
+    x, y, metadata = next(iter(loader))
+    assert x.shape == (8, 13, 8, 8)
+    assert y.shape == (8, )
+    for i in range(8):
+        item_x, item_y, item_metadata = dataset[i]
+        assert torch.equal(x[i], item_x)
+        assert y[i] == item_y
+        assert torch.equal(metadata[i], item_metadata)
+
+
+def test_plain_dataloader_on_subset(tmp_path):
+    dataset = make_brick_kiln(tmp_path)
+    subset = dataset.get_subset('train', transform=lambda x: x * 2)
+    x, y = next(iter(DataLoader(subset, batch_size=4)))
+    assert torch.equal(x[0], 2 * dataset[subset.indices[0]][0])
+    assert torch.equal(y, dataset.y_array[subset.indices[:4]])
+
+
+def test_batched_reads_match_items_on_transformed_subset(tmp_path):
+    fixtures.write_crop_yield_fixture(str(tmp_path), n_per_split=10, n_bins=4, n_timesteps=3, n_bands=2)
+    with fixtures.working_directory(str(tmp_path)):
+        dataset = CropYieldDataset(root_dir=os.path.join(str(tmp_path), 'data'))
+    # get_input returns arrays, so the transform can use the ndarray API
+    subset = dataset.get_subset('train', transform=lambda x: x.copy())
+    for i in [0, 3]:
+        (item_x, item_y), = subset.__getitems__([i])
+        x, y = subset[i]
+        assert isinstance(item_x, np.ndarray) and isinstance(x, np.ndarray)
+        assert type(item_y) is type(y)
+        assert np.array_equal(item_x, x)
+        assert item_y == y
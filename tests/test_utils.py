@@ -0,0 +1,12 @@
+import numpy as np
+import torch
+
+from sustainbench.common.utils import stable_argsort
+
+
+def test_stable_argsort_matches_numpy():
+    rng = np.random.default_rng(0)
+    for shape in [(1000, ), (500, 3)]:
+        g = rng.integers(0, 7, size=shape)
+        order = stable_argsort(torch.from_numpy(g))
+        assert np.array_equal(order.numpy(), np.argsort(g, axis=0, kind='stable'))